@@ -0,0 +1,119 @@
+"""
+Benchmark for product catalog queries (database.search_products).
+
+Generates a synthetic fertilizer/seed catalog in a scratch database (FTS
+index and triggers included) and times one page of results for typical
+marketplace queries: newest first, type and price filters, price sorts,
+one seller, full-text search for common and rare words, and a page deep
+in the listing reached by cursor versus by OFFSET. The old behaviour,
+reading and serializing the whole table, is timed for comparison.
+
+Run from the project root:
+    python -m benchmarks.catalog --products 500000 --repeat 50
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.measure import percentile, scratch_database
+
+TYPES = ['fertilizer', 'seed', 'pesticide', 'tool', 'organic', 'irrigation', 'sapling', 'feed']
+WORDS = ['urea', 'dap', 'potash', 'compost', 'vermicompost', 'hybrid', 'maize', 'rice', 'wheat', 'tomato',
+         'chilli', 'mustard', 'lentil', 'neem', 'organic', 'granular', 'liquid', 'sprayer', 'drip', 'pipe',
+         'seedling', 'mango', 'litchi', 'banana', 'cattle', 'poultry', 'premium', 'certified', 'local', 'imported']
+RARE_WORD = 'kiwifruit'
+PHRASES = ['Fresh stock from Chitwan', 'Suitable for terai and hills', 'Bulk discount available',
+           'Delivered within Bharatpur', 'Government certified quality', 'Best for monsoon planting']
+
+
+def generate(rng, count, sellers):
+    for i in range(count):
+        words = rng.sample(WORDS, 3)
+        if i % 50000 == 7:
+            words.append(RARE_WORD)
+        seller = rng.randint(1, sellers)
+        yield (seller, f'Seller {seller}', ' '.join(words).title(), round(rng.uniform(50, 20000), 2),
+               f'{" ".join(rng.sample(WORDS, 4))}. {rng.choice(PHRASES)}.', rng.choice(TYPES),
+               f'98{rng.randint(10000000, 99999999)}', rng.randint(0, 500))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=500000)
+    parser.add_argument('--sellers', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--deep-page', type=int, default=2000, help='page number for the cursor vs OFFSET test')
+    args = parser.parse_args()
+
+    with scratch_database() as database:
+        rng = random.Random(0)
+        began = time.perf_counter()
+        with database.get_db(write=True) as conn:
+            conn.executemany('''
+                INSERT INTO products (seller_id, seller_name, name, price, description, type, phone, views)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', generate(rng, args.products, args.sellers))
+        print(f'Inserted {args.products:,} products (indexes and FTS maintained by triggers) '
+              f'in {time.perf_counter() - began:.1f}s, database {os.path.getsize(database.DB_PATH) / 2**20:,.0f} MB '
+              f'(FTS5: {database.FTS_ENABLED})')
+
+        scenarios = {
+            'newest': dict(),
+            'type': dict(product_type='seed'),
+            'price range': dict(min_price=1000, max_price=1500),
+            'type + price asc': dict(sort='price_asc', product_type='fertilizer'),
+            'price desc': dict(sort='price_desc'),
+            'seller': dict(seller_id=42),
+            'search common': dict(query='hybrid rice'),
+            'search prefix': dict(query='vermi'),
+            'search rare': dict(query=RARE_WORD),
+            'search + type': dict(query='organic', product_type='fertilizer', sort='price_asc'),
+        }
+        print(f'One page of {args.limit}, {args.repeat} runs each:')
+        for name, kwargs in scenarios.items():
+            timings = []
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                rows = database.search_products(args.limit, **kwargs)
+                timings.append((time.perf_counter() - began) * 1000)
+            print(f'  {name:<18} p50 {percentile(timings, 50):8.2f} ms  p95 {percentile(timings, 95):8.2f} ms  '
+                  f'({len(rows)} rows)')
+
+        # Walk to a deep page with cursors, then time that page both ways. The
+        # page is clamped to the last one the catalog has.
+        deep_page = max(1, min(args.deep_page, -(-args.products // args.limit)))
+        after = None
+        for page in range(1, deep_page):
+            rows = database.search_products(args.limit, 'price_asc', after)
+            if not rows:
+                deep_page = page
+                break
+            after = (rows[-1]['price'], rows[-1]['id'])
+        began = time.perf_counter()
+        by_cursor = database.search_products(args.limit, 'price_asc', after)
+        cursor_ms = (time.perf_counter() - began) * 1000
+        began = time.perf_counter()
+        with database.get_db() as conn:
+            by_offset = [dict(row) for row in conn.execute(
+                'SELECT * FROM products ORDER BY price, id LIMIT ? OFFSET ?',
+                (args.limit, (deep_page - 1) * args.limit))]
+        offset_ms = (time.perf_counter() - began) * 1000
+        same = [r['id'] for r in by_cursor] == [r['id'] for r in by_offset]
+        print(f'Page {deep_page:,} by price: cursor {cursor_ms:.2f} ms, OFFSET {offset_ms:.2f} ms (same rows: {same})')
+
+        began = time.perf_counter()
+        with database.get_db() as conn:
+            everything = [dict(row) for row in conn.execute('SELECT * FROM products')]
+        payload = json.dumps(everything)
+        print(f'Whole catalog (before): {(time.perf_counter() - began) * 1000:,.0f} ms, '
+              f'{len(payload) / 2**20:,.0f} MB of JSON')
+
+        return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
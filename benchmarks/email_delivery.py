@@ -0,0 +1,143 @@
+"""
+Delivery benchmark for the email outbox worker in notifications.py.
+
+Starts a local SMTP stand-in (aiosmtpd, `pip install aiosmtpd`), queues
+alert emails into a scratch outbox and drains them with NotificationWorker,
+sampling queue depth while it runs. The stand-in can reject a fraction of
+messages with a transient 451 to exercise retries, and every message is
+queued twice to check per-recipient deduplication. For comparison the
+previous behaviour, one fresh SMTP session per message, is timed too.
+
+Run from the project root:
+    python -m benchmarks.email_delivery --messages 2000 --workers 4 --fail-rate 0.05
+"""
+import argparse
+import random
+import smtplib
+import sys
+import threading
+import time
+from email.mime.text import MIMEText
+
+from benchmarks.measure import scratch_database
+
+SENDER = 'alerts@example.com'
+
+
+class CountingHandler:
+    def __init__(self, fail_rate, seed=0):
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self.delivered = 0
+        self.rejected = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self.lock:
+            self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            if self.rng.random() < self.fail_rate:
+                self.rejected += 1
+                return '451 Temporary failure, try again'
+            self.delivered += 1
+        return '250 Message accepted for delivery'
+
+
+def start_smtp_server(handler, port):
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        sys.exit('This benchmark needs a local SMTP stand-in: pip install aiosmtpd')
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    return controller
+
+
+def alert_body(i):
+    return f'Disease: Late Blight\nAffected Crop: Tomato\nLocation: Ward {i % 50}\n'
+
+
+def run_per_message(port, count):
+    began = time.perf_counter()
+    for i in range(count):
+        message = MIMEText(alert_body(i))
+        message['Subject'] = 'Crop Disease Alert'
+        message['From'] = SENDER
+        message['To'] = f'farmer{i}@example.com'
+        with smtplib.SMTP('127.0.0.1', port) as server:
+            server.send_message(message)
+    return time.perf_counter() - began
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--fail-rate', type=float, default=0.05, help='fraction of DATA commands answered with 451')
+    parser.add_argument('--retry-base', type=float, default=0.05, help='first retry delay in seconds')
+    parser.add_argument('--baseline', type=int, default=200, help='messages to send one session each (0 to skip)')
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    with scratch_database():
+        from notifications import NotificationWorker, SMTPPool
+
+        handler = CountingHandler(args.fail_rate)
+        controller = start_smtp_server(handler, args.port)
+
+        pool = SMTPPool('127.0.0.1', args.port, starttls=False, size=args.pool_size, timeout_s=10)
+        worker = NotificationWorker(pool, SENDER, workers=args.workers, max_attempts=20,
+                                    retry_base_s=args.retry_base, retry_max_s=1, lease_s=30)
+
+        began = time.perf_counter()
+        queued = 0
+        for i in range(args.messages):
+            recipient = f'farmer{i}@example.com'
+            queued += worker.enqueue(recipient, 'Crop Disease Alert', alert_body(i))
+            worker.enqueue(recipient.upper(), 'Crop Disease Alert', alert_body(i))  # duplicate
+        enqueue_s = time.perf_counter() - began
+
+        samples = []
+        began = time.perf_counter()
+        worker.start()
+        while True:
+            stats = worker.stats()
+            samples.append(stats['queueDepth'])
+            if stats['queueDepth'] == 0:
+                break
+            time.sleep(0.05)
+        drain_s = time.perf_counter() - began
+        worker.stop()
+        stats = worker.stats()
+        delivered = handler.delivered
+
+        print(f'Queued {queued} messages in {enqueue_s:.2f}s ({queued / enqueue_s:,.0f}/s), '
+              f'{stats["deduplicated"]} duplicates dropped')
+        print(f'Delivered {delivered} in {drain_s:.2f}s ({delivered / drain_s:,.0f} msg/s) '
+              f'with {args.workers} workers')
+        print(f'  queue depth: start {samples[0]}, samples {len(samples)}, '
+              f'mean {sum(samples) / len(samples):,.0f}')
+        print(f'  transient rejections {handler.rejected}, retries {stats["retried"]}, failed {stats["failed"]}')
+        print(f'  SMTP sessions opened {stats["connectionsOpened"]}, reused {stats["connectionsReused"]} times')
+
+        if args.baseline:
+            handler.fail_rate = 0
+            baseline_s = run_per_message(args.port, args.baseline)
+            print(f'Per-message sessions: {args.baseline} in {baseline_s:.2f}s '
+                  f'({args.baseline / baseline_s:,.0f} msg/s, single caller)')
+
+        controller.stop()
+
+        # Every queued message must end up delivered exactly once or marked failed
+        accounted = stats['outbox'].get('sent', 0) + stats['outbox'].get('failed', 0)
+        return 0 if accounted == queued and stats['outbox'].get('sent', 0) == delivered else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
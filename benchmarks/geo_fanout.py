@@ -0,0 +1,117 @@
+"""
+Benchmark for matching disease reports to alert registrations (geoindex.py).
+
+Builds an AlertIndex over synthetic registrations spread across Nepal,
+mostly clustered around the towns in KNOWN_LOCATIONS, with mixed alert
+radii and one or two crops each. It then times report matches and checks
+a sample of them against a brute-force scan over every registration,
+which is also timed for comparison.
+
+Run from the project root:
+    python -m benchmarks.geo_fanout --registrations 1000000 --reports 2000
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+from geoindex import KM_PER_DEGREE_LAT, KNOWN_LOCATIONS, AlertIndex, haversine_km
+from benchmarks.measure import percentile, rss_mb
+
+LAT_RANGE = (26.4, 30.4)
+LON_RANGE = (80.1, 88.2)
+CROPS = ["rice", "wheat", "maize", "potato", "tomato", "millet", "mustard", "lentil", "sugarcane", "tea"]
+RADII_KM = [5, 10, 10, 15, 25, 50]
+
+
+def random_points(rng, count, cluster_share=0.7, spread_km=25):
+    towns = np.array(list(KNOWN_LOCATIONS.values()))
+    clustered = rng.random(count) < cluster_share
+    centres = towns[rng.integers(0, len(towns), count)]
+    lat = np.where(clustered, centres[:, 0] + rng.normal(0, spread_km / KM_PER_DEGREE_LAT, count),
+                   rng.uniform(*LAT_RANGE, count))
+    lon = np.where(clustered, centres[:, 1] + rng.normal(0, spread_km / (KM_PER_DEGREE_LAT * 0.88), count),
+                   rng.uniform(*LON_RANGE, count))
+    return lat, lon
+
+
+def make_registrations(rng, count):
+    lat, lon = random_points(rng, count)
+    radii = np.array(RADII_KM)[rng.integers(0, len(RADII_KM), count)]
+    first = rng.integers(0, len(CROPS), count)
+    second = rng.integers(0, len(CROPS), count)
+    two_crops = rng.random(count) < 0.4
+    crop_types = [f"{CROPS[a]}, {CROPS[b]}" if both else CROPS[a]
+                  for a, b, both in zip(first, second, two_crops)]
+    return lat, lon, radii, crop_types
+
+
+def brute_force(lat, lon, crop, reg_lat, reg_lon, reg_radius, reg_crops):
+    # Vectorised haversine over every registration
+    p1, p2 = np.radians(lat), np.radians(reg_lat)
+    a = (np.sin((p2 - p1) / 2) ** 2
+         + np.cos(p1) * np.cos(p2) * np.sin(np.radians(reg_lon - lon) / 2) ** 2)
+    dist = 2 * 6371.0088 * np.arcsin(np.sqrt(a))
+    near = np.nonzero(dist <= reg_radius)[0]
+    return {int(i) + 1 for i in near if crop in reg_crops[i]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registrations', type=int, default=1000000)
+    parser.add_argument('--reports', type=int, default=2000)
+    parser.add_argument('--verify', type=int, default=50, help='reports to check against brute force')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    reg_lat, reg_lon, reg_radius, crop_types = make_registrations(rng, args.registrations)
+
+    rss_before = rss_mb()
+    index = AlertIndex()
+    began = time.perf_counter()
+    for i in range(args.registrations):
+        index.add(i + 1, float(reg_lat[i]), float(reg_lon[i]), int(reg_radius[i]), crop_types[i])
+    build_s = time.perf_counter() - began
+    print(f'Indexed {args.registrations:,} registrations in {build_s:.1f}s '
+          f'({args.registrations / build_s:,.0f}/s), ~{rss_mb() - rss_before:,.0f} MB')
+    print(f'  cells per tier: {index.stats()["cells"]}')
+
+    report_lat, report_lon = random_points(rng, args.reports)
+    report_crops = [CROPS[i] for i in rng.integers(0, len(CROPS), args.reports)]
+
+    timings = []
+    matched = []
+    for lat, lon, crop in zip(report_lat, report_lon, report_crops):
+        began = time.perf_counter()
+        matches = index.match(float(lat), float(lon), crop)
+        timings.append((time.perf_counter() - began) * 1000)
+        matched.append(len(matches))
+
+    print(f'Matched {args.reports:,} reports: p50 {percentile(timings, 50):.2f} ms, '
+          f'p95 {percentile(timings, 95):.2f} ms, p99 {percentile(timings, 99):.2f} ms, '
+          f'max {max(timings):.2f} ms')
+    print(f'  farmers per report: mean {np.mean(matched):,.0f}, max {max(matched):,}')
+
+    reg_crops = [set(c.strip() for c in crops.split(',')) for crops in crop_types]
+    brute_timings = []
+    mismatches = 0
+    for lat, lon, crop in list(zip(report_lat, report_lon, report_crops))[:args.verify]:
+        began = time.perf_counter()
+        expected = brute_force(lat, lon, crop, reg_lat, reg_lon, reg_radius, reg_crops)
+        brute_timings.append((time.perf_counter() - began) * 1000)
+        got = set(index.match(float(lat), float(lon), crop))
+        if got != expected:
+            # Points within rounding distance of a radius edge may differ
+            edge = {r for r in got ^ expected
+                    if abs(haversine_km(lat, lon, reg_lat[r - 1], reg_lon[r - 1]) - reg_radius[r - 1]) > 1e-6}
+            mismatches += bool(edge)
+
+    if brute_timings:
+        print(f'Brute-force scan (numpy): p50 {percentile(brute_timings, 50):.1f} ms per report; '
+              f'{mismatches} of {len(brute_timings)} verified reports disagree')
+    return 0 if mismatches == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
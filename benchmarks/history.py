@@ -0,0 +1,99 @@
+"""
+Benchmark for detection history reads (database.get_user_detection_history).
+
+Fills a scratch database with synthetic scan records for many users,
+including a few heavy users, and times one page of history for users of
+different history sizes, a deep page reached by cursor, and the old
+behaviour of reading a user's whole history. It also measures the
+NDJSON export of the heaviest user, streamed through the app.
+
+Run from the project root:
+    python -m benchmarks.history --records 1000000 --users 5000 --heavy 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.measure import percentile, scratch_database
+
+
+def records(rng, total, users, heavy):
+    start = datetime(2024, 1, 1)
+    for i in range(total):
+        # The first `heavy` records belong to user 1, the rest are spread out
+        user_id = 1 if i < heavy else rng.randint(2, users)
+        timestamp = (start + timedelta(seconds=i * 7)).isoformat()
+        yield user_id, f'{rng.getrandbits(256):064x}', rng.choice(['healthy', 'diseased']), rng.random(), timestamp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--heavy', type=int, default=100000, help='records belonging to user 1')
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    os.environ.setdefault('MODEL_LOAD_MODE', 'lazy')
+    with scratch_database() as database:
+        rng = random.Random(0)
+        began = time.perf_counter()
+        with database.get_db(write=True) as conn:
+            conn.executemany('''
+                INSERT INTO detection_history (user_id, image, image_id, prediction, confidence, timestamp)
+                VALUES (?, '', ?, ?, ?, ?)
+            ''', records(rng, args.records, args.users, args.heavy))
+        print(f'Inserted {args.records:,} records for {args.users:,} users in {time.perf_counter() - began:.1f}s '
+              f'(user 1 has {args.heavy:,})')
+
+        def timed(fn):
+            timings = []
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                result = fn()
+                timings.append((time.perf_counter() - began) * 1000)
+            return timings, result
+
+        typical_user = 2
+        for name, fn in (
+            ('page, typical user', lambda: database.get_user_detection_history(typical_user, args.limit)),
+            ('page, heavy user', lambda: database.get_user_detection_history(1, args.limit)),
+            ('whole history, typical (before)', lambda: database.get_user_detection_history(typical_user)),
+        ):
+            timings, rows = timed(fn)
+            print(f'  {name:<34} p50 {percentile(timings, 50):8.2f} ms  p95 {percentile(timings, 95):8.2f} ms  '
+                  f'({len(rows):,} rows)')
+
+        last = database.get_user_detection_history(1, args.heavy // 2)[-1]
+        timings, rows = timed(lambda: database.get_user_detection_history(1, args.limit, (last['timestamp'], last['id'])))
+        print(f'  {"page at depth " + format(args.heavy // 2, ","):<34} p50 {percentile(timings, 50):8.2f} ms  '
+              f'p95 {percentile(timings, 95):8.2f} ms')
+
+        began = time.perf_counter()
+        everything = database.get_user_detection_history(1)
+        print(f'  {"whole history, heavy (before)":<34} {(time.perf_counter() - began) * 1000:8.0f} ms  '
+              f'({len(everything):,} rows)')
+
+        import main as app_module
+        from fastapi.testclient import TestClient
+        with TestClient(app_module.app) as client:
+            began = time.perf_counter()
+            lines = 0
+            size = 0
+            with client.stream('GET', '/api/detection-history/1/export') as response:
+                for line in response.iter_lines():
+                    lines += bool(line)
+                    size += len(line) + 1
+            export_s = time.perf_counter() - began
+        print(f'NDJSON export of user 1: {lines:,} records, {size / 2**20:,.1f} MB in {export_s:.2f}s '
+              f'({lines / export_s:,.0f} records/s)')
+
+        return 0 if lines == args.heavy else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
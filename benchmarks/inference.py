@@ -0,0 +1,281 @@
+"""
+Benchmark for model inference: preprocessing plus the forward pass, per
+model variant, thread setting and batch size, on CPU.
+
+Each variant (plant.keras, a SavedModel export, the TFLite and ONNX
+exports from export_model.py) runs once per thread setting, in its own
+subprocess. That way the runtime's thread pools are configured before
+they start, and cold start and peak RSS are measured from a clean
+process. A batch is timed the way the server runs it:
+preprocess_image_bytes on each photo, stacked into one float32 batch,
+then the forward pass.
+
+Per configuration it reports:
+- cold start: runtime import, model load and the first prediction
+- per batch size: images/sec and p50/p95/p99 batch latency
+- peak RSS
+
+Every configuration also scores the same evaluation images. Scores are
+compared with the first configuration (plant.keras by default), and
+DRIFT is flagged when any score moves by more than --drift-tolerance or
+a diseased/healthy call changes. Pass --data-dir (the export_model.py
+layout) to score real held-out photos and report accuracy; otherwise
+synthetic leaf photos are used.
+
+Run from the project root:
+    python -m benchmarks.inference --batch-sizes 1,4,8,16 --threads 0,1,2,4
+    python -m benchmarks.inference --models plant.keras plant_int8.tflite --output nodes.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+
+from benchmarks.measure import percentile, rss_mb
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODELS = ('plant.keras', 'plant_savedmodel', 'plant_float16.tflite', 'plant_int8.tflite', 'plant.onnx')
+BACKEND_BY_EXTENSION = {'.keras': 'keras', '.h5': 'keras', '.tflite': 'tflite', '.onnx': 'onnx'}
+
+
+def parse_ints(text):
+    return [int(part) for part in text.split(',') if part.strip()]
+
+
+def backend_for(path):
+    if os.path.isdir(path):
+        return 'savedmodel'
+    return BACKEND_BY_EXTENSION.get(os.path.splitext(path)[1].lower(), 'keras')
+
+
+def sample_photos(count, seed, size):
+    from benchmarks.loadtest import leaf_photo
+    rng = random.Random(seed)
+    return [leaf_photo(rng, size, diseased=i % 2 == 0) for i in range(count)]
+
+
+def evaluation_set(args):
+    """Preprocessed float32 images, plus labels when real data is given."""
+    if args.data_dir:
+        from export_model import load_dataset
+        images, labels = load_dataset(args.data_dir, args.eval_images // 2)
+        return images, labels
+    from inference import preprocess_image_bytes
+    photos = sample_photos(args.eval_images, args.seed + 1, (args.width, args.height))
+    return np.stack([preprocess_image_bytes(photo) for photo in photos]).astype(np.float32), None
+
+
+def run_config(args):
+    """Child process: benchmark one model at one thread setting."""
+    baseline_rss = rss_mb('VmRSS')
+    started = time.perf_counter()
+    from inference import IMAGE_SIZE, load_backend, preprocess_image_bytes
+
+    backend = load_backend(args.backend, args.model)
+    loaded = time.perf_counter()
+    load_rss = rss_mb('VmRSS')
+    backend.predict(np.zeros((1,) + IMAGE_SIZE + (3,), dtype=np.float32))
+    cold_start = {
+        **getattr(backend, 'timings', {}),
+        'firstPredict': time.perf_counter() - loaded,
+        'total': time.perf_counter() - started,
+    }
+
+    photos = sample_photos(max(args.batch_sizes), args.seed, (args.width, args.height))
+    buffer = np.empty((max(args.batch_sizes),) + IMAGE_SIZE + (3,), dtype=np.float32)
+
+    def run_batch(size):
+        began = time.perf_counter()
+        batch = np.stack([preprocess_image_bytes(photo) for photo in photos[:size]], out=buffer[:size])
+        prepared = time.perf_counter()
+        backend.predict(batch)
+        return prepared - began, time.perf_counter() - prepared
+
+    batches = []
+    for size in args.batch_sizes:
+        for _ in range(args.warmup):
+            run_batch(size)  # graph retracing and allocator growth for a new shape
+        prepare_s, forward_s, total_s = [], [], []
+        for _ in range(args.iterations):
+            prepare, forward = run_batch(size)
+            prepare_s.append(prepare)
+            forward_s.append(forward)
+            total_s.append(prepare + forward)
+        batches.append({
+            'batchSize': size,
+            'imagesPerSec': size * len(total_s) / sum(total_s),
+            'p50Ms': percentile(total_s, 50) * 1000,
+            'p95Ms': percentile(total_s, 95) * 1000,
+            'p99Ms': percentile(total_s, 99) * 1000,
+            'prepareMs': sum(prepare_s) / len(prepare_s) * 1000,
+            'forwardMs': sum(forward_s) / len(forward_s) * 1000,
+        })
+
+    images, labels = evaluation_set(args)
+    scores = np.concatenate([
+        np.asarray(backend.predict(images[i:i + 8])).reshape(-1) for i in range(0, len(images), 8)
+    ]) if len(images) else np.zeros((0,))
+
+    return {
+        'coldStartS': cold_start,
+        'batches': batches,
+        'loadRssMb': load_rss - baseline_rss,
+        'peakRssMb': rss_mb('VmHWM'),
+        'scores': scores.tolist(),
+        'accuracy': float(np.mean((scores >= 0.5) == labels)) if labels is not None and len(labels) else None,
+    }
+
+
+def spawn_config(args, model, threads, inter_op):
+    env = dict(os.environ, INFERENCE_THREADS=str(threads), INFERENCE_INTER_OP_THREADS=str(inter_op))
+    command = [
+        sys.executable, '-m', 'benchmarks.inference', '--child',
+        '--models', model, '--batch-sizes', ','.join(map(str, args.batch_sizes)),
+        '--iterations', str(args.iterations), '--warmup', str(args.warmup),
+        '--width', str(args.width), '--height', str(args.height),
+        '--eval-images', str(args.eval_images), '--seed', str(args.seed),
+    ]
+    if args.data_dir:
+        command += ['--data-dir', args.data_dir]
+    result = {'model': os.path.basename(model.rstrip('/')), 'backend': backend_for(model),
+              'threads': threads, 'interOpThreads': inter_op}
+    process = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    try:
+        result.update(json.loads(process.stdout.strip().splitlines()[-1]))
+    except (IndexError, ValueError):
+        lines = (process.stderr or process.stdout).strip().splitlines()
+        result['error'] = lines[-1] if lines else f'exited with {process.returncode}'
+    return result
+
+
+def compare_scores(reference, result, tolerance):
+    ours, theirs = np.array(result['scores']), np.array(reference['scores'])
+    if len(ours) != len(theirs) or not len(ours):
+        return None
+    diff = np.abs(ours - theirs)
+    drift = {
+        'maxAbsDiff': float(diff.max()),
+        'meanAbsDiff': float(diff.mean()),
+        'agreement': float(np.mean((ours >= 0.5) == (theirs >= 0.5))),
+    }
+    drift['flagged'] = drift['maxAbsDiff'] > tolerance or drift['agreement'] < 1.0
+    return drift
+
+
+def label(result):
+    threads = 'default' if not result['threads'] else str(result['threads'])
+    if result['interOpThreads']:
+        threads += f"/{result['interOpThreads']}"
+    return f"{result['model']} [{threads}]"
+
+
+def print_report(results, reference):
+    print(f"{'configuration':<36}{'batch':>6}{'img/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'prep ms':>9}{'fwd ms':>9}")
+    for result in results:
+        if 'error' in result:
+            print(f"{label(result):<36} skipped: {result['error']}")
+            continue
+        for i, batch in enumerate(result['batches']):
+            name = label(result) if i == 0 else ''
+            print(f"{name:<36}{batch['batchSize']:>6}{batch['imagesPerSec']:>9.1f}{batch['p50Ms']:>9.1f}"
+                  f"{batch['p95Ms']:>9.1f}{batch['p99Ms']:>9.1f}{batch['prepareMs']:>9.1f}{batch['forwardMs']:>9.1f}")
+
+    print(f"\n{'configuration':<36}{'cold start s':>13}{'load s':>9}{'1st pred s':>11}{'model MB':>10}"
+          f"{'peak RSS MB':>13}  drift vs {label(reference) if reference else '-'}")
+    for result in results:
+        if 'error' in result:
+            continue
+        cold = result['coldStartS']
+        drift = result.get('drift')
+        if drift is None:
+            drift_text = 'reference' if result is reference else 'n/a'
+        else:
+            drift_text = (f"max {drift['maxAbsDiff']:.4f}, agree {drift['agreement']:.1%}"
+                          + ('  DRIFT' if drift['flagged'] else ''))
+        if result.get('accuracy') is not None:
+            drift_text += f", accuracy {result['accuracy']:.4f}"
+        print(f"{label(result):<36}{cold['total']:>13.2f}{cold.get('load', 0):>9.2f}{cold['firstPredict']:>11.3f}"
+              f"{result['loadRssMb']:>10.1f}{result['peakRssMb']:>13.1f}  {drift_text}")
+
+    usable = [r for r in results if 'error' not in r and not (r.get('drift') or {}).get('flagged')]
+    if usable:
+        best = max(((r, b) for r in usable for b in r['batches']), key=lambda pair: pair[1]['imagesPerSec'])
+        smallest = min(b['batchSize'] for r in usable for b in r['batches'])
+        fastest = min(((r, b) for r in usable for b in r['batches'] if b['batchSize'] == smallest),
+                      key=lambda pair: pair[1]['p50Ms'])
+        print(f"\nHighest throughput without drift: {label(best[0])} at batch {best[1]['batchSize']} "
+              f"({best[1]['imagesPerSec']:.1f} img/s)")
+        print(f"Lowest latency without drift: {label(fastest[0])} at batch {fastest[1]['batchSize']} "
+              f"(p50 {fastest[1]['p50Ms']:.1f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', nargs='*',
+                        help='model files or SavedModel directories (default: whichever exports exist)')
+    parser.add_argument('--batch-sizes', type=parse_ints, default=[1, 2, 4, 8, 16])
+    parser.add_argument('--threads', type=parse_ints, default=[0],
+                        help='intra-op thread counts to try; 0 leaves the runtime default')
+    parser.add_argument('--inter-op-threads', type=parse_ints, default=[0],
+                        help='inter-op thread counts to try (TensorFlow and ONNX Runtime only)')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--width', type=int, default=1280, help='sample photo size')
+    parser.add_argument('--height', type=int, default=960)
+    parser.add_argument('--eval-images', type=int, default=64, help='images scored to check drift')
+    parser.add_argument('--data-dir', help='held-out photos, one sub-directory per class')
+    parser.add_argument('--drift-tolerance', type=float, default=0.02, help='max allowed score difference')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.model = args.models[0]
+        args.backend = backend_for(args.model)
+        print(json.dumps(run_config(args)))
+        return 0
+
+    models = args.models or [name for name in DEFAULT_MODELS if os.path.exists(os.path.join(ROOT, name))]
+    if not models:
+        print('No models found; pass --models or run export_model.py first', file=sys.stderr)
+        return 1
+    models = [os.path.abspath(model) for model in models]
+    missing = [model for model in models if not os.path.exists(model)]
+    if missing:
+        print(f"Not found: {', '.join(missing)}", file=sys.stderr)
+        return 1
+
+    results = []
+    for model in models:
+        for threads in args.threads:
+            for inter_op in args.inter_op_threads:
+                result = spawn_config(args, model, threads, inter_op)
+                print(f"  {label(result)}: {'failed' if 'error' in result else 'done'}", file=sys.stderr)
+                results.append(result)
+
+    reference = next((r for r in results if 'error' not in r), None)
+    for result in results:
+        if reference is not None and 'error' not in result and result is not reference:
+            result['drift'] = compare_scores(reference, result, args.drift_tolerance)
+
+    print(f"\nCPU: {os.cpu_count()} cores; {args.width}x{args.height} JPEGs; "
+          f"{args.iterations} iterations per batch size after {args.warmup} warm-up\n")
+    print_report(results, reference)
+
+    if args.output:
+        for result in results:
+            result.pop('scores', None)
+        with open(args.output, 'w') as f:
+            json.dump({'config': {k: v for k, v in vars(args).items() if k != 'child'}, 'results': results}, f, indent=2)
+        print(f"\nWrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
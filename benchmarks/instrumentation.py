@@ -0,0 +1,104 @@
+"""
+Benchmark for the cost of the built-in metrics (metrics.py).
+
+Times the primitives on the request path (a histogram observation, a
+counter increment, a stage timer), one pass through MetricsMiddleware
+around a trivial ASGI app, and a SQLite read through database.get_db()
+(which times itself) against the same statement on the bare connection.
+Finally it fills the registry with a realistic number of route series,
+then times rendering /metrics and reports its size.
+
+Run from the project root:
+    python -m benchmarks.instrumentation --iterations 200000
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks.measure import scratch_database
+
+
+def per_call_ns(fn, iterations):
+    began = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - began) / iterations * 1e9
+
+
+async def bare_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def asgi_call_ns(app, iterations):
+    scope = {"type": "http", "method": "GET", "path": "/api/health"}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    async def run():
+        began = time.perf_counter()
+        for _ in range(iterations):
+            await app(scope, receive, send)
+        return (time.perf_counter() - began) / iterations * 1e9
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--routes', type=int, default=60, help='route series to create before rendering')
+    args = parser.parse_args()
+
+    with scratch_database() as database:
+        from metrics import MetricsMiddleware, Registry
+
+        registry = Registry(prefix='bench_')
+        histogram = registry.histogram('latency_seconds', 'x', labels=('stage',))
+        counter = registry.counter('events_total', 'x', labels=('kind',))
+        n = args.iterations
+
+        print(f'{n:,} iterations each:')
+        results = [
+            ('histogram observe', per_call_ns(lambda: histogram.observe(0.003, 'forward'), n)),
+            ('counter inc', per_call_ns(lambda: counter.inc('hit'), n)),
+            ('stage timer', per_call_ns(lambda: histogram.time('resize').__enter__().__exit__(), n)),
+        ]
+        bare = asgi_call_ns(bare_app, n // 4)
+        wrapped = asgi_call_ns(MetricsMiddleware(bare_app, registry), n // 4)
+        results.append(('ASGI request, middleware cost', wrapped - bare))
+
+        conn = database.get_connection()
+
+        def timed_read():
+            with database.get_db() as db:
+                db.execute('SELECT 1').fetchone()
+
+        raw = per_call_ns(lambda: conn.execute('SELECT 1').fetchone(), n)
+        results.append(('get_db() read vs bare execute', per_call_ns(timed_read, n) - raw))
+        for name, ns in results:
+            print(f'  {name:<32} {ns:8.0f} ns')
+        print(f'  (bare ASGI call {bare:,.0f} ns, bare SELECT 1 {raw:,.0f} ns)')
+
+        middleware = MetricsMiddleware(bare_app, registry)
+        for i in range(args.routes):
+            for status in (200, 304, 404, 500):
+                middleware.latency.observe(0.01, 'GET', f'/api/route/{i}/{{id}}', status)
+        began = time.perf_counter()
+        repeat = 50
+        for _ in range(repeat):
+            text = registry.render()
+        render_ms = (time.perf_counter() - began) / repeat * 1000
+        series = sum(1 for line in text.splitlines() if not line.startswith('#'))
+        print(f'/metrics render: {render_ms:.2f} ms for {series:,} samples ({len(text) / 1024:,.0f} KB)')
+
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,500 @@
+"""
+Load test for the whole API, served by uvicorn exactly as in production.
+
+Generates a synthetic dataset in a scratch directory: users with plenty
+of tokens, a product catalog, disease reports, alert registrations, scan
+history, and leaf photos drawn locally with PIL. It then starts
+`uvicorn main:app` against that data and drives it with a mixed
+workload from concurrent closed-loop clients. Nothing is fetched from
+the network. Scenarios:
+
+    login    POST /api/users/login
+    scan     POST /api/users/{id}/scan (raw JPEG leaf photo)
+    history  GET  /api/detection-history/{id}
+    browse   GET  /api/products (newest, type filter, search, next page)
+    report   POST /api/report-disease
+    alerts   GET  /api/recent-alerts
+
+For each scenario and overall, the run reports throughput, errors and
+p50/p95/p99 latency. It also samples the server's peak and final RSS
+and takes a few figures from /metrics. Results are written as JSON
+(--output) and can be diffed against an earlier run (--compare).
+The data and each client's request sequence are seeded, so two runs at
+the same settings issue the same mix of requests.
+
+Every scan sends a photo the server has not seen, unless
+--repeat-photos is given. Scans need the model (plant.keras, or MODEL_PATH). If it does not
+load, scan is dropped from the mix with a warning.
+
+Run from the project root:
+    python -m benchmarks.loadtest --concurrency 32 --duration 60 --output before.json
+    python -m benchmarks.loadtest --concurrency 32 --duration 60 --compare before.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.measure import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ('login', 'scan', 'history', 'browse', 'report', 'alerts')
+DEFAULT_MIX = 'login=15,scan=10,history=20,browse=40,report=5,alerts=10'
+
+PRODUCT_TYPES = ['fertilizer', 'seed', 'pesticide', 'tool', 'organic', 'irrigation']
+PRODUCT_WORDS = ['urea', 'dap', 'potash', 'compost', 'hybrid', 'maize', 'rice', 'wheat', 'tomato',
+                 'mustard', 'neem', 'organic', 'granular', 'liquid', 'sprayer', 'drip', 'premium']
+SEARCH_TERMS = ['rice', 'organic', 'comp', 'hybrid maize', 'sprayer', 'neem']
+DISEASES = ['Late Blight', 'Leaf Rust', 'Powdery Mildew', 'Bacterial Wilt', 'Leaf Spot']
+CROPS = ['rice', 'wheat', 'maize', 'tomato', 'potato', 'mustard']
+LOCATIONS = ['Bharatpur', 'Ratnanagar', 'Khairahani', 'Madi', 'Rapti', 'Kalika', 'Ichchhakamana']
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name!r}; expected one of {", ".join(SCENARIOS)}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# --- Synthetic Data ---
+
+def leaf_photo(rng, size=(640, 480), diseased=False):
+    """A green leaf on soil, with brown lesions when diseased, as a JPEG."""
+    from PIL import Image, ImageDraw, ImageFilter
+    width, height = size
+    soil = tuple(rng.randint(70, 110) for _ in range(3))
+    img = Image.new('RGB', size, soil)
+    draw = ImageDraw.Draw(img)
+    green = (rng.randint(40, 90), rng.randint(120, 190), rng.randint(30, 70))
+    cx, cy = width // 2 + rng.randint(-40, 40), height // 2 + rng.randint(-30, 30)
+    rx, ry = rng.randint(width // 4, width // 3), rng.randint(height // 5, height // 3)
+    draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry), fill=green)
+    draw.line((cx - rx, cy, cx + rx, cy), fill=(green[0] + 40, green[1] + 40, green[2] + 20), width=4)
+    if diseased:
+        for _ in range(rng.randint(5, 25)):
+            x, y, r = cx + rng.randint(-rx, rx) * 3 // 4, cy + rng.randint(-ry, ry) * 3 // 4, rng.randint(4, 18)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=(rng.randint(90, 140), rng.randint(60, 90), 30))
+    img = img.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def generate_data(args, scratch):
+    """Fills a scratch database and blob store; returns what the clients need to know."""
+    os.environ['DATABASE_PATH'] = os.path.join(scratch, 'loadtest.db')
+    os.environ['BLOB_DIR'] = os.path.join(scratch, 'blobs')
+    sys.path.insert(0, ROOT)
+    import blobstore
+    import database
+
+    rng = random.Random(args.seed)
+    photos = [leaf_photo(rng, diseased=i % 2 == 1) for i in range(args.images)]
+    digests = [blobstore.save_image(photo) for photo in photos]
+
+    epoch = database.current_token_epoch()
+    now = datetime.now(timezone.utc)
+    with database.get_db(write=True) as conn:
+        conn.executemany('''
+            INSERT INTO users (name, type, credits, tokens, last_token_reset, token_epoch)
+            VALUES (?, 'farmer', 0, 1000000, '', ?)
+        ''', ((f'loadtest-farmer-{i}', epoch) for i in range(args.users)))
+        conn.executemany('''
+            INSERT INTO products (seller_id, seller_name, name, price, description, type, phone, views)
+            VALUES (?, ?, ?, ?, ?, ?, '9800000000', ?)
+        ''', ((seller, f'Seller {seller}', ' '.join(rng.sample(PRODUCT_WORDS, 3)).title(),
+               round(rng.uniform(50, 5000), 2), ' '.join(rng.sample(PRODUCT_WORDS, 6)),
+               rng.choice(PRODUCT_TYPES), rng.randint(0, 500))
+              for seller in (rng.randint(1, args.users) for _ in range(args.products))))
+        conn.executemany('''
+            INSERT INTO disease_reports (disease_name, location, location_key, crop_type, severity,
+                                         description, reported_at, status)
+            VALUES (?, ?, ?, ?, ?, 'Seen on several plants', ?, 'pending_verification')
+        ''', ((rng.choice(DISEASES), location, database.location_key(location), rng.choice(CROPS),
+               rng.choice(['low', 'medium', 'high']),
+               (now - timedelta(minutes=args.reports - i)).strftime('%Y-%m-%d %H:%M:%S'))
+              for i, location in enumerate(rng.choice(LOCATIONS) for _ in range(args.reports))))
+        conn.executemany('''
+            INSERT INTO detection_history (user_id, image, image_id, prediction, confidence, timestamp)
+            VALUES (?, '', ?, ?, ?, ?)
+        ''', ((rng.randint(1, args.users), rng.choice(digests), rng.choice(['healthy', 'diseased']),
+               rng.random(), (now - timedelta(minutes=args.history - i)).isoformat())
+              for i in range(args.history)))
+    for i in range(args.registrations):
+        database.create_or_update_alert_registration(
+            f'Farmer {i}', f'+977-98{i:08d}', ','.join(rng.sample(CROPS, 2)), rng.choice([5, 10, 25]),
+            rng.choice(LOCATIONS), latitude=27.68 + rng.uniform(-0.2, 0.2), longitude=84.43 + rng.uniform(-0.2, 0.2)
+        )
+    database.close_connections()
+    return {'userCount': args.users, 'photos': photos}
+
+
+# --- Server ---
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    """Resident set size in bytes of `pid` and its descendants, from /proc."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid, interval_s=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval_s = interval_s
+        self.peak = 0
+        self.last = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            self.last = process_tree_rss(self.pid)
+            self.peak = max(self.peak, self.last)
+            self._stopping.wait(self.interval_s)
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+        self.last = process_tree_rss(self.pid) or self.last
+
+
+def start_server(args, scratch, port):
+    env = dict(os.environ, MODEL_LOAD_MODE='eager')
+    log = open(os.path.join(scratch, 'server.log'), 'w')
+    command = [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(args.workers), '--log-level', 'warning', '--no-access-log']
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(client_module, base_url, server, timeout_s):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'server exited with code {server.returncode}')
+        try:
+            response = client_module.get(base_url + '/api/health', timeout=1)
+            if response.status_code == 200:
+                return response.json()['model']
+        except client_module.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'server not ready after {timeout_s:.0f}s')
+
+
+# --- Workload ---
+
+class Workload:
+    def __init__(self, data, seed, repeat_photos=False):
+        self.data = data
+        self.seed = seed
+        self.repeat_photos = repeat_photos
+
+    async def login(self, client, rng):
+        user = rng.randint(0, self.data['userCount'] - 1)
+        return await client.post('/api/users/login', json={'name': f'loadtest-farmer-{user}', 'type': 'farmer'})
+
+    async def scan(self, client, rng):
+        photo = rng.choice(self.data['photos'])
+        if not self.repeat_photos:
+            # Bytes after the JPEG end marker are ignored by decoders but change
+            # the digest, so every scan misses the prediction cache like a new photo
+            photo += rng.randbytes(16)
+        return await client.post(f'/api/users/{rng.randint(1, self.data["userCount"])}/scan',
+                                 content=photo, headers={'Content-Type': 'image/jpeg'})
+
+    async def history(self, client, rng):
+        return await client.get(f'/api/detection-history/{rng.randint(1, self.data["userCount"])}',
+                                params={'limit': 20, 'view': rng.choice(['summary', 'full'])})
+
+    async def browse(self, client, rng):
+        variant = rng.random()
+        if variant < 0.4:
+            params = {'limit': 24}
+        elif variant < 0.6:
+            params = {'limit': 24, 'type': rng.choice(PRODUCT_TYPES), 'sort': 'price_asc'}
+        elif variant < 0.8:
+            params = {'limit': 24, 'q': rng.choice(SEARCH_TERMS)}
+        else:
+            first = await client.get('/api/products', params={'limit': 24, 'sort': 'price_desc'})
+            cursor = first.headers.get('x-next-cursor')
+            if not cursor:
+                return first
+            params = {'limit': 24, 'sort': 'price_desc', 'cursor': cursor}
+        return await client.get('/api/products', params=params)
+
+    async def report(self, client, rng):
+        return await client.post('/api/report-disease', json={
+            'diseaseName': rng.choice(DISEASES), 'cropType': rng.choice(CROPS),
+            'severity': rng.choice(['low', 'medium', 'high']), 'description': 'Load test report',
+            'latitude': 27.68 + rng.uniform(-0.2, 0.2), 'longitude': 84.43 + rng.uniform(-0.2, 0.2),
+        })
+
+    async def alerts(self, client, rng):
+        params = {'limit': 10}
+        if rng.random() < 0.5:
+            params['location'] = rng.choice(LOCATIONS)
+        return await client.get('/api/recent-alerts', params=params)
+
+
+async def run_clients(httpx, base_url, workload, mix, concurrency, warmup_s, duration_s):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: {} for name in names}
+    measuring = asyncio.Event()
+    stopping = asyncio.Event()
+
+    async def client_loop(index, client):
+        rng = random.Random(workload.seed * 1000 + index)
+        while not stopping.is_set():
+            name = rng.choices(names, weights)[0]
+            began = time.perf_counter()
+            try:
+                response = await getattr(workload, name)(client, rng)
+                outcome = response.status_code if response.status_code >= 400 else None
+            except httpx.HTTPError as err:
+                outcome = type(err).__name__
+            elapsed = time.perf_counter() - began
+            if measuring.is_set() and not stopping.is_set():
+                samples[name].append(elapsed)
+                if outcome is not None:
+                    errors[name][str(outcome)] = errors[name].get(str(outcome), 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        tasks = [asyncio.create_task(client_loop(i, client)) for i in range(concurrency)]
+        await asyncio.sleep(warmup_s)
+        measuring.set()
+        began = time.perf_counter()
+        await asyncio.sleep(duration_s)
+        stopping.set()
+        measured_s = time.perf_counter() - began
+        await asyncio.gather(*tasks)
+    return samples, errors, measured_s
+
+
+def summarize(timings, errors, measured_s):
+    if not timings:
+        return {'requests': 0, 'errors': sum(errors.values()), 'errorsByStatus': errors}
+    ms = [t * 1000 for t in timings]
+    return {
+        'requests': len(ms),
+        'errors': sum(errors.values()),
+        'errorsByStatus': errors,
+        'throughputPerS': round(len(ms) / measured_s, 2),
+        'meanMs': round(sum(ms) / len(ms), 3),
+        'p50Ms': round(percentile(ms, 50), 3),
+        'p95Ms': round(percentile(ms, 95), 3),
+        'p99Ms': round(percentile(ms, 99), 3),
+        'maxMs': round(max(ms), 3),
+    }
+
+
+def scrape_server_metrics(httpx, base_url):
+    """A few totals from /metrics: cache use, prediction stages and SQLite time."""
+    wanted = ('arobytess_cache_', 'arobytess_predict_stage_seconds_sum', 'arobytess_predict_stage_seconds_count',
+              'arobytess_db_transaction_seconds_sum', 'arobytess_db_transaction_seconds_count',
+              'arobytess_db_rows_written_total', 'arobytess_inference_rejected_total')
+    try:
+        text = httpx.get(base_url + '/metrics', timeout=10).text
+    except httpx.HTTPError:
+        return {}
+    values = {}
+    for line in text.splitlines():
+        if line.startswith(wanted):
+            series, _, value = line.rpartition(' ')
+            values[series.removeprefix('arobytess_')] = float(value)
+    return values
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    print(f'\n{"scenario":<10} {"requests":>9} {"err":>5} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    rows = dict(result['scenarios'], total=result['total'])
+    for name, row in rows.items():
+        if not row['requests']:
+            continue
+        print(f'{name:<10} {row["requests"]:9,} {row["errors"]:5} {row["throughputPerS"]:9,.1f} '
+              f'{row["p50Ms"]:9.2f} {row["p95Ms"]:9.2f} {row["p99Ms"]:9.2f}')
+        old = (baseline or {}).get('scenarios', {}).get(name) if name != 'total' else (baseline or {}).get('total')
+        if old and old.get('requests'):
+            def change(key):
+                return f'{(row[key] - old[key]) / old[key] * 100:+8.1f}%' if old[key] else '       -'
+            print(f'{"  vs base":<10} {"":>9} {"":>5} {change("throughputPerS"):>9} {change("p50Ms"):>9} '
+                  f'{change("p95Ms"):>9} {change("p99Ms"):>9}')
+    rss = result['rss']
+    print(f'\nServer RSS: {rss["startMb"]:,.0f} MB after warm-up, peak {rss["peakMb"]:,.0f} MB, '
+          f'end {rss["endMb"]:,.0f} MB')
+    if baseline:
+        print(f'Baseline: {baseline.get("git")} at {baseline.get("startedAt")}, '
+              f'peak RSS {baseline["rss"]["peakMb"]:,.0f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--reports', type=int, default=5000)
+    parser.add_argument('--history', type=int, default=50000)
+    parser.add_argument('--registrations', type=int, default=2000)
+    parser.add_argument('--images', type=int, default=32, help='distinct leaf photos used by scans')
+    parser.add_argument('--repeat-photos', action='store_true',
+                        help='send the photos unchanged, so repeat scans hit the prediction cache')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'scenario weights (default {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before measuring')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='a previous --output file to compare against')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory (database, server log)')
+    args = parser.parse_args()
+
+    import httpx
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    scratch = tempfile.mkdtemp(prefix='arobytess-loadtest-')
+    server = None
+    try:
+        began = time.perf_counter()
+        data = generate_data(args, scratch)
+        generate_s = time.perf_counter() - began
+        print(f'Generated {args.users:,} users, {args.products:,} products, {args.reports:,} reports, '
+              f'{args.history:,} history records, {args.registrations:,} alert registrations and '
+              f'{args.images} leaf photos in {generate_s:.1f}s ({scratch})')
+
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        began = time.perf_counter()
+        server = start_server(args, scratch, port)
+        model_state = wait_until_ready(httpx, base_url, server, args.startup_timeout)
+        startup_s = time.perf_counter() - began
+        print(f'uvicorn with {args.workers} worker(s) ready in {startup_s:.1f}s (model: {model_state})')
+
+        mix = dict(args.mix)
+        if model_state != 'ready' and mix.pop('scan', None):
+            print('WARNING: the model did not load; scan is left out of the mix')
+
+        sampler = RSSSampler(server.pid)
+        sampler.start()
+        print(f'Running {args.concurrency} clients: {args.warmup:.0f}s warm-up, {args.duration:.0f}s measured, '
+              f'mix {", ".join(f"{k}={v:g}" for k, v in mix.items())}')
+        workload = Workload(data, args.seed, args.repeat_photos)
+        warm = {}
+
+        async def measure():
+            async def mark_start():
+                await asyncio.sleep(args.warmup)
+                warm['rss'] = process_tree_rss(server.pid)
+            marker = asyncio.create_task(mark_start())
+            result = await run_clients(httpx, base_url, workload, mix, args.concurrency, args.warmup, args.duration)
+            await marker
+            return result
+
+        samples, errors, measured_s = asyncio.run(measure())
+        sampler.stop()
+        server_metrics = scrape_server_metrics(httpx, base_url)
+
+        all_timings = [t for timings in samples.values() for t in timings]
+        all_errors = {}
+        for by_status in errors.values():
+            for status, count in by_status.items():
+                all_errors[status] = all_errors.get(status, 0) + count
+        result = {
+            'version': 1,
+            'startedAt': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+            'mix': mix,
+            'generateS': round(generate_s, 2),
+            'startupS': round(startup_s, 2),
+            'measuredS': round(measured_s, 2),
+            'total': summarize(all_timings, all_errors, measured_s),
+            'scenarios': {name: summarize(samples[name], errors[name], measured_s) for name in mix},
+            'rss': {
+                'startMb': round(warm.get('rss', 0) / 2**20, 1),
+                'peakMb': round(sampler.peak / 2**20, 1),
+                'endMb': round(sampler.last / 2**20, 1),
+            },
+            'server': server_metrics,
+        }
+
+        print_report(result, baseline)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+            print(f'Results written to {args.output}')
+        return 1 if result['total']['errors'] else 0
+    except RuntimeError as err:
+        print(f'Load test failed: {err}')
+        log_path = os.path.join(scratch, 'server.log')
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                print(''.join(f.readlines()[-30:]))
+        return 2
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if args.keep:
+            print(f'Scratch directory kept at {scratch}')
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Check that the API's per-record lookups and writes stay O(log n) as the
+data grows.
+
+Fills a scratch database at each size and runs the database.py functions
+behind the hot endpoints:
+- user by id and by (name, type)
+- token spend
+- products by id and by seller, plus view counts
+- detection history by user
+- alert registration upsert by phone number
+- disease report by id
+
+Every SQL statement they issue, and each of database.LOOKUP_QUERIES, is
+checked with EXPLAIN QUERY PLAN. A full table scan is reported and makes
+the script exit 1, so it can run in CI. Mean time per call is printed for each size; it should
+barely move between them.
+
+Run from the project root:
+    python -m benchmarks.lookups --sizes 1000,100000 --iterations 2000
+"""
+import argparse
+import random
+import sys
+import time
+
+from benchmarks.measure import scratch_database
+
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'INSERT')
+
+
+def populate(database, size, rng):
+    sellers = max(1, size // 20)
+    with database.get_db(write=True) as conn:
+        conn.executemany(
+            'INSERT INTO users (id, name, type, tokens, token_epoch) VALUES (?, ?, ?, ?, ?)',
+            [(i, f'user{i}', 'seller' if i <= sellers else 'farmer', 10 ** 9, database.current_token_epoch())
+             for i in range(1, size + 1)]
+        )
+        conn.executemany(
+            'INSERT INTO products (id, seller_id, seller_name, name, price, type) VALUES (?, ?, ?, ?, ?, ?)',
+            [(i, rng.randint(1, sellers), 'seller', f'product {i}', rng.uniform(10, 5000), 'seed')
+             for i in range(1, size + 1)]
+        )
+        conn.executemany(
+            'INSERT INTO detection_history (user_id, image_id, prediction, confidence, timestamp) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(rng.randint(1, size), 'x', 'healthy', 0.9, f'2024-01-01T00:00:{i % 60:02d}.{i:06d}')
+             for i in range(size)]
+        )
+        conn.executemany(
+            'INSERT INTO alert_registrations (farmer_name, phone_number, crop_types, revision) VALUES (?, ?, ?, ?)',
+            [(f'farmer{i}', f'+977-{i:08d}', 'rice', i) for i in range(1, size + 1)]
+        )
+        conn.executemany(
+            'INSERT INTO disease_reports (disease_name, location, location_key, crop_type, severity, reported_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [('Blight', 'Bharatpur', 'bharatpur', 'rice', 'high', '2024-01-01T00:00:00Z') for _ in range(size)]
+        )
+        conn.execute('ANALYZE')
+
+
+def operations(database, size, sellers):
+    return {
+        'user by id': lambda rng: database.get_user_by_id(rng.randint(1, size)),
+        'user by (name, type)': lambda rng: database.get_user_by_name_type(f'USER{rng.randint(1, size)}', 'farmer'),
+        'spend token': lambda rng: database.spend_token(rng.randint(1, size)),
+        'product by id': lambda rng: database.get_product_by_id(rng.randint(1, size)),
+        'products by seller': lambda rng: database.get_seller_products(rng.randint(1, sellers)),
+        'product views': lambda rng: database.add_product_views({rng.randint(1, size): 1}),
+        'history by user': lambda rng: database.get_user_detection_history(rng.randint(1, size), 20),
+        'alert upsert by phone': lambda rng: database.create_or_update_alert_registration(
+            'farmer', f'+977-{rng.randint(1, size):08d}', 'rice', 10),
+        'report by id': lambda rng: database.get_disease_report_by_id(rng.randint(1, size)),
+    }
+
+
+def run_size(size, iterations, seed):
+    with scratch_database() as database:
+        rng = random.Random(seed)
+        populate(database, size, rng)
+        sellers = max(1, size // 20)
+
+        results = {}
+        statements = set()
+        conn = database.get_connection()
+        for name, op in operations(database, size, sellers).items():
+            conn.set_trace_callback(statements.add)
+            op(rng)
+            conn.set_trace_callback(None)
+            began = time.perf_counter()
+            for _ in range(iterations):
+                op(rng)
+            results[name] = (time.perf_counter() - began) / iterations * 1e6
+        scans = database.full_table_scans(conn, [
+            sql for sql in statements if not sql.lstrip().upper().startswith(TRANSACTION_STATEMENTS)
+        ] + list(database.LOOKUP_QUERIES.values()))
+
+        return results, scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,100000', help='rows per table, comma separated')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    by_size = {}
+    scans = {}
+    for size in sizes:
+        by_size[size], size_scans = run_size(size, args.iterations, args.seed)
+        scans.update(size_scans)
+
+    print(f"{'operation':<24}" + ''.join(f"{f'{size:,} rows':>14}" for size in sizes) + f"{'growth':>9}")
+    for name in by_size[sizes[0]]:
+        timings = [by_size[size][name] for size in sizes]
+        print(f"{name:<24}" + ''.join(f"{t:>11.1f} us" for t in timings) + f"{timings[-1] / timings[0]:>8.2f}x")
+
+    if scans:
+        print(f"\nFAIL: {len(scans)} statement(s) scan a whole table:")
+        for sql, detail in sorted(scans.items()):
+            print(f"  {detail}: {sql[:120]}")
+        return 1
+    print("\nOK: every statement is served by an index or the rowid")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Measurement helpers shared by the benchmark scripts.
+"""
+import math
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile: the smallest value with at least pct% of values at or below it."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+def rss_mb(field='VmRSS'):
+    """This process's memory in MB from /proc/self/status (VmRSS now, VmHWM peak); 0 off Linux."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+@contextmanager
+def scratch_database():
+    """Points database.py and the blob store at a fresh temporary directory
+    and yields the database module.
+
+    The directory (bench.db with its -wal/-shm, and blobs/) is removed on
+    the way out, also when the benchmark fails part way. Scripts that need
+    the paths read database.DB_PATH, or its directory for other scratch files.
+    """
+    scratch = tempfile.mkdtemp(prefix='arobytess-bench-')
+    db_path = os.path.join(scratch, 'bench.db')
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['BLOB_DIR'] = os.path.join(scratch, 'blobs')
+    import blobstore
+    import database  # the first import creates the schema at DATABASE_PATH
+    blobstore.BLOB_DIR = os.environ['BLOB_DIR']
+    blobstore.THUMBNAIL_DIR = os.path.join(blobstore.BLOB_DIR, 'thumbnails')
+    database.DB_PATH = db_path
+    database.close_connections()
+    database.init_db()
+    try:
+        yield database
+    finally:
+        database.close_connections()
+        shutil.rmtree(scratch, ignore_errors=True)
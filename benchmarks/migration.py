@@ -0,0 +1,215 @@
+"""
+Benchmark for the JSON-to-SQLite migration (migrate_to_db.py).
+
+Writes synthetic users.json, products.json and detection_history.json
+(every scan carrying an inline base64 photo) to a scratch directory and
+imports them twice into fresh databases: the old way, json.load() on the
+whole file followed by one execute() per row with indexes in place, and
+with migrate_to_db's streaming, batched loader. Peak Python memory is
+measured with tracemalloc in a separate, untimed run. A last run is
+interrupted part-way through the history file and restarted to check
+that it resumes from its checkpoint without losing or duplicating
+records.
+
+Run from the project root:
+    python -m benchmarks.migration --users 20000 --products 50000 --history 200000
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+from benchmarks.measure import scratch_database
+
+
+class Interrupted(Exception):
+    pass
+
+
+def sample_images(rng, count):
+    from PIL import Image
+    images = []
+    for _ in range(count):
+        buffer = BytesIO()
+        pixels = bytes(rng.getrandbits(8) for _ in range(64 * 64 * 3))
+        Image.frombytes('RGB', (64, 64), pixels).save(buffer, format='JPEG', quality=80)
+        images.append('data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode())
+    return images
+
+
+def write_json_array(path, items):
+    # Written element by element so the generator itself stays small
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for i, item in enumerate(items):
+            f.write(',\n' if i else '')
+            json.dump(item, f, indent=2)
+        f.write('\n]\n')
+
+
+def generate(data_dir, args):
+    rng = random.Random(0)
+    images = sample_images(rng, 50)
+    write_json_array(os.path.join(data_dir, 'users.json'), (
+        {'id': i, 'name': f'Farmer {i}', 'type': 'farmer', 'credits': rng.randint(0, 100), 'tokens': 5,
+         'lastTokenReset': '2024-06', 'friends': [f'Farmer {rng.randint(1, args.users)}' for _ in range(3)]}
+        for i in range(1, args.users + 1)))
+    write_json_array(os.path.join(data_dir, 'products.json'), (
+        {'id': i, 'seller_id': rng.randint(1, args.users), 'seller_name': 'Seller', 'name': f'Product {i}',
+         'price': round(rng.uniform(50, 5000), 2), 'description': 'Fresh stock from Chitwan — नेपाल',
+         'type': 'fertilizer', 'phone': '9800000000', 'views': rng.randint(0, 500)}
+        for i in range(1, args.products + 1)))
+    write_json_array(os.path.join(data_dir, 'detection_history.json'), (
+        {'id': i, 'userId': rng.randint(1, args.users), 'image': rng.choice(images),
+         'prediction': rng.choice(['healthy', 'diseased']), 'confidence': rng.random(),
+         'timestamp': f'2024-06-{1 + i % 28:02d}T10:00:00'}
+        for i in range(1, args.history + 1)))
+
+
+def fresh_database(database):
+    database.close_connections()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database.DB_PATH + suffix):
+            os.remove(database.DB_PATH + suffix)
+    database.init_db()
+
+
+def inline_history_rows(record):
+    # The previous loader kept the photo inline; the app moved it out on first start
+    return [('''
+        INSERT OR IGNORE INTO detection_history
+        (id, user_id, image, image_id, prediction, confidence, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (record['id'], record['userId'], record.get('image', ''), record.get('imageId'),
+          record['prediction'], record['confidence'], record.get('timestamp')))]
+
+
+def migrate_before(migrate_to_db):
+    """The previous loader: whole file in memory, one execute() per row."""
+    for filename, convert in migrate_to_db.SOURCES:
+        if filename == 'detection_history.json':
+            convert = inline_history_rows
+        filepath = os.path.join(migrate_to_db.DATA_DIR, filename)
+        if not os.path.exists(filepath):
+            continue
+        with open(filepath) as f:
+            records = json.load(f)
+        with migrate_to_db.get_db(write=True) as conn:
+            for record in records:
+                for sql, params in convert(record):
+                    conn.execute(sql, params)
+
+
+def move_inline_images(database, blobstore, decode_image_data):
+    """What main.migrate_inline_images then did on the app's first start."""
+    while True:
+        records = database.get_inline_detection_images()
+        if not records:
+            break
+        for record in records:
+            database.set_detection_image_id(record['id'], blobstore.save_image(decode_image_data(record['image'])))
+
+
+def migrate_after(migrate_to_db, batch_size):
+    migrate_to_db.create_checkpoint_table()
+    migrate_to_db.drop_secondary_indexes()
+    for filename, convert in migrate_to_db.SOURCES:
+        migrate_to_db.migrate_file(filename, convert, batch_size)
+    migrate_to_db.rebuild_indexes()
+
+
+def measured(fn, reset):
+    # Timed and traced in separate runs; tracemalloc slows allocation-heavy code
+    reset()
+    began = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - began
+    reset()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def counts(database):
+    with database.get_db() as conn:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('users', 'user_friends', 'products', 'detection_history')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--history', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    with scratch_database() as database:
+        import blobstore
+        import migrate_to_db
+        data_dir = os.path.join(os.path.dirname(database.DB_PATH), 'data')
+        os.makedirs(data_dir)
+        migrate_to_db.DATA_DIR = data_dir
+        migrate_to_db.PROGRESS_INTERVAL_S = float('inf')
+
+        began = time.perf_counter()
+        generate(data_dir, args)
+        size = sum(os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir))
+        print(f'Generated {args.users:,} users, {args.products:,} products, {args.history:,} scans '
+              f'({size / 2**20:,.0f} MB of JSON) in {time.perf_counter() - began:.1f}s')
+        total = args.users + args.products + args.history
+
+        reset = lambda: fresh_database(database)
+        before_s, before_peak = measured(lambda: migrate_before(migrate_to_db), reset)
+        began = time.perf_counter()
+        move_inline_images(database, blobstore, migrate_to_db.decode_image_data)
+        startup_s = time.perf_counter() - began
+        before_counts = counts(database)
+        after_s, after_peak = measured(lambda: migrate_after(migrate_to_db, args.batch_size), reset)
+        after_counts = counts(database)
+
+        print(f'{"":<28} {"time":>8} {"records/s":>11} {"peak memory":>12}')
+        for name, elapsed, peak in (('json.load + execute (before)', before_s, before_peak),
+                                    ('streamed + executemany', after_s, after_peak)):
+            print(f'{name:<28} {elapsed:7.1f}s {total / elapsed:11,.0f} {peak / 2**20:10,.1f} MB')
+        print(f'  then moving {args.history:,} inline images to the blob store on first start: {startup_s:.1f}s')
+        print(f'Row counts match: {before_counts == after_counts} {after_counts}')
+
+        # Interrupt the history file half-way, then run again
+        fresh_database(database)
+        migrate_to_db.create_checkpoint_table()
+        stop_at = args.history // 2 + args.batch_size // 3
+        seen = 0
+
+        def failing(record):
+            nonlocal seen
+            seen += 1
+            if seen == stop_at:
+                raise Interrupted()
+            return migrate_to_db.detection_record_rows(record)
+
+        try:
+            migrate_to_db.migrate_file('detection_history.json', failing, args.batch_size)
+        except Interrupted:
+            pass
+        checkpoint = migrate_to_db.load_checkpoint('detection_history.json', migrate_to_db.file_fingerprint(
+            os.path.join(data_dir, 'detection_history.json')))
+        resumed = migrate_to_db.migrate_file('detection_history.json', migrate_to_db.detection_record_rows,
+                                             args.batch_size)
+        history_rows = counts(database)['detection_history']
+        resumed_ok = checkpoint['rows'] + resumed == args.history == history_rows
+        print(f'Interrupted at record {stop_at:,}; checkpoint after {checkpoint["rows"]:,}, '
+              f'resumed with {resumed:,} more; {history_rows:,} rows in the table (correct: {resumed_ok})')
+
+        return 0 if resumed_ok and before_counts == after_counts else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Microbenchmark for prediction preprocessing (decode + resize + array build).
+
+Compares the original full-resolution pipeline with the draft-mode
+pipeline in inference.py on a synthetic phone-sized JPEG. Each variant
+runs in its own subprocess so peak RSS is measured independently.
+
+Run from the project root:
+    python -m benchmarks.preprocess --width 4000 --height 3000 --iterations 20
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+from inference import IMAGE_SIZE, preprocess_image_bytes
+from benchmarks.measure import rss_mb
+
+
+def make_jpeg(width, height, seed=0):
+    # Smooth gradients plus noise compress like a real photo, unlike flat colour
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([
+        (x * 255 // max(width - 1, 1)),
+        (y * 255 // max(height - 1, 1)),
+        ((x + y) * 127 // max(width + height - 2, 1)),
+    ], axis=-1).astype(np.int16)
+    pixels += rng.integers(-20, 20, size=pixels.shape, dtype=np.int16)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def legacy_preprocess(image_bytes):
+    img = Image.open(BytesIO(image_bytes))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img = img.resize(IMAGE_SIZE)
+    img_array = np.array(img, dtype=np.float32)
+    return np.expand_dims(img_array, axis=0)
+
+
+def current_preprocess(image_bytes, batch_buffer):
+    return preprocess_image_bytes(image_bytes, out=batch_buffer[0])
+
+
+def max_rss_mb():
+    # VmHWM is reset by exec; ru_maxrss would include the parent's peak
+    return rss_mb('VmHWM') or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(variant, image_path, iterations):
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    batch_buffer = np.empty((8,) + IMAGE_SIZE + (3,), dtype=np.float32)
+
+    if variant == "legacy":
+        run = lambda: legacy_preprocess(image_bytes)
+    else:
+        run = lambda: current_preprocess(image_bytes, batch_buffer)
+
+    baseline_rss = max_rss_mb()
+    run()  # warm up decoder tables and allocator
+
+    tracemalloc.start()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "variant": variant,
+        "imageBytes": len(image_bytes),
+        "iterations": iterations,
+        "meanMs": sum(timings) / len(timings),
+        "p50Ms": timings[len(timings) // 2],
+        "p95Ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "tracedPeakMb": traced_peak / (1024 * 1024),
+        "peakRssMb": max_rss_mb(),
+        "rssGrowthMb": max_rss_mb() - baseline_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--variant', choices=['legacy', 'current'], help=argparse.SUPPRESS)
+    parser.add_argument('--image', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.image, args.iterations)))
+        return
+
+    # Generate the sample once here so its allocation does not count
+    # towards either variant's peak RSS
+    results = []
+    with tempfile.NamedTemporaryFile(suffix='.jpg') as sample:
+        sample.write(make_jpeg(args.width, args.height))
+        sample.flush()
+        for variant in ('legacy', 'current'):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.preprocess', '--variant', variant,
+                 '--image', sample.name, '--iterations', str(args.iterations)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output))
+
+    print(f"{args.width}x{args.height} JPEG, {args.iterations} iterations")
+    print(f"{'variant':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'traced MB':>12}"
+          f"{'peak RSS MB':>14}{'RSS growth MB':>16}")
+    for r in results:
+        print(f"{r['variant']:<10}{r['meanMs']:>10.1f}{r['p50Ms']:>10.1f}{r['p95Ms']:>10.1f}"
+              f"{r['tracedPeakMb']:>12.1f}{r['peakRssMb']:>14.1f}{r['rssGrowthMb']:>16.1f}")
+
+    legacy, current = results
+    print(f"\nSpeed-up: {legacy['meanMs'] / current['meanMs']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark for /api/recent-alerts lookups (recent_reports.py, database.py).
+
+Fills a scratch database with synthetic disease reports spread over a set
+of locations, then times one page of recent alerts three ways: the old
+`LIKE '%location%'` query, the keyset query on the location index, and
+the in-memory RecentReports window. It also times walking page by page
+through one location to show cursor cost stays flat with depth.
+
+Run from the project root:
+    python -m benchmarks.recent_alerts --reports 500000 --locations 200
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.measure import percentile, scratch_database
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - began) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reports', type=int, default=500000)
+    parser.add_argument('--locations', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--window', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with scratch_database() as database:
+        from recent_reports import RecentReports, encode_cursor
+
+        rng = random.Random(0)
+        places = [f'Ward {i} Municipality' for i in range(args.locations)]
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        rows = []
+        for i in range(args.reports):
+            place = places[int(rng.paretovariate(1.2)) % len(places)]
+            reported_at = (start + timedelta(seconds=i * 30)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            rows.append(('Late Blight', place, database.location_key(place), 'Tomato', 'high', reported_at))
+        began = time.perf_counter()
+        with database.get_db(write=True) as conn:
+            conn.executemany('''
+                INSERT INTO disease_reports (disease_name, location, location_key, crop_type, severity, reported_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+        print(f'Inserted {args.reports:,} reports over {args.locations} locations in {time.perf_counter() - began:.1f}s')
+
+        began = time.perf_counter()
+        recent = RecentReports(capacity=args.window)
+        recent.load(database.get_recent_disease_reports_by_location(args.window + 1))
+        print(f'Loaded recent windows in {(time.perf_counter() - began) * 1000:.0f} ms')
+
+        queries = [rng.choice(places) for _ in range(args.repeat)]
+        it = iter(queries * 2)
+
+        def like_query():
+            location = next(it)
+            with database.get_db() as conn:
+                conn.execute('''
+                    SELECT * FROM disease_reports WHERE LOWER(location) LIKE LOWER(?)
+                    ORDER BY reported_at DESC LIMIT ?
+                ''', (f'%{location}%', args.limit)).fetchall()
+
+        results = {
+            'LIKE + sort (before)': timed(like_query, args.repeat),
+        }
+        it = iter(queries * 2)
+        results['keyset on location index'] = timed(
+            lambda: database.get_recent_disease_reports(next(it), args.limit), args.repeat)
+        it = iter(queries * 2)
+        results['in-memory window'] = timed(lambda: recent.page(next(it), args.limit), args.repeat)
+
+        for name, timings in results.items():
+            print(f'  {name:<26} p50 {percentile(timings, 50):8.3f} ms  p95 {percentile(timings, 95):8.3f} ms')
+
+        # Page through the busiest location with cursors
+        busiest = places[1]
+        depth_timings = []
+        before, pages = None, 0
+        while pages < 200:
+            began = time.perf_counter()
+            page = recent.page(busiest, args.limit, before)
+            if page is None:
+                reports = database.get_recent_disease_reports(busiest, args.limit + 1, before)
+                page = reports[:args.limit], len(reports) > args.limit
+            depth_timings.append((time.perf_counter() - began) * 1000)
+            reports, has_more = page
+            pages += 1
+            if not has_more:
+                break
+            last = reports[-1]
+            before = (last['reported_at'], last['id'])
+            assert encode_cursor(last)
+        first, deep = depth_timings[:args.window // args.limit], depth_timings[args.window // args.limit:]
+        print(f'Paged {pages} pages of "{busiest}": in-window p50 {percentile(first, 50):.3f} ms'
+              + (f', past window (SQL keyset) p50 {percentile(deep, 50):.3f} ms' if deep else ''))
+
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
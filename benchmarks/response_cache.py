@@ -0,0 +1,77 @@
+"""
+Benchmark for the listing response cache (response_cache.py).
+
+Fills a scratch database with synthetic products and times one
+200-product page of GET /api/products through the app in-process: with
+the cache disabled (every request re-reads and re-serializes the page),
+with a warm cache, and as a conditional request answered with 304. A product write between
+rounds checks that the next read is rebuilt.
+
+Run from the project root:
+    python -m benchmarks.response_cache --products 5000 --requests 300
+"""
+import argparse
+import os
+import sys
+import time
+
+from benchmarks.measure import percentile, scratch_database
+
+
+def timed_gets(client, requests, headers=None):
+    timings = []
+    for _ in range(requests):
+        began = time.perf_counter()
+        response = client.get('/api/products', params={'limit': 200}, headers=headers or {})
+        timings.append((time.perf_counter() - began) * 1000)
+    return timings, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    os.environ.setdefault('MODEL_LOAD_MODE', 'lazy')
+    with scratch_database() as database:
+        import main as app_module
+        from fastapi.testclient import TestClient
+
+        with database.get_db(write=True) as conn:
+            conn.executemany('''
+                INSERT INTO products (seller_id, seller_name, name, price, description, type, phone)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(i % 300, f'Seller {i % 300}', f'Product {i}', 10 + i % 90,
+                   'Fresh organic produce from the farm, harvested this week.', 'vegetable', '9800000000')
+                  for i in range(args.products)])
+
+        cache = app_module.response_cache
+        with TestClient(app_module.app) as client:
+            max_entries = cache.max_entries
+            cache.max_entries = 0
+            uncached, response = timed_gets(client, args.requests)
+            size_kb = len(response.content) / 1024
+            cache.max_entries = max_entries
+
+            cached, response = timed_gets(client, args.requests)
+            etag = response.headers['etag']
+            revalidated, response = timed_gets(client, args.requests, {'If-None-Match': etag})
+            assert response.status_code == 304
+
+            client.post('/api/products', params={'seller_id': 1, 'seller_name': 'Seller 1'},
+                        json={'name': 'New', 'price': 5, 'description': 'x', 'type': 'fruit', 'phone': '1'})
+            after_write = client.get('/api/products', params={'limit': 200}, headers={'If-None-Match': etag})
+            rebuilt = after_write.status_code == 200 and after_write.json()[0]['name'] == 'New'
+
+        print(f'GET /api/products?limit=200 over {args.products:,} products ({size_kb:,.0f} KB body):')
+        for name, timings in (('no cache', uncached), ('cached body', cached), ('304 revalidation', revalidated)):
+            print(f'  {name:<18} p50 {percentile(timings, 50):7.2f} ms  p95 {percentile(timings, 95):7.2f} ms')
+        print(f'  cache stats: {cache.stats()}')
+        print(f'  rebuilt after a product write: {rebuilt}')
+
+        return 0 if rebuilt else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Benchmark for a plant scan: the fused POST /api/users/{id}/scan versus
+the previous three calls (use-token, predict, detection-history).
+
+Both flows run in-process against a scratch database, so the server time
+is measured directly. Network cost is modelled on top for a slow mobile
+link: one round trip per request plus the upload bytes over the given
+uplink bandwidth. The old flow sends the photo twice, once as raw bytes
+for the prediction and again as base64 JSON for history.
+
+Needs the model, or a stand-in importable as tensorflow. Run from the
+project root:
+    python -m benchmarks.scan --scans 200 --rtt-ms 300 --uplink-kbps 1000
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+
+from benchmarks.measure import percentile, scratch_database
+
+
+def sample_photo(seed, size):
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def old_flow(client, user_id, photo):
+    """Returns the bytes uploaded across the three requests."""
+    sent = 0
+    response = client.post(f'/api/users/{user_id}/use-token')
+    assert response.status_code == 200, response.text
+    response = client.post('/api/predict/upload', content=photo, headers={'Content-Type': 'image/jpeg'})
+    assert response.status_code == 200, response.text
+    sent += len(photo)
+    result = response.json()
+    body = {'userId': user_id, 'image': 'data:image/jpeg;base64,' + base64.b64encode(photo).decode(),
+            'prediction': result['prediction'], 'confidence': result['confidence']}
+    response = client.post('/api/detection-history', json=body)
+    assert response.status_code == 200, response.text
+    sent += len(response.request.content)
+    return 3, sent
+
+
+def fused_flow(client, user_id, photo):
+    response = client.post(f'/api/users/{user_id}/scan', content=photo, headers={'Content-Type': 'image/jpeg'})
+    assert response.status_code == 200, response.text
+    return 1, len(photo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scans', type=int, default=200)
+    parser.add_argument('--photo-size', type=int, default=640, help='width and height of the test photos')
+    parser.add_argument('--rtt-ms', type=float, default=300, help='modelled round trip per request')
+    parser.add_argument('--uplink-kbps', type=float, default=1000, help='modelled upload bandwidth')
+    args = parser.parse_args()
+
+    os.environ.setdefault('MODEL_LOAD_MODE', 'eager')
+    with scratch_database() as database:
+        import main as app_module
+        from fastapi.testclient import TestClient
+
+        # Distinct photos, so neither flow is answered from the prediction cache
+        photos = [sample_photo(seed, args.photo_size) for seed in range(2 * args.scans)]
+        results = {}
+        with TestClient(app_module.app) as client:
+            user_id = client.post('/api/users/register', json={'name': 'bench', 'type': 'farmer'}).json()['id']
+            client.post(f'/api/users/{user_id}/purchase-tokens', json={'quantity': 2 * args.scans})
+            for name, flow, batch in (('three calls (before)', old_flow, photos[:args.scans]),
+                                      ('fused /scan', fused_flow, photos[args.scans:])):
+                timings, requests, sent = [], 0, 0
+                for photo in batch:
+                    began = time.perf_counter()
+                    count, size = flow(client, user_id, photo)
+                    timings.append((time.perf_counter() - began) * 1000)
+                    requests, sent = requests + count, sent + size
+                results[name] = (timings, requests / len(batch), sent / len(batch))
+            saved = len(database.get_user_detection_history(user_id))
+
+        print(f'{args.scans} scans of {args.photo_size}px JPEGs (~{sum(map(len, photos)) / len(photos) / 1024:,.0f} KB); '
+              f'link modelled as {args.rtt_ms:.0f} ms RTT, {args.uplink_kbps:,.0f} kbit/s up')
+        print(f'{"":<22} {"server p50":>11} {"p95":>9} {"requests":>9} {"upload":>10} {"modelled total":>15}')
+        for name, (timings, requests, sent) in results.items():
+            server = percentile(timings, 50)
+            link = requests * args.rtt_ms + sent * 8 / args.uplink_kbps
+            print(f'{name:<22} {server:8.1f} ms {percentile(timings, 95):6.1f} ms {requests:9.0f} '
+                  f'{sent / 1024:7,.0f} KB {server + link:12,.0f} ms')
+        print(f'History records saved: {saved} (expected {2 * args.scans})')
+
+        return 0 if saved == 2 * args.scans else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Benchmark for the month-rollover "login storm" on the token system.
+
+Seeds a scratch database with users whose free tokens belong to last
+month, then logs every one of them in, the way the 1st of the month looks.
+Variants:
+
+  lazy   - the current read path: the top-up is derived from the stored
+           token epoch while reading, nothing is written
+  eager  - the previous behaviour moved onto SQLite: each login that sees a
+           stale month writes the reset back (one write transaction each)
+  json   - the original users.json behaviour: each stale login rewrites
+           the whole file; timed on --json-sample logins and extrapolated
+
+Run from the project root:
+    python -m benchmarks.token_reset --users 100000 --threads 8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.measure import scratch_database
+
+
+def seed_users(database, count):
+    last_epoch = database.current_token_epoch() - 1
+    last_month = database.epoch_month(last_epoch)
+    with database.get_db(write=True) as conn:
+        conn.executemany(
+            'INSERT INTO users (name, type, credits, tokens, last_token_reset, token_epoch) VALUES (?, ?, 0, ?, ?, ?)',
+            ((f'farmer-{i}', 'farmer', i % 5, last_month, last_epoch) for i in range(count))
+        )
+
+
+def lazy_login(database, name):
+    return database.get_user_by_name_type(name, 'farmer')
+
+
+def eager_login(database, name):
+    # The pre-epoch check_and_reset_monthly_tokens, one write per stale user
+    user = database.get_user_by_name_type(name, 'farmer')
+    current_month = database.epoch_month(database.current_token_epoch())
+    with database.get_db(write=True) as conn:
+        row = conn.execute('SELECT tokens, last_token_reset FROM users WHERE id = ?', (user['id'],)).fetchone()
+        if row['last_token_reset'] != current_month:
+            conn.execute(
+                'UPDATE users SET tokens = ?, last_token_reset = ?, token_epoch = ? WHERE id = ?',
+                (database.MONTHLY_TOKENS, current_month, database.current_token_epoch(), user['id'])
+            )
+            database._append_ledger(conn, user['id'], 'tokens', database.MONTHLY_TOKENS - row['tokens'],
+                                    database.MONTHLY_TOKENS, 'monthly_reset')
+    return user
+
+
+def wal_size(db_path):
+    path = db_path + '-wal'
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def run_sqlite_variant(database, db_path, label, login, names, threads):
+    database.close_connections()
+    with database.get_db() as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        ledger_before = conn.execute('SELECT COUNT(*) FROM ledger').fetchone()[0]
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        users = list(pool.map(lambda name: login(database, name), names, chunksize=256))
+    elapsed = time.perf_counter() - began
+
+    with database.get_db() as conn:
+        ledger_rows = conn.execute('SELECT COUNT(*) FROM ledger').fetchone()[0] - ledger_before
+
+    assert all(u['tokens'] == database.MONTHLY_TOKENS for u in users)
+    print(f'{label:>6}: {len(names)} logins in {elapsed:.2f}s ({len(names) / elapsed:,.0f}/s), '
+          f'{ledger_rows} rows written, WAL {wal_size(db_path) / 1e6:.1f} MB')
+    return elapsed
+
+
+def run_json_variant(users, sample):
+    current_month = time.strftime('%Y-%m')
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    with open(path, 'w') as f:
+        json.dump(users, f, indent=2)
+
+    began = time.perf_counter()
+    for user in users[:sample]:
+        with open(path) as f:
+            data = json.load(f)
+        for record in data:
+            if record['id'] == user['id'] and record['lastTokenReset'] != current_month:
+                record['tokens'] = 5
+                record['lastTokenReset'] = current_month
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+    elapsed = time.perf_counter() - began
+    os.remove(path)
+
+    per_login = elapsed / sample
+    print(f'{"json":>6}: {sample} logins in {elapsed:.2f}s ({per_login * 1000:.1f} ms each), '
+          f'~{per_login * len(users) / 60:,.0f} min for all {len(users)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--json-sample', type=int, default=20, help='logins to time for the json variant (0 to skip)')
+    args = parser.parse_args()
+
+    with scratch_database() as database:
+        print(f'Seeding {args.users} users with last month\'s tokens...')
+        seed_users(database, args.users)
+        names = [f'farmer-{i}' for i in range(args.users)]
+
+        run_sqlite_variant(database, database.DB_PATH, 'lazy', lazy_login, names, args.threads)
+        run_sqlite_variant(database, database.DB_PATH, 'eager', eager_login, names, args.threads)
+
+        if args.json_sample:
+            last_month = database.epoch_month(database.current_token_epoch() - 1)
+            users = [{'id': i + 1, 'name': name, 'type': 'farmer', 'credits': 0, 'friends': [],
+                      'tokens': i % 5, 'lastTokenReset': last_month} for i, name in enumerate(names)]
+            run_json_variant(users, min(args.json_sample, len(users)))
+
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Concurrency stress test for the token ledger in database.py.
+
+Worker processes, each running several threads, hammer a handful of
+users with token spends and purchases against a scratch database. At the
+end every user's balance must equal its starting balance plus purchases
+minus successful spends, no balance may be negative, and the ledger must
+account for every change: its deltas sum to the balance, its last entry
+records it, and it holds one row per spend and per purchase. Any mismatch,
+a lost operation or a crashed worker is printed and the script exits 1.
+`--naive` runs the old read-modify-write update alongside for comparison,
+which loses updates under the same load (it does not affect the exit code).
+
+Run from the project root:
+    python -m benchmarks.token_stress --processes 4 --threads 8 --ops 2000
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from benchmarks.measure import scratch_database
+
+START_TOKENS = 50
+WORKER_TIMEOUT_S = 600
+
+
+def naive_spend(database, user_id):
+    user = database.get_user_by_id(user_id)
+    if user['tokens'] < 1:
+        return None
+    database.update_user(user_id, tokens=user['tokens'] - 1)
+    return user['tokens'] - 1
+
+
+def naive_purchase(database, user_id, amount):
+    user = database.get_user_by_id(user_id)
+    return database.update_user(user_id, tokens=user['tokens'] + amount)['tokens']
+
+
+def run_worker(db_path, user_ids, threads, ops, purchase_ratio, naive, seed, results):
+    os.environ['DATABASE_PATH'] = db_path
+    import database
+
+    spend = (lambda uid: naive_spend(database, uid)) if naive else database.spend_token
+    purchase = ((lambda uid, n: naive_purchase(database, uid, n)) if naive
+                else database.add_tokens)
+
+    totals = {uid: {'spent': 0, 'purchased': 0, 'rejected': 0} for uid in user_ids}
+    lock = threading.Lock()
+
+    def loop(thread_seed):
+        rng = random.Random(thread_seed)
+        local = {uid: {'spent': 0, 'purchased': 0, 'rejected': 0} for uid in user_ids}
+        for _ in range(ops):
+            uid = rng.choice(user_ids)
+            if rng.random() < purchase_ratio:
+                purchase(uid, 1)
+                local[uid]['purchased'] += 1
+            elif spend(uid) is None:
+                local[uid]['rejected'] += 1
+            else:
+                local[uid]['spent'] += 1
+        with lock:
+            for uid, counts in local.items():
+                for key, value in counts.items():
+                    totals[uid][key] += value
+
+    workers = [threading.Thread(target=loop, args=(seed * 1000 + i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(totals)
+
+
+def run_variant(args, naive):
+    with scratch_database() as database:
+        user_ids = []
+        for i in range(args.users):
+            user = database.create_user(f'stress-{i}', 'farmer')
+            database.update_user(user['id'], tokens=START_TOKENS)
+            user_ids.append(user['id'])
+        database.close_connections()  # never share a connection across fork
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(
+                database.DB_PATH, user_ids, args.threads, args.ops, args.purchase_ratio, naive, p, results))
+            for p in range(args.processes)
+        ]
+        began = time.perf_counter()
+        for process in processes:
+            process.start()
+        failures = []
+        totals = []
+        for _ in processes:
+            try:
+                totals.append(results.get(timeout=WORKER_TIMEOUT_S))
+            except queue.Empty:
+                break
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                failures.append(f'worker {process.pid} exited with code {process.exitcode}')
+        elapsed = time.perf_counter() - began
+
+        total_ops = args.processes * args.threads * args.ops
+        counted_ops = sum(sum(counts.values()) for t in totals for counts in t.values())
+        if counted_ops != total_ops:
+            failures.append(f'{counted_ops} of {total_ops} operations reported back by the workers')
+
+        spent_total = 0
+        for uid in user_ids:
+            spent = sum(t[uid]['spent'] for t in totals)
+            purchased = sum(t[uid]['purchased'] for t in totals)
+            spent_total += spent
+            expected = START_TOKENS + purchased - spent
+
+            with database.get_db() as conn:
+                balance = conn.execute('SELECT tokens FROM users WHERE id = ?', (uid,)).fetchone()[0]
+                ledger_sum, scans, purchases = conn.execute('''
+                    SELECT COALESCE(SUM(delta), 0), COALESCE(SUM(reason = 'scan'), 0),
+                           COALESCE(SUM(reason = 'purchase'), 0)
+                    FROM ledger WHERE user_id = ? AND account = 'tokens'
+                ''', (uid,)).fetchone()
+                last = conn.execute('''
+                    SELECT balance FROM ledger WHERE user_id = ? AND account = 'tokens'
+                    ORDER BY id DESC LIMIT 1
+                ''', (uid,)).fetchone()
+
+            if balance != expected:
+                failures.append(f'user {uid}: balance {balance}, expected {expected} '
+                                f'({START_TOKENS} + {purchased} bought - {spent} spent)')
+            if balance < 0:
+                failures.append(f'user {uid}: negative balance {balance}')
+            if naive:
+                continue
+            if database.MONTHLY_TOKENS + ledger_sum != balance:
+                failures.append(f'user {uid}: ledger deltas sum to {database.MONTHLY_TOKENS + ledger_sum}, '
+                                f'balance is {balance}')
+            if last is None or last[0] != balance:
+                failures.append(f'user {uid}: last ledger entry records {last and last[0]}, balance is {balance}')
+            if scans != spent or purchases != purchased:
+                failures.append(f'user {uid}: ledger has {scans} spends / {purchases} purchases, '
+                                f'workers made {spent} / {purchased}')
+
+
+        label = 'naive read-modify-write' if naive else 'ledger'
+        print(f'{label:>24}: {total_ops} ops in {elapsed:.2f}s ({total_ops / elapsed:,.0f} ops/s), '
+              f'{spent_total} tokens spent, {len(failures)} inconsistencies')
+        for failure in failures[:5]:
+            print(f'{"":>26}{failure}')
+        return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=500, help='operations per thread')
+    parser.add_argument('--purchase-ratio', type=float, default=0.1)
+    parser.add_argument('--naive', action='store_true', help='also run the unguarded update for comparison')
+    args = parser.parse_args()
+
+    passed = run_variant(args, naive=False)
+    if args.naive:
+        run_variant(args, naive=True)
+    print('OK: balances and the ledger match every spend and purchase' if passed
+          else 'FAIL: the ledger does not add up (see above)')
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Benchmark for product view counting (view_counter.py).
+
+Records product views from several threads against a scratch database,
+first the previous way (one committed UPDATE plus a re-select per view)
+and then through ViewCounter with batched flushes. For the counter it
+reports the cost of the in-memory increment alone, the full per-view path
+the endpoint takes (increment plus a consistent read), and the number of
+write transactions. It then checks that no views were lost.
+
+Run from the project root:
+    python -m benchmarks.view_counter --views 100000 --threads 8 --products 500
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+from benchmarks.measure import scratch_database
+
+
+def run_threads(threads, views, fn):
+    per_thread = views // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(per_thread):
+            fn(rng)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    began = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return per_thread * threads, time.perf_counter() - began
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--views', type=int, default=100000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--interval', type=float, default=2.0)
+    parser.add_argument('--threshold', type=int, default=1000)
+    args = parser.parse_args()
+
+    with scratch_database() as database:
+        from view_counter import ViewCounter
+
+        with database.get_db(write=True) as conn:
+            conn.executemany('''
+                INSERT INTO products (id, seller_id, seller_name, name, price, description, type, phone)
+                VALUES (?, 1, 'Seller', ?, 10, 'x', 'vegetable', '1')
+            ''', [(i, f'Product {i}') for i in range(1, args.products + 1)])
+
+        def total_views():
+            with database.get_db() as conn:
+                return conn.execute('SELECT SUM(views) FROM products').fetchone()[0]
+
+        def naive_view(rng):
+            product_id = rng.randint(1, args.products)
+            with database.get_db(write=True) as conn:
+                conn.execute('UPDATE products SET views = views + 1 WHERE id = ?', (product_id,))
+            return database.get_product_by_id(product_id)
+
+        naive_views = max(args.threads, args.views // 10)
+        done, elapsed = run_threads(args.threads, naive_views, naive_view)
+        print(f'Committed UPDATE per view: {done:,} views in {elapsed:.2f}s '
+              f'({done / elapsed:,.0f}/s, {elapsed / done * 1e6:,.1f} us/view, {done:,} transactions)')
+        baseline = total_views()
+
+        counter = ViewCounter(database.add_product_views, interval_s=args.interval, threshold=args.threshold)
+        counter.start()
+        done, elapsed = run_threads(args.threads, args.views, lambda rng: counter.increment(rng.randint(1, args.products)))
+        print(f'In-memory increment: {done:,} views in {elapsed:.2f}s '
+              f'({done / elapsed:,.0f}/s, {elapsed / done * 1e6:,.2f} us/view)')
+
+        def endpoint_view(rng):
+            product_id = rng.randint(1, args.products)
+            counter.increment(product_id)
+            product, pending = counter.read(product_id, lambda: database.get_product_by_id(product_id))
+            return product['views'] + pending
+
+        flushes_before = counter.flushes
+        done_endpoint, elapsed = run_threads(args.threads, args.views, endpoint_view)
+        print(f'Increment + consistent read: {done_endpoint:,} views in {elapsed:.2f}s '
+              f'({done_endpoint / elapsed:,.0f}/s, {elapsed / done_endpoint * 1e6:,.1f} us/view, '
+              f'{counter.flushes - flushes_before} flush transactions)')
+
+        counter.stop()
+        stats = counter.stats()
+        print(f'  flushes {stats["flushes"]}, views per flush {stats["flushedViews"] / max(1, stats["flushes"]):,.0f}, '
+              f'last flush {stats["lastFlushMs"]:.2f} ms')
+        lost = baseline + done + done_endpoint - total_views()
+        print(f'  views lost: {lost}')
+
+        return 0 if lost == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
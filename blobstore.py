@@ -0,0 +1,110 @@
+import hashlib
+import os
+import re
+import tempfile
+from io import BytesIO
+from PIL import Image
+
+BASE_DIR = os.path.dirname(__file__)
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(BASE_DIR, "data", "blobs"))
+THUMBNAIL_DIR = os.path.join(BLOB_DIR, "thumbnails")
+
+THUMBNAIL_SIZE = (256, 256)
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+MEDIA_TYPES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def is_valid_digest(digest: str) -> bool:
+    return bool(DIGEST_PATTERN.match(digest))
+
+
+def blob_path(digest: str) -> str:
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def thumbnail_path(digest: str) -> str:
+    return os.path.join(THUMBNAIL_DIR, digest[:2], digest + ".jpg")
+
+
+def media_type(path: str) -> str:
+    with open(path, "rb") as f:
+        header = f.read(12)
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, kind in MEDIA_TYPES:
+        if header.startswith(magic):
+            return kind
+    return "application/octet-stream"
+
+
+def make_thumbnail(image_bytes: bytes) -> bytes:
+    img = Image.open(BytesIO(image_bytes))
+    if img.format == "JPEG":
+        img.draft("RGB", THUMBNAIL_SIZE)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail(THUMBNAIL_SIZE)
+
+    output = BytesIO()
+    img.save(output, "JPEG", quality=80, optimize=True)
+    return output.getvalue()
+
+
+def save_image(image_bytes: bytes, digest: str = None) -> str:
+    """Stores an image once under its SHA-256 and pre-renders its thumbnail."""
+    if digest is None:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        _write_atomic(path, image_bytes)
+
+    if not os.path.exists(thumbnail_path(digest)):
+        try:
+            _write_atomic(thumbnail_path(digest), make_thumbnail(image_bytes))
+        except Exception:
+            pass  # served lazily from get_thumbnail instead
+
+    return digest
+
+
+def get_image(digest: str):
+    if not is_valid_digest(digest):
+        return None
+    path = blob_path(digest)
+    return path if os.path.exists(path) else None
+
+
+def get_thumbnail(digest: str):
+    if not is_valid_digest(digest):
+        return None
+
+    path = thumbnail_path(digest)
+    if os.path.exists(path):
+        return path
+
+    source = get_image(digest)
+    if source is None:
+        return None
+    with open(source, "rb") as f:
+        _write_atomic(path, make_thumbnail(f.read()))
+    return path
@@ -1,30 +1,197 @@
 import sqlite3
+import logging
 import os
-from datetime import datetime
+import re
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
 from contextlib import contextmanager
+from metrics import registry
+
+logger = logging.getLogger("uvicorn.error")
 
 BASE_DIR = os.path.dirname(__file__)
-DB_PATH = os.path.join(BASE_DIR, "data", "arobytess.db")
+DB_PATH = os.getenv('DATABASE_PATH', os.path.join(BASE_DIR, "data", "arobytess.db"))
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', '16384'))
+SQLITE_MMAP_BYTES = int(os.getenv('SQLITE_MMAP_BYTES', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# One connection per thread, reused for the life of the thread. sqlite3
+# keeps a per-connection cache of prepared statements, so reusing the
+# connection also reuses the compiled SQL. Worker threads come and go
+# (anyio retires idle ones after 10s), so each connection is closed when
+# its thread exits and the thread-local holder is released.
+_local = threading.local()
+_connections = set()
+_connections_lock = threading.RLock()  # _release may run from a GC inside get_connection
+
+DB_SECONDS = registry.histogram(
+    "db_transaction_seconds", "Time a connection is held per get_db() block.", labels=("mode",)
+)
+DB_LOCK_WAIT_SECONDS = registry.histogram("db_write_lock_wait_seconds", "Time spent waiting for the write lock.")
+DB_ROWS_WRITTEN = registry.counter("db_rows_written_total", "Rows inserted, updated or deleted.")
+registry.callback("db_connections", "Open SQLite connections.", lambda: len(_connections))
+
+
+class _ConnectionHolder:
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+def _open_connection():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    # Only the owning thread uses a connection, but it may be closed from
+    # wherever its thread is torn down or from close_connections()
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, cached_statements=256, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_BYTES}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
+def _release(conn):
+    with _connections_lock:
+        _connections.discard(conn)
+    conn.close()
+
+def get_connection():
+    holder = getattr(_local, 'holder', None)
+    # Not in the set once close_connections() closed it from another thread
+    if holder is None or holder.conn not in _connections:
+        holder = _ConnectionHolder(_open_connection())
+        with _connections_lock:
+            _connections.add(holder.conn)
+        weakref.finalize(holder, _release, holder.conn)
+        _local.holder = holder
+    return holder.conn
+
+def close_connection():
+    """Closes the calling thread's connection, e.g. before a worker thread exits."""
+    holder = getattr(_local, 'holder', None)
+    if holder is not None:
+        _local.holder = None  # its finalizer closes the connection
+
+def close_connections():
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+    for conn in connections:
+        conn.close()
+    _local.holder = None
+
 @contextmanager
-def get_db():
+def get_db(write: bool = False):
+    """Yields this thread's connection.
+
+    Reads run in autocommit mode so they never hold a lock; WAL lets them
+    proceed while a write is in progress. `write=True` opens a
+    BEGIN IMMEDIATE transaction (taking the write lock up front, so it
+    cannot deadlock upgrading from a read). Nested calls join the
+    enclosing transaction, so compound operations commit once.
+    """
     conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+
+    started = time.perf_counter()
+    if not write:
+        try:
+            yield conn
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, "read")
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
+    locked = time.perf_counter()
+    changes = conn.total_changes
     try:
         yield conn
-        conn.commit()
+        conn.execute('COMMIT')
+        DB_ROWS_WRITTEN.inc(amount=conn.total_changes - changes)
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
     finally:
-        conn.close()
+        DB_LOCK_WAIT_SECONDS.observe(locked - started)
+        DB_SECONDS.observe(time.perf_counter() - locked, "write")
+
+def file_sizes() -> dict:
+    """Bytes on disk for the database and its write-ahead log."""
+    sizes = {}
+    for name, path in (("main", DB_PATH), ("wal", DB_PATH + "-wal")):
+        try:
+            sizes[name] = os.path.getsize(path)
+        except OSError:
+            pass
+    return sizes
+
+def _ensure_column(cursor, table: str, column: str, definition: str) -> bool:
+    columns = [row['name'] for row in cursor.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+    return False
+
+def location_key(location: str) -> str:
+    """Normalized form used to group reports by place: "  Bharatpur " -> "bharatpur"."""
+    return ' '.join((location or '').lower().split())
+
+def utc_timestamp() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+# --- Monthly Token Epochs ---
+# Free tokens top up to MONTHLY_TOKENS each calendar month. Instead of
+# rewriting every user when the month changes, each row stores the month
+# (as a count of months, "epoch") its balance belongs to. A row from an
+# earlier epoch is read as a fresh MONTHLY_TOKENS balance, and only gets
+# written back the next time that user's tokens actually change.
+
+MONTHLY_TOKENS = 5
+
+def month_epoch(month: str) -> int:
+    year, month_number = month.split('-')
+    return int(year) * 12 + int(month_number) - 1
+
+def epoch_month(epoch: int) -> str:
+    return f'{epoch // 12:04d}-{epoch % 12 + 1:02d}'
+
+def current_token_epoch() -> int:
+    now = datetime.now()
+    return now.year * 12 + now.month - 1
+
+def _apply_token_epoch(user: dict) -> dict:
+    epoch = current_token_epoch()
+    if user['token_epoch'] < epoch:
+        user['tokens'] = MONTHLY_TOKENS
+        user['token_epoch'] = epoch
+    user['last_token_reset'] = epoch_month(user['token_epoch'])
+    return user
+
+def _materialize_monthly_tokens(conn, user_id: int):
+    """Writes a pending monthly top-up back to the row (inside a write transaction)."""
+    epoch = current_token_epoch()
+    row = conn.execute('SELECT tokens, token_epoch FROM users WHERE id = ?', (user_id,)).fetchone()
+    if row is None or row['token_epoch'] >= epoch:
+        return
+    conn.execute(
+        'UPDATE users SET tokens = ?, token_epoch = ?, last_token_reset = ? WHERE id = ?',
+        (MONTHLY_TOKENS, epoch, epoch_month(epoch), user_id)
+    )
+    _append_ledger(conn, user_id, 'tokens', MONTHLY_TOKENS - row['tokens'], MONTHLY_TOKENS, 'monthly_reset')
 
 def init_db():
     """Initialize database tables"""
-    with get_db() as conn:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
-        
+
         # Users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -34,11 +201,19 @@ def init_db():
                 credits INTEGER DEFAULT 0,
                 tokens INTEGER DEFAULT 5,
                 last_token_reset TEXT,
+                token_epoch INTEGER NOT NULL DEFAULT 0,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(name, type)
             )
         ''')
-        
+        if _ensure_column(cursor, 'users', 'token_epoch', 'INTEGER NOT NULL DEFAULT 0'):
+            cursor.execute('''
+                UPDATE users
+                SET token_epoch = CAST(substr(last_token_reset, 1, 4) AS INTEGER) * 12
+                                  + CAST(substr(last_token_reset, 6, 2) AS INTEGER) - 1
+                WHERE last_token_reset GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]'
+            ''')
+
         # User friends (many-to-many relationship)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS user_friends (
@@ -49,7 +224,7 @@ def init_db():
                 UNIQUE(user_id, friend_name)
             )
         ''')
-        
+
         # Disease reports table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS disease_reports (
@@ -79,20 +254,45 @@ def init_db():
                 is_active INTEGER DEFAULT 1
             )
         ''')
-        
-        # Detection history table
+
+        # Detection history table; the photo itself lives in the blob store
+        # and is referenced by image_id (image only holds legacy inline data)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS detection_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
-                image TEXT NOT NULL,
+                image TEXT NOT NULL DEFAULT '',
+                image_id TEXT,
                 prediction TEXT NOT NULL,
                 confidence REAL NOT NULL,
                 timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users(id)
             )
         ''')
-        
+        _ensure_column(cursor, 'detection_history', 'image_id', 'TEXT')
+
+        # Coordinates for radius-based alert fan-out (see geoindex.py)
+        _ensure_column(cursor, 'disease_reports', 'latitude', 'REAL')
+        _ensure_column(cursor, 'disease_reports', 'longitude', 'REAL')
+        _ensure_column(cursor, 'alert_registrations', 'email', 'TEXT')
+        _ensure_column(cursor, 'alert_registrations', 'latitude', 'REAL')
+        _ensure_column(cursor, 'alert_registrations', 'longitude', 'REAL')
+
+        # Normalized location for the recent-alerts lookups
+        _ensure_column(cursor, 'disease_reports', 'location_key', 'TEXT')
+        unkeyed = cursor.execute('SELECT id, location FROM disease_reports WHERE location_key IS NULL').fetchall()
+        cursor.executemany('UPDATE disease_reports SET location_key = ? WHERE id = ?',
+                           [(location_key(row['location']), row['id']) for row in unkeyed])
+
+        # Every insert or update of a registration takes the next revision,
+        # so other processes can find what changed since they last looked
+        _ensure_column(cursor, 'alert_registrations', 'revision', 'INTEGER')
+        cursor.execute('''
+            UPDATE alert_registrations
+            SET revision = (SELECT coalesce(max(revision), 0) FROM alert_registrations) + id
+            WHERE revision IS NULL
+        ''')
+
         # Products table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS products (
@@ -110,15 +310,156 @@ def init_db():
             )
         ''')
 
+        # Append-only log of every token and credit balance change
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                account TEXT NOT NULL,
+                delta INTEGER NOT NULL,
+                balance INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+        ''')
+
+        # Outgoing email queue, drained by the worker in notifications.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                dedup_key TEXT NOT NULL UNIQUE,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                sent_at TEXT
+            )
+        ''')
+
+        create_indexes(cursor)
+        create_product_search(cursor)
+
+def create_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_name_nocase ON users(name COLLATE NOCASE, type)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_friends_user ON user_friends(user_id)')
+    cursor.execute('DROP INDEX IF EXISTS idx_detection_history_user')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_detection_history_user_time
+        ON detection_history(user_id, timestamp, id)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_seller ON products(seller_id)')
+    # Index entries end in the rowid, so these also order ties by id for keyset paging
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_type ON products(type)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_price ON products(price)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_type_price ON products(type, price)')
+    cursor.execute('DROP INDEX IF EXISTS idx_disease_reports_reported_at')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_disease_reports_recent ON disease_reports(reported_at, id)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_disease_reports_location_recent
+        ON disease_reports(location_key, reported_at, id)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alert_registrations_revision ON alert_registrations(revision)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at)')
+
+# Full-text search over product name and description. Builds without FTS5
+# fall back to LIKE scans in search_products
+FTS_ENABLED = True
+
+def create_product_search(cursor):
+    global FTS_ENABLED
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+    ).fetchone()
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, description, content='products', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as err:
+        FTS_ENABLED = False
+        logger.warning("SQLite FTS5 unavailable, product search will scan: %s", err)
+        return
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    ''')
+    if not exists:
+        cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+# --- Indexed Lookups ---
+# The per-record lookups behind the hot endpoints. Each is answered from an
+# index or the rowid in O(log n), and a write touches only its own rows, so
+# neither grows with the size of the data. check_lookup_plans() proves it.
+
+LOOKUP_QUERIES = {
+    "user by id": "SELECT * FROM users WHERE id = ?",
+    "user by (name, type)": "SELECT * FROM users WHERE name = ? COLLATE NOCASE AND type = ?",
+    "product by id": "SELECT * FROM products WHERE id = ?",
+    "products by seller": "SELECT * FROM products WHERE seller_id = ?",
+    "history by user": '''
+        SELECT id, user_id, image_id, prediction, confidence, timestamp FROM detection_history
+        WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''',
+    "alert registration by phone": "SELECT id FROM alert_registrations WHERE phone_number = ?",
+    "disease report by id": "SELECT * FROM disease_reports WHERE id = ?",
+}
+
+def full_table_scans(conn, statements) -> list:
+    """(statement, plan line) for every statement whose EXPLAIN QUERY PLAN scans a whole table."""
+    scans = []
+    for sql in statements:
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, [None] * sql.count('?')):
+            detail = row[3]
+            if detail.startswith('SCAN ') and 'USING' not in detail and detail != 'SCAN CONSTANT ROW':
+                scans.append((' '.join(sql.split()), detail))
+    return scans
+
+def check_lookup_plans() -> list:
+    """Logs a warning for every lookup in LOOKUP_QUERIES that would scan its
+    table, e.g. while migrate_to_db.py has the indexes dropped."""
+    # A connection of its own: cached EXPLAIN statements are not re-planned
+    # after an index is dropped or created
+    conn = sqlite3.connect(DB_PATH, cached_statements=0)
+    try:
+        scans = full_table_scans(conn, LOOKUP_QUERIES.values())
+    finally:
+        conn.close()
+    for sql, detail in scans:
+        logger.warning("Lookup is not index-served (%s): %s", detail, sql)
+    return scans
+
 # --- User Operations ---
 
 def create_user(name: str, user_type: str) -> dict:
-    with get_db() as conn:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
-        current_month = datetime.now().strftime("%Y-%m")
+        epoch = current_token_epoch()
         cursor.execute(
-            'INSERT INTO users (name, type, last_token_reset) VALUES (?, ?, ?)',
-            (name, user_type, current_month)
+            'INSERT INTO users (name, type, tokens, last_token_reset, token_epoch) VALUES (?, ?, ?, ?, ?)',
+            (name, user_type, MONTHLY_TOKENS, epoch_month(epoch), epoch)
         )
         return get_user_by_id(cursor.lastrowid)
 
@@ -128,7 +469,7 @@ def get_user_by_id(user_id: int) -> dict:
         cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
         row = cursor.fetchone()
         if row:
-            user = dict(row)
+            user = _apply_token_epoch(dict(row))
             user['friends'] = get_user_friends(user_id)
             return user
         return None
@@ -137,46 +478,126 @@ def get_user_by_name_type(name: str, user_type: str) -> dict:
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            'SELECT * FROM users WHERE LOWER(name) = LOWER(?) AND type = ?',
+            'SELECT * FROM users WHERE name = ? COLLATE NOCASE AND type = ?',
             (name, user_type)
         )
         row = cursor.fetchone()
         if row:
-            user = dict(row)
+            user = _apply_token_epoch(dict(row))
             user['friends'] = get_user_friends(user['id'])
             return user
         return None
 
-def update_user(user_id: int, credits: int = None, tokens: int = None, last_token_reset: str = None) -> dict:
-    with get_db() as conn:
+def register_user(name: str, user_type: str) -> dict:
+    """Creates the user unless the name (case-insensitive) is already taken; returns None if so."""
+    with get_db(write=True):
+        if get_user_by_name_type(name, user_type):
+            return None
+        return create_user(name, user_type)
+
+def update_user(user_id: int, credits: int = None, tokens: int = None) -> dict:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
+        if tokens is not None:
+            _materialize_monthly_tokens(conn, user_id)
+        cursor.execute('SELECT credits, tokens FROM users WHERE id = ?', (user_id,))
+        current = cursor.fetchone()
+        if current is None:
+            return None
+
         updates = []
         values = []
-        
+
         if credits is not None:
             updates.append('credits = ?')
             values.append(credits)
+            _append_ledger(conn, user_id, 'credits', credits - current['credits'], credits, 'adjustment')
         if tokens is not None:
             updates.append('tokens = ?')
             values.append(tokens)
-        if last_token_reset is not None:
-            updates.append('last_token_reset = ?')
-            values.append(last_token_reset)
-        
+            _append_ledger(conn, user_id, 'tokens', tokens - current['tokens'], tokens, 'adjustment')
+
         if updates:
             values.append(user_id)
             cursor.execute(f'UPDATE users SET {", ".join(updates)} WHERE id = ?', values)
-        
+
+        return get_user_by_id(user_id)
+
+def add_user_credits(user_id: int, amount: int, reason: str = 'deposit') -> dict:
+    with get_db(write=True):
+        if _adjust_balance(user_id, 'credits', amount, reason) is None:
+            return None
         return get_user_by_id(user_id)
 
+# --- Token Ledger Operations ---
+# Balances live on the users row and only change through single UPDATE
+# statements, so concurrent requests (threads or worker processes) cannot
+# lose an update or spend the same token twice. Every change is also
+# appended to `ledger` with the resulting balance, for auditing.
+
+LEDGER_ACCOUNTS = ('tokens', 'credits')
+
+def _append_ledger(conn, user_id: int, account: str, delta: int, balance: int, reason: str):
+    if delta == 0:
+        return
+    conn.execute('''
+        INSERT INTO ledger (user_id, account, delta, balance, reason, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, account, delta, balance, reason, utc_timestamp()))
+
+def _adjust_balance(user_id: int, account: str, delta: int, reason: str, require_funds: bool = False):
+    """Applies `delta` to one balance; returns the new balance or None.
+
+    None means the user does not exist or, with `require_funds`, that the
+    balance would go negative.
+    """
+    if account not in LEDGER_ACCOUNTS:
+        raise ValueError(f"Unknown ledger account: {account}")
+
+    with get_db(write=True) as conn:
+        if account == 'tokens':
+            _materialize_monthly_tokens(conn, user_id)
+
+        guard = f' AND {account} >= ?' if require_funds else ''
+        params = (delta, user_id, -delta) if require_funds else (delta, user_id)
+        rows = conn.execute(
+            f'UPDATE users SET {account} = {account} + ? WHERE id = ?{guard} RETURNING {account}',
+            params
+        ).fetchall()
+        if not rows:
+            return None
+
+        balance = rows[0][0]
+        _append_ledger(conn, user_id, account, delta, balance, reason)
+        return balance
+
+def spend_token(user_id: int, reason: str = 'scan') -> int:
+    """Takes one token if the user has any; returns the remaining balance or None."""
+    return _adjust_balance(user_id, 'tokens', -1, reason, require_funds=True)
+
+def add_tokens(user_id: int, amount: int, reason: str = 'purchase') -> int:
+    return _adjust_balance(user_id, 'tokens', amount, reason)
+
+def refund_token(user_id: int, reason: str = 'refund') -> int:
+    return _adjust_balance(user_id, 'tokens', 1, reason)
+
+def get_ledger_entries(user_id: int, limit: int = 50) -> list:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM ledger WHERE user_id = ?
+            ORDER BY id DESC LIMIT ?
+        ''', (user_id, limit))
+        return [dict(row) for row in cursor.fetchall()]
+
 def get_user_friends(user_id: int) -> list:
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT friend_name FROM user_friends WHERE user_id = ?', (user_id,))
+        cursor.execute('SELECT friend_name FROM user_friends WHERE user_id = ? ORDER BY id', (user_id,))
         return [row['friend_name'] for row in cursor.fetchall()]
 
 def add_user_friend(user_id: int, friend_name: str) -> dict:
-    with get_db() as conn:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
             'INSERT OR IGNORE INTO user_friends (user_id, friend_name) VALUES (?, ?)',
@@ -184,17 +605,30 @@ def add_user_friend(user_id: int, friend_name: str) -> dict:
         )
         return get_user_by_id(user_id)
 
+def set_user_friends(user_id: int, friends: list) -> dict:
+    with get_db(write=True) as conn:
+        conn.execute('DELETE FROM user_friends WHERE user_id = ?', (user_id,))
+        conn.executemany(
+            'INSERT OR IGNORE INTO user_friends (user_id, friend_name) VALUES (?, ?)',
+            [(user_id, friend) for friend in friends]
+        )
+        return get_user_by_id(user_id)
+
 
 # --- Disease Report Operations ---
 
-def create_disease_report(disease_name: str, crop_type: str, severity: str, 
-                          description: str = None, location: str = "Bharatpur") -> dict:
-    with get_db() as conn:
+def create_disease_report(disease_name: str, crop_type: str, severity: str,
+                          description: str = None, location: str = "Bharatpur",
+                          reporter_phone: str = None, latitude: float = None,
+                          longitude: float = None) -> dict:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO disease_reports (disease_name, location, crop_type, severity, description)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (disease_name, location, crop_type, severity, description))
+            INSERT INTO disease_reports (disease_name, location, location_key, crop_type, severity,
+                                         description, reporter_phone, reported_at, latitude, longitude)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (disease_name, location, location_key(location), crop_type, severity, description,
+              reporter_phone, utc_timestamp(), latitude, longitude))
         return get_disease_report_by_id(cursor.lastrowid)
 
 def get_disease_report_by_id(report_id: int) -> dict:
@@ -204,42 +638,79 @@ def get_disease_report_by_id(report_id: int) -> dict:
         row = cursor.fetchone()
         return dict(row) if row else None
 
-def get_recent_disease_reports(location: str = None, limit: int = 10) -> list:
+def get_recent_disease_reports(location: str = None, limit: int = 10, before: tuple = None) -> list:
+    """Newest reports first, optionally for one location and older than a (reported_at, id) cursor."""
+    conditions, params = [], []
+    if location:
+        conditions.append('location_key = ?')
+        params.append(location_key(location))
+    if before:
+        conditions.append('(reported_at, id) < (?, ?)')
+        params.extend(before)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
     with get_db() as conn:
-        cursor = conn.cursor()
-        if location:
-            cursor.execute('''
-                SELECT * FROM disease_reports 
-                WHERE LOWER(location) LIKE LOWER(?)
-                ORDER BY reported_at DESC LIMIT ?
-            ''', (f'%{location}%', limit))
-        else:
-            cursor.execute('SELECT * FROM disease_reports ORDER BY reported_at DESC LIMIT ?', (limit,))
-        return [dict(row) for row in cursor.fetchall()]
+        rows = conn.execute(f'''
+            SELECT * FROM disease_reports {where}
+            ORDER BY reported_at DESC, id DESC LIMIT ?
+        ''', (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+def get_recent_disease_reports_by_location(per_location: int) -> list:
+    """The newest `per_location` reports of every location, plus the newest overall."""
+    with get_db() as conn:
+        keys = [row[0] for row in conn.execute('SELECT DISTINCT location_key FROM disease_reports')]
+        rows = conn.execute('SELECT * FROM disease_reports ORDER BY reported_at DESC, id DESC LIMIT ?',
+                            (per_location,)).fetchall()
+        for key in keys:
+            # One short range scan of idx_disease_reports_location_recent per location
+            rows += conn.execute('''
+                SELECT * FROM disease_reports WHERE location_key IS ?
+                ORDER BY reported_at DESC, id DESC LIMIT ?
+            ''', (key, per_location)).fetchall()
+    return list({row['id']: dict(row) for row in rows}.values())
+
+def get_latest_disease_report_id() -> int:
+    # Answered from the end of the rowid b-tree, not a scan
+    with get_db() as conn:
+        return conn.execute('SELECT max(id) FROM disease_reports').fetchone()[0] or 0
+
+def get_disease_reports_after(report_id: int, limit: int) -> list:
+    with get_db() as conn:
+        rows = conn.execute('SELECT * FROM disease_reports WHERE id > ? ORDER BY id LIMIT ?',
+                            (report_id, limit)).fetchall()
+        return [dict(row) for row in rows]
 
 # --- Alert Registration Operations ---
 
-def create_or_update_alert_registration(farmer_name: str, phone_number: str, 
+def create_or_update_alert_registration(farmer_name: str, phone_number: str,
                                         crop_types: str, alert_radius: int,
-                                        location: str = "Bharatpur") -> dict:
-    with get_db() as conn:
+                                        location: str = "Bharatpur", email: str = None,
+                                        latitude: float = None, longitude: float = None) -> dict:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM alert_registrations WHERE phone_number = ?', (phone_number,))
         existing = cursor.fetchone()
-        
+
         if existing:
             cursor.execute('''
-                UPDATE alert_registrations 
-                SET farmer_name = ?, crop_types = ?, alert_radius = ?, 
-                    location = ?, updated_at = CURRENT_TIMESTAMP
+                UPDATE alert_registrations
+                SET farmer_name = ?, crop_types = ?, alert_radius = ?,
+                    location = ?, email = ?, latitude = ?, longitude = ?, updated_at = ?,
+                    revision = (SELECT coalesce(max(revision), 0) + 1 FROM alert_registrations)
                 WHERE phone_number = ?
-            ''', (farmer_name, crop_types, alert_radius, location, phone_number))
+            ''', (farmer_name, crop_types, alert_radius, location, email, latitude, longitude,
+                  utc_timestamp(), phone_number))
             return get_alert_registration_by_id(existing['id'])
         else:
             cursor.execute('''
-                INSERT INTO alert_registrations (farmer_name, phone_number, location, crop_types, alert_radius)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (farmer_name, phone_number, location, crop_types, alert_radius))
+                INSERT INTO alert_registrations (farmer_name, phone_number, location, crop_types,
+                                                 alert_radius, email, latitude, longitude, registered_at,
+                                                 revision)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,
+                        (SELECT coalesce(max(revision), 0) + 1 FROM alert_registrations))
+            ''', (farmer_name, phone_number, location, crop_types, alert_radius, email, latitude, longitude,
+                  utc_timestamp()))
             return get_alert_registration_by_id(cursor.lastrowid)
 
 def get_alert_registration_by_id(reg_id: int) -> dict:
@@ -249,44 +720,198 @@ def get_alert_registration_by_id(reg_id: int) -> dict:
         row = cursor.fetchone()
         return dict(row) if row else None
 
-# --- Detection History Operations ---
+def iter_active_alert_registrations(batch_size: int = 10000):
+    """Yields (id, location, latitude, longitude, alert_radius, crop_types) for every active registration."""
+    last_id = 0
+    while True:
+        with get_db() as conn:
+            rows = conn.execute('''
+                SELECT id, location, latitude, longitude, alert_radius, crop_types
+                FROM alert_registrations
+                WHERE is_active = 1 AND id > ?
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        yield from (tuple(row) for row in rows)
+        last_id = rows[-1]['id']
+
+def get_alert_registrations_revision() -> int:
+    with get_db() as conn:
+        return conn.execute('SELECT max(revision) FROM alert_registrations').fetchone()[0] or 0
 
-def save_detection_record(user_id: int, image: str, prediction: str, confidence: float) -> dict:
+def get_alert_registrations_changed_since(revision: int, limit: int) -> list:
+    """(id, location, latitude, longitude, alert_radius, crop_types, is_active, revision) in revision order."""
     with get_db() as conn:
+        rows = conn.execute('''
+            SELECT id, location, latitude, longitude, alert_radius, crop_types, is_active, revision
+            FROM alert_registrations
+            WHERE revision > ?
+            ORDER BY revision LIMIT ?
+        ''', (revision, limit)).fetchall()
+        return [tuple(row) for row in rows]
+
+def get_alert_contacts(reg_ids: list, batch_size: int = 500):
+    """Yields (id, farmer_name, email) for the given registrations that have an email address."""
+    for start in range(0, len(reg_ids), batch_size):
+        chunk = reg_ids[start:start + batch_size]
+        placeholders = ', '.join('?' * len(chunk))
+        with get_db() as conn:
+            rows = conn.execute(f'''
+                SELECT id, farmer_name, email FROM alert_registrations
+                WHERE id IN ({placeholders}) AND is_active = 1 AND email IS NOT NULL AND email != ''
+            ''', chunk).fetchall()
+        yield from (tuple(row) for row in rows)
+
+# --- Detection History Operations ---
+
+def save_detection_record(user_id: int, image_id: str, prediction: str, confidence: float) -> dict:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO detection_history (user_id, image, prediction, confidence)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, image, prediction, confidence))
+            INSERT INTO detection_history (user_id, image, image_id, prediction, confidence, timestamp)
+            VALUES (?, '', ?, ?, ?, ?)
+        ''', (user_id, image_id, prediction, confidence, datetime.now().isoformat()))
         return get_detection_record_by_id(cursor.lastrowid)
 
 def get_detection_record_by_id(record_id: int) -> dict:
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM detection_history WHERE id = ?', (record_id,))
+        cursor.execute('''
+            SELECT id, user_id, image_id, prediction, confidence, timestamp
+            FROM detection_history WHERE id = ?
+        ''', (record_id,))
         row = cursor.fetchone()
         return dict(row) if row else None
 
-def get_user_detection_history(user_id: int) -> list:
+def get_user_detection_history(user_id: int, limit: int = -1, before: tuple = None) -> list:
+    """Newest records first, optionally older than a (timestamp, id) cursor; limit -1 means all."""
+    keyset, params = '', [user_id]
+    if before:
+        keyset = 'AND (timestamp, id) < (?, ?)'
+        params.extend(before)
+    with get_db() as conn:
+        rows = conn.execute(f'''
+            SELECT id, user_id, image_id, prediction, confidence, timestamp
+            FROM detection_history
+            WHERE user_id = ? {keyset}
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+        ''', (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+def iter_user_detection_history(user_id: int, batch_size: int = 500):
+    """Every record of a user, newest first, fetched one keyset page at a time."""
+    before = None
+    while True:
+        records = get_user_detection_history(user_id, batch_size, before)
+        yield from records
+        if len(records) < batch_size:
+            return
+        before = (records[-1]['timestamp'], records[-1]['id'])
+
+def get_inline_detection_images(limit: int = 100) -> list:
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT * FROM detection_history 
-            WHERE user_id = ? ORDER BY timestamp DESC
-        ''', (user_id,))
+            SELECT id, image FROM detection_history
+            WHERE image_id IS NULL AND image != '' LIMIT ?
+        ''', (limit,))
         return [dict(row) for row in cursor.fetchall()]
 
-def delete_detection_record(record_id: int) -> bool:
+def set_detection_image_id(record_id: int, image_id: str):
+    with get_db(write=True) as conn:
+        conn.execute(
+            "UPDATE detection_history SET image_id = ?, image = '' WHERE id = ?",
+            (image_id, record_id)
+        )
+
+def delete_detection_record(record_id: int) -> int:
+    """Returns the owning user's id, or None if there was no such record."""
+    with get_db(write=True) as conn:
+        row = conn.execute('DELETE FROM detection_history WHERE id = ? RETURNING user_id', (record_id,)).fetchone()
+        return row['user_id'] if row else None
+
+# --- Email Outbox Operations ---
+
+def enqueue_email(recipient: str, subject: str, body: str, dedup_key: str) -> int:
+    """Queues a message; returns its id, or None if `dedup_key` was already queued."""
+    with get_db(write=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO email_outbox (recipient, subject, body, dedup_key, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (recipient, subject, body, dedup_key, utc_timestamp()))
+        return cursor.lastrowid if cursor.rowcount else None
+
+def enqueue_emails(messages: list) -> int:
+    """Queues (recipient, subject, body, dedup_key) tuples in one transaction; returns how many were new."""
+    with get_db(write=True) as conn:
+        before = conn.total_changes
+        created_at = utc_timestamp()
+        conn.executemany('''
+            INSERT OR IGNORE INTO email_outbox (recipient, subject, body, dedup_key, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(recipient, subject, body, key, created_at) for recipient, subject, body, key in messages])
+        return conn.total_changes - before
+
+def claim_emails(now: float, lease_s: float, limit: int = 10) -> list:
+    """Leases up to `limit` due messages to the caller and returns them.
+
+    A claimed message is due again once its lease runs out, so messages
+    held by a worker that died are picked up without a separate sweep.
+    """
+    with get_db(write=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE email_outbox
+            SET status = 'sending', attempts = attempts + 1, next_attempt_at = ?
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id LIMIT ?
+            )
+            RETURNING *
+        ''', (now + lease_s, now, limit))
+        return [dict(row) for row in cursor.fetchall()]
+
+def mark_email_sent(email_id: int):
+    with get_db(write=True) as conn:
+        conn.execute(
+            "UPDATE email_outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+            (utc_timestamp(), email_id)
+        )
+
+def mark_email_retry(email_id: int, next_attempt_at: float, error: str):
+    with get_db(write=True) as conn:
+        conn.execute(
+            "UPDATE email_outbox SET status = 'pending', next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (next_attempt_at, error, email_id)
+        )
+
+def mark_email_failed(email_id: int, error: str):
+    with get_db(write=True) as conn:
+        conn.execute(
+            "UPDATE email_outbox SET status = 'failed', last_error = ? WHERE id = ?",
+            (error, email_id)
+        )
+
+def next_email_due() -> float:
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM detection_history WHERE id = ?', (record_id,))
-        return cursor.rowcount > 0
+        cursor.execute("SELECT MIN(next_attempt_at) FROM email_outbox WHERE status IN ('pending', 'sending')")
+        return cursor.fetchone()[0]
+
+def count_emails_by_status() -> dict:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT status, COUNT(*) AS count FROM email_outbox GROUP BY status')
+        return {row['status']: row['count'] for row in cursor.fetchall()}
 
 # --- Product Operations ---
 
 def create_product(seller_id: int, seller_name: str, name: str, price: float,
                    description: str, product_type: str, phone: str) -> dict:
-    with get_db() as conn:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO products (seller_id, seller_name, name, price, description, type, phone)
@@ -301,29 +926,91 @@ def get_product_by_id(product_id: int) -> dict:
         row = cursor.fetchone()
         return dict(row) if row else None
 
-def get_all_products() -> list:
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM products')
-        return [dict(row) for row in cursor.fetchall()]
-
 def get_seller_products(seller_id: int) -> list:
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM products WHERE seller_id = ?', (seller_id,))
         return [dict(row) for row in cursor.fetchall()]
 
-def delete_product(product_id: int) -> bool:
+# sort -> (column, direction); every order ends on id so cursors are unique
+PRODUCT_SORTS = {
+    'newest': (None, 'DESC'),
+    'price_asc': ('price', 'ASC'),
+    'price_desc': ('price', 'DESC'),
+}
+
+def fts_query(text: str) -> str:
+    """"tomato see" -> '"tomato"* "see"*': every word, as a prefix, must appear."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text.lower()))
+
+def search_products(limit: int = 50, sort: str = 'newest', after: tuple = None,
+                    product_type: str = None, min_price: float = None, max_price: float = None,
+                    seller_id: int = None, query: str = None) -> list:
+    """One page of products. `after` is the (sort value, id) of the previous page's last row."""
+    column, direction = PRODUCT_SORTS[sort]
+    comparison = '<' if direction == 'DESC' else '>'
+    conditions, params = [], []
+    source, id_column = 'products p', 'p.id'
+
+    if query:
+        terms = fts_query(query)
+        if not terms:
+            return []
+        if FTS_ENABLED:
+            # Drive the query from the FTS matches. Left to itself the planner
+            # may walk a products index and run MATCH once per row instead,
+            # which is orders of magnitude slower. For newest-first, FTS5
+            # yields rowids in order and the scan stops at `limit`.
+            source = 'products_fts CROSS JOIN products p ON p.id = products_fts.rowid'
+            id_column = 'products_fts.rowid'
+            conditions.append('products_fts MATCH ?')
+            params.append(terms)
+        else:
+            for word in re.findall(r'\w+', query.lower()):
+                conditions.append("(p.name LIKE ? OR p.description LIKE ?)")
+                params.extend([f'%{word}%'] * 2)
+    if product_type:
+        conditions.append('p.type = ?')
+        params.append(product_type)
+    if min_price is not None:
+        conditions.append('p.price >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append('p.price <= ?')
+        params.append(max_price)
+    if seller_id is not None:
+        conditions.append('p.seller_id = ?')
+        params.append(seller_id)
+    if after is not None:
+        if column:
+            conditions.append(f'(p.{column}, p.id) {comparison} (?, ?)')
+            params.extend(after)
+        else:
+            conditions.append(f'{id_column} {comparison} ?')
+            params.append(after[-1])
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    order = f'p.{column} {direction}, p.id {direction}' if column else f'{id_column} {direction}'
     with get_db() as conn:
+        rows = conn.execute(f'''
+            SELECT p.* FROM {source} {where}
+            ORDER BY {order} LIMIT ?
+        ''', (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+def delete_product(product_id: int) -> bool:
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
         return cursor.rowcount > 0
 
-def increment_product_views(product_id: int) -> dict:
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('UPDATE products SET views = views + 1 WHERE id = ?', (product_id,))
-        return get_product_by_id(product_id)
+def add_product_views(counts: dict) -> int:
+    """Applies {product_id: views} deltas in one transaction; returns how many products were updated."""
+    with get_db(write=True) as conn:
+        before = conn.total_changes
+        conn.executemany('UPDATE products SET views = views + ? WHERE id = ?',
+                         [(count, product_id) for product_id, count in sorted(counts.items())])
+        return conn.total_changes - before
 
 # Initialize database on import
 init_db()
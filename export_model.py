@@ -0,0 +1,220 @@
+"""
+Export plant.keras to SavedModel, quantized TFLite and ONNX artifacts for the
+inference backends in inference.py, then check accuracy parity against
+the Keras model on a held-out image set.
+
+Usage:
+    python export_model.py --data-dir /path/to/dataset/test
+
+The data directory uses the same layout the notebook trains on: one
+sub-directory per class ("diseased", "healthy"). Select a backend at
+startup with INFERENCE_BACKEND=savedmodel|tflite|onnx (and MODEL_PATH if
+the artifact lives somewhere else). Compare their speed on this machine
+with `python -m benchmarks.inference`.
+
+With --tiled the held-out set is also scored the way /api/predict?tiled=true
+does it (see predict_tiled in inference.py), and the combined tile score
+must be as accurate as the single whole-photo prediction.
+"""
+import argparse
+import os
+import sys
+import numpy as np
+
+from inference import (
+    BASE_DIR,
+    KerasBackend,
+    aggregate_tile_scores,
+    load_backend,
+    preprocess_image_bytes,
+    tile_image_bytes,
+)
+
+KERAS_PATH = os.path.join(BASE_DIR, "plant.keras")
+CLASS_NAMES = ["diseased", "healthy"]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def iter_image_files(data_dir, limit=None):
+    """Yields (file bytes, label) for each held-out image."""
+    for label, class_name in enumerate(CLASS_NAMES):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        filenames = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        for filename in filenames[:limit]:
+            with open(os.path.join(class_dir, filename), 'rb') as f:
+                yield f.read(), label
+
+
+def load_dataset(data_dir, limit=None):
+    images = []
+    labels = []
+    for image_bytes, label in iter_image_files(data_dir, limit):
+        images.append(preprocess_image_bytes(image_bytes))
+        labels.append(label)
+
+    if not images:
+        return np.zeros((0, 160, 160, 3), dtype=np.float32), np.zeros((0,), dtype=np.int64)
+    return np.stack(images).astype(np.float32), np.array(labels)
+
+
+def representative_dataset(images, count=100):
+    def generator():
+        for image in images[:count]:
+            yield [image[np.newaxis, ...]]
+    return generator
+
+
+def export_tflite(model, output_path, quantization, calibration_images=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8" and calibration_images is not None and len(calibration_images):
+        # Full-integer: int8-only ops, and int8 input and output tensors.
+        # TFLiteBackend quantizes the float32 pixels and dequantizes the
+        # score itself, so preprocessing is the same for every backend.
+        converter.representative_dataset = representative_dataset(calibration_images)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    # Without calibration data "int8" falls back to dynamic-range quantization
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"Wrote {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB)")
+
+
+def export_savedmodel(model, output_path):
+    import tensorflow as tf
+
+    if hasattr(model, "export"):
+        model.export(output_path)  # Keras 3: inference-only, with a serving_default signature
+    else:
+        tf.saved_model.save(model, output_path)
+    print(f"Wrote {output_path}/")
+
+
+def export_onnx(model, output_path):
+    try:
+        import tensorflow as tf
+        import tf2onnx
+    except ImportError:
+        print("Skipping ONNX export: tf2onnx is not installed")
+        return False
+
+    spec = (tf.TensorSpec((None, 160, 160, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=output_path)
+    print(f"Wrote {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB)")
+    return True
+
+
+def predict_in_batches(backend, images, batch_size=32):
+    scores = []
+    for start in range(0, len(images), batch_size):
+        scores.append(np.asarray(backend.predict(images[start:start + batch_size])).reshape(-1))
+    return np.concatenate(scores) if scores else np.zeros((0,))
+
+
+def check_parity(reference_scores, labels, backend_name, path, images, max_accuracy_drop):
+    backend = load_backend(backend_name, path)
+    scores = predict_in_batches(backend, images)
+
+    reference_accuracy = np.mean((reference_scores >= 0.5) == labels)
+    accuracy = np.mean((scores >= 0.5) == labels)
+    agreement = np.mean((scores >= 0.5) == (reference_scores >= 0.5))
+    max_diff = float(np.max(np.abs(scores - reference_scores)))
+
+    passed = reference_accuracy - accuracy <= max_accuracy_drop
+    print(f"  {os.path.basename(path)}: accuracy {accuracy:.4f} (keras {reference_accuracy:.4f}), "
+          f"agreement {agreement:.4f}, max score diff {max_diff:.4f} -> {'OK' if passed else 'FAIL'}")
+    return passed
+
+
+def check_tiled(reference, data_dir, limit, grid, max_accuracy_drop):
+    """Scores each held-out photo whole and tiled with the Keras model.
+
+    Besides the combined score predict_tiled returns (coverage-weighted,
+    unless one tile is confident of a lesion), the plain tile mean and the
+    least healthy tile are shown for comparison.
+    """
+    whole, combined, mean, lowest, labels = [], [], [], [], []
+    for image_bytes, label in iter_image_files(data_dir, limit):
+        batch, boxes = tile_image_bytes(image_bytes, grid)
+        score, whole_score, tiles = aggregate_tile_scores(predict_in_batches(reference, batch), boxes, grid, True)
+        whole.append(whole_score)
+        combined.append(score)
+        mean.append(float(tiles.mean()))
+        lowest.append(float(tiles.min()))
+        labels.append(label)
+    if not labels:
+        print("No held-out images found; skipping tiled check.")
+        return True
+
+    labels = np.array(labels)
+    accuracy = lambda scores: np.mean((np.array(scores) >= 0.5) == labels)
+    whole_accuracy = accuracy(whole)
+    for name, scores in (("whole photo", whole), ("tiled (combined)", combined),
+                         ("tile mean", mean), ("least healthy tile", lowest)):
+        print(f"  {name:<26} accuracy {accuracy(scores):.4f}")
+
+    passed = whole_accuracy - accuracy(combined) <= max_accuracy_drop
+    print(f"  tiled vs whole photo: agreement {np.mean((np.array(combined) >= 0.5) == (np.array(whole) >= 0.5)):.4f} "
+          f"-> {'OK' if passed else 'FAIL'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=KERAS_PATH)
+    parser.add_argument('--output-dir', default=BASE_DIR)
+    parser.add_argument('--data-dir', help='held-out images, one sub-directory per class')
+    parser.add_argument('--limit', type=int, help='max images per class for calibration and parity')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01)
+    parser.add_argument('--skip-onnx', action='store_true')
+    parser.add_argument('--tiled', action='store_true', help='also check tiled prediction accuracy')
+    parser.add_argument('--tile-grid', type=int, default=int(os.getenv('TILED_PREDICT_GRID', '3')))
+    args = parser.parse_args()
+
+    reference = KerasBackend(args.model)
+    images, labels = (load_dataset(args.data_dir, args.limit) if args.data_dir
+                      else (None, None))
+
+    print("Exporting models...")
+    artifacts = []
+    savedmodel_path = os.path.join(args.output_dir, "plant_savedmodel")
+    export_savedmodel(reference.model, savedmodel_path)
+    artifacts.append(("savedmodel", savedmodel_path))
+
+    for quantization in ("int8", "float16"):
+        path = os.path.join(args.output_dir, f"plant_{quantization}.tflite")
+        export_tflite(reference.model, path, quantization, images)
+        artifacts.append(("tflite", path))
+
+    onnx_path = os.path.join(args.output_dir, "plant.onnx")
+    if not args.skip_onnx and export_onnx(reference.model, onnx_path):
+        artifacts.append(("onnx", onnx_path))
+
+    if images is None or not len(images):
+        print("\nNo held-out data given; skipping accuracy parity check.")
+        return 0
+
+    print(f"\nChecking parity on {len(images)} held-out images...")
+    reference_scores = predict_in_batches(reference, images)
+    results = [
+        check_parity(reference_scores, labels, backend_name, path, images, args.max_accuracy_drop)
+        for backend_name, path in artifacts
+    ]
+
+    if args.tiled:
+        print(f"\nChecking tiled prediction ({args.tile_grid}x{args.tile_grid} grid) on the held-out images...")
+        results.append(check_tiled(reference, args.data_dir, args.limit, args.tile_grid, args.max_accuracy_drop))
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
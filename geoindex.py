@@ -0,0 +1,209 @@
+import math
+import threading
+from array import array
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Cell sizes; each registration lives in the grid of the smallest tier that
+# covers its alert radius, so a lookup only has to scan the cells within
+# one tier-width of the report in each grid
+RADIUS_TIERS_KM = (5, 10, 25, 50, 100)
+ANY_CROP = "*"
+
+# Coordinates for the place names the app hands out, so registrations and
+# reports without GPS coordinates can still be placed on the map
+KNOWN_LOCATIONS = {
+    "bharatpur": (27.6833, 84.4333),
+    "chitwan": (27.5291, 84.3542),
+    "kathmandu": (27.7172, 85.3240),
+    "kathmandu valley": (27.7172, 85.3240),
+    "lalitpur": (27.6644, 85.3188),
+    "bhaktapur": (27.6710, 85.4298),
+    "pokhara": (28.2096, 83.9856),
+    "butwal": (27.7006, 83.4484),
+    "hetauda": (27.4284, 85.0322),
+    "biratnagar": (26.4525, 87.2718),
+    "dharan": (26.8065, 87.2846),
+    "nepalgunj": (28.0500, 81.6167),
+    "dhangadhi": (28.6940, 80.5930),
+}
+
+
+def resolve_location(name: str):
+    if not name:
+        return None
+    return KNOWN_LOCATIONS.get(name.strip().lower())
+
+
+def parse_crop_types(crop_types: str) -> frozenset:
+    """"Rice, Potato" -> {"rice", "potato"}; empty means every crop."""
+    crops = frozenset(c.strip().lower() for c in (crop_types or "").split(",") if c.strip())
+    return crops or frozenset((ANY_CROP,))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class _Bucket:
+    """Registrations of one cell and crop, packed into parallel arrays."""
+
+    __slots__ = ("ids", "lats", "lons", "radii")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.radii = array("d")
+
+    def append(self, reg_id, lat, lon, radius_km):
+        self.ids.append(reg_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.radii.append(radius_km)
+
+    def remove(self, reg_id) -> bool:
+        try:
+            i = self.ids.index(reg_id)
+        except ValueError:
+            return False
+        for column in (self.ids, self.lats, self.lons, self.radii):
+            column.pop(i)
+        return True
+
+    def within(self, lat_rad: float, lon_rad: float, cos_lat: float):
+        """Ids whose own radius covers the point (vectorised haversine)."""
+        lats = np.radians(np.frombuffer(self.lats))
+        lons = np.radians(np.frombuffer(self.lons))
+        a = (np.sin((lats - lat_rad) / 2) ** 2
+             + cos_lat * np.cos(lats) * np.sin((lons - lon_rad) / 2) ** 2)
+        dist = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        return np.frombuffer(self.ids, dtype=np.int64)[dist <= np.frombuffer(self.radii)].tolist()
+
+
+class _Grid:
+    """Fixed-size lat/lon cells, each holding a crop -> bucket inverted index.
+
+    Rows are `cell_km` tall. Column width in degrees is chosen per row from
+    the cosine at the row's poleward edge, so a cell is never narrower than
+    `cell_km` and a search radius of `cell_km` touches at most 3x3 cells.
+    """
+
+    def __init__(self, cell_km: float):
+        self.cell_km = cell_km
+        self.lat_step = cell_km / KM_PER_DEGREE_LAT
+        self.cells = {}
+
+    def _lon_step(self, row: int) -> float:
+        edge_lat = max(abs(row * self.lat_step), abs((row + 1) * self.lat_step))
+        return self.cell_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(min(edge_lat, 89.0))), 1e-6))
+
+    def cell_of(self, lat: float, lon: float):
+        row = math.floor(lat / self.lat_step)
+        return row, math.floor(lon / self._lon_step(row))
+
+    def add(self, cell, crops, reg_id: int, lat: float, lon: float, radius_km: float):
+        buckets = self.cells.setdefault(cell, {})
+        for crop in crops:
+            bucket = buckets.get(crop)
+            if bucket is None:
+                bucket = buckets[crop] = _Bucket()
+            bucket.append(reg_id, lat, lon, radius_km)
+
+    def remove(self, cell, crops, reg_id: int):
+        buckets = self.cells.get(cell)
+        if buckets is None:
+            return
+        for crop in crops:
+            bucket = buckets.get(crop)
+            if bucket is not None and bucket.remove(reg_id) and not bucket.ids:
+                del buckets[crop]
+        if not buckets:
+            del self.cells[cell]
+
+    def buckets_near(self, lat: float, lon: float, crop_keys):
+        first_row = math.floor((lat - self.lat_step) / self.lat_step)
+        last_row = math.floor((lat + self.lat_step) / self.lat_step)
+        for row in range(first_row, last_row + 1):
+            lon_step = self._lon_step(row)
+            first_col = math.floor((lon - lon_step) / lon_step)
+            for col in range(first_col, first_col + 3):
+                buckets = self.cells.get((row, col))
+                if buckets is None:
+                    continue
+                for crop in crop_keys:
+                    bucket = buckets.get(crop)
+                    if bucket is not None:
+                        yield bucket
+
+
+class AlertIndex:
+    """In-memory spatial + crop index over alert registrations.
+
+    `match(lat, lon, crop)` returns the registrations whose own alert radius
+    covers the report location and who follow that crop (or all crops).
+    Work is proportional to the registrations in the neighbouring cells
+    for that crop, not to the total number of registrations.
+
+    `revision` is the highest alert_registrations revision applied, so the
+    owner can catch up on registrations changed by other processes.
+    """
+
+    def __init__(self, tiers=RADIUS_TIERS_KM):
+        self.tiers = tuple(sorted(tiers))
+        self.grids = [_Grid(tier) for tier in self.tiers]
+        self.entries = {}
+        self.revision = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _tier(self, radius_km: float) -> int:
+        for i, tier in enumerate(self.tiers):
+            if radius_km <= tier:
+                return i
+        return len(self.tiers) - 1
+
+    def add(self, reg_id: int, lat: float, lon: float, radius_km: float, crop_types: str):
+        radius_km = min(max(float(radius_km or 0), 0.0), self.tiers[-1])
+        crops = parse_crop_types(crop_types)
+        tier = self._tier(radius_km)
+        cell = self.grids[tier].cell_of(lat, lon)
+
+        with self._lock:
+            self.remove(reg_id)
+            self.entries[reg_id] = (tier, cell, crops)
+            self.grids[tier].add(cell, crops, reg_id, lat, lon, radius_km)
+
+    def remove(self, reg_id: int):
+        with self._lock:
+            entry = self.entries.pop(reg_id, None)
+            if entry is not None:
+                tier, cell, crops = entry
+                self.grids[tier].remove(cell, crops, reg_id)
+
+    def match(self, lat: float, lon: float, crop: str = None) -> list:
+        crop_keys = (ANY_CROP,) if not crop else (crop.strip().lower(), ANY_CROP)
+        lat_rad, lon_rad = math.radians(lat), math.radians(lon)
+        cos_lat = math.cos(lat_rad)
+        matches = []
+
+        with self._lock:
+            for grid in self.grids:
+                for bucket in grid.buckets_near(lat, lon, crop_keys):
+                    matches.extend(bucket.within(lat_rad, lon_rad, cos_lat))
+        return matches
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "registrations": len(self.entries),
+                "revision": self.revision,
+                "cells": {f"{grid.cell_km}km": len(grid.cells) for grid in self.grids},
+            }
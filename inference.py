@@ -0,0 +1,664 @@
+import asyncio
+import os
+import base64
+import contextvars
+import hashlib
+import threading
+import time
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from metrics import Histogram, registry
+
+BASE_DIR = os.path.dirname(__file__)
+
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'keras')
+DEFAULT_MODEL_FILES = {
+    "keras": "plant.keras",
+    "tflite": "plant_int8.tflite",
+    "onnx": "plant.onnx",
+    "savedmodel": "plant_savedmodel",
+}
+MODEL_PATH = os.getenv(
+    'MODEL_PATH',
+    os.path.join(BASE_DIR, DEFAULT_MODEL_FILES.get(INFERENCE_BACKEND, "plant.keras"))
+)
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '0'))
+INFERENCE_INTER_OP_THREADS = int(os.getenv('INFERENCE_INTER_OP_THREADS', '0'))
+
+# Recorded in whichever process runs the stage; with process-mode workers
+# only "forward" (timed by MicroBatcher in the server process) is exported
+PREDICT_STAGE_SECONDS = registry.histogram(
+    "predict_stage_seconds", "Time spent in each prediction stage.", labels=("stage",)
+)
+MODEL_LOAD_FAILURES = registry.counter("model_load_failures_total", "Failed attempts to load the model.")
+
+
+def configure_tf_threads(tf):
+    try:
+        if INFERENCE_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(INFERENCE_THREADS)
+        if INFERENCE_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(INFERENCE_INTER_OP_THREADS)
+    except RuntimeError:
+        pass  # TF runtime already initialised in this process
+
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, path: str):
+        started = time.perf_counter()
+        import tensorflow as tf
+        imported = time.perf_counter()
+
+        configure_tf_threads(tf)
+        self.model = tf.keras.models.load_model(path)
+        self.timings = {"import": imported - started, "load": time.perf_counter() - imported}
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        return self.model.predict(images, verbose=0)
+
+
+class SavedModelBackend:
+    """Serves a SavedModel directory through its serving_default signature,
+    without rebuilding the Keras layers.
+    """
+
+    name = "savedmodel"
+
+    def __init__(self, path: str):
+        started = time.perf_counter()
+        import tensorflow as tf
+        imported = time.perf_counter()
+
+        configure_tf_threads(tf)
+        self._tf = tf
+        self.model = tf.saved_model.load(path)
+        self.signature = self.model.signatures["serving_default"]
+        self.input_name = next(iter(self.signature.structured_input_signature[1]))
+        self.timings = {"import": imported - started, "load": time.perf_counter() - imported}
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        outputs = self.signature(**{self.input_name: self._tf.constant(images, dtype=self._tf.float32)})
+        return next(iter(outputs.values())).numpy()
+
+
+class TFLiteBackend:
+    """Serves a (possibly quantized) .tflite export of plant.keras.
+
+    Interpreters are not thread-safe, so each worker thread gets its own.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path: str):
+        started = time.perf_counter()
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        imported = time.perf_counter()
+
+        self._interpreter_cls = Interpreter
+        self.path = path
+        self._local = threading.local()
+        self._get_interpreter()
+        self.timings = {"import": imported - started, "load": time.perf_counter() - imported}
+
+    def _get_interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            interpreter = self._interpreter_cls(
+                model_path=self.path,
+                num_threads=INFERENCE_THREADS or None
+            )
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+        return interpreter
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        interpreter = self._get_interpreter()
+        input_detail = interpreter.get_input_details()[0]
+
+        if input_detail["shape"][0] != len(images):
+            interpreter.resize_tensor_input(input_detail["index"], images.shape)
+            interpreter.allocate_tensors()
+            input_detail = interpreter.get_input_details()[0]
+        output_detail = interpreter.get_output_details()[0]
+
+        # Full-integer exports take quantized input and return quantized output
+        if input_detail["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = input_detail["quantization"]
+            limits = np.iinfo(input_detail["dtype"])
+            images = np.clip(np.round(images / scale + zero_point), limits.min, limits.max).astype(input_detail["dtype"])
+
+        interpreter.set_tensor(input_detail["index"], images.astype(input_detail["dtype"], copy=False))
+        interpreter.invoke()
+        output = interpreter.get_tensor(output_detail["index"])
+
+        if output_detail["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = output_detail["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+
+        return output
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path: str):
+        started = time.perf_counter()
+        import onnxruntime as ort
+        imported = time.perf_counter()
+
+        options = ort.SessionOptions()
+        if INFERENCE_THREADS:
+            options.intra_op_num_threads = INFERENCE_THREADS
+        if INFERENCE_INTER_OP_THREADS:
+            options.inter_op_num_threads = INFERENCE_INTER_OP_THREADS
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.timings = {"import": imported - started, "load": time.perf_counter() - imported}
+
+    def predict(self, images: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: images.astype(np.float32, copy=False)})[0]
+
+
+MODEL_BACKENDS = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": OnnxBackend,
+    "savedmodel": SavedModelBackend,
+}
+
+
+def load_backend(name: str, path: str):
+    if name not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name}")
+    return MODEL_BACKENDS[name](path)
+
+
+plant_model = None
+plant_model_version = None
+_failed_model_version = None
+_model_lock = threading.Lock()
+
+# Reported by the readiness endpoint; one of not_loaded, loading, ready,
+# failed or missing
+model_status = {
+    "state": "not_loaded",
+    "backend": INFERENCE_BACKEND,
+    "version": None,
+    "error": None,
+    "timings": {},
+}
+
+
+def model_version():
+    """Identifies the served model; changes whenever the model file is replaced."""
+    try:
+        stat = os.stat(MODEL_PATH)
+    except OSError:
+        return None
+    return f"{INFERENCE_BACKEND}:{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def initialize_plant_model():
+    global plant_model, plant_model_version, _failed_model_version
+    current_version = model_version()
+    if current_version is None and plant_model is None:
+        model_status.update(state="missing", error=f"{MODEL_PATH} not found")
+    if current_version in (None, plant_model_version, _failed_model_version):
+        return plant_model
+
+    with _model_lock:
+        if current_version in (plant_model_version, _failed_model_version):
+            return plant_model
+
+        model_status["state"] = "loading"
+        started = time.perf_counter()
+        try:
+            plant_model = load_backend(INFERENCE_BACKEND, MODEL_PATH)
+            plant_model_version = current_version
+            timings = dict(getattr(plant_model, "timings", {}))
+            timings["total"] = time.perf_counter() - started
+            model_status.update(state="ready", version=current_version, error=None, timings=timings)
+        except Exception as err:
+            _failed_model_version = current_version
+            MODEL_LOAD_FAILURES.inc()
+            if plant_model is None:
+                model_status.update(state="failed", version=current_version, error=str(err))
+            else:
+                model_status.update(state="ready", error=str(err))
+        return plant_model
+
+
+def load_plant_model(warm_up: bool = True) -> dict:
+    """Loads the model (and optionally runs one forward pass so the first
+    real request does not pay for graph tracing). Returns the model status.
+    """
+    model = initialize_plant_model()
+    if model is not None and warm_up and "warmup" not in model_status["timings"]:
+        started = time.perf_counter()
+        model.predict(np.zeros((1,) + IMAGE_SIZE + (3,), dtype=np.float32))
+        model_status["timings"]["warmup"] = time.perf_counter() - started
+    return {**model_status, "timings": dict(model_status["timings"])}
+
+
+def run_model_batch(images: np.ndarray) -> np.ndarray:
+    model = initialize_plant_model()
+    if model is None:
+        raise RuntimeError("Disease detection model unavailable")
+    return model.predict(images)
+
+
+def decode_image_data(image_data: str) -> bytes:
+    with PREDICT_STAGE_SECONDS.time("base64_decode"):
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        return base64.b64decode(image_data)
+
+
+def image_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class InvalidImageError(ValueError):
+    """The upload is not an image PIL can decode."""
+
+
+# PIL reports unknown formats, truncated files and corrupt data with these
+IMAGE_DECODE_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+
+def upload_digest(image_bytes: bytes, decode: bool = False) -> str:
+    """image_digest() of an upload whose header PIL recognises as an image.
+
+    Only the header is read, so PDFs and random bytes are turned away
+    before any work is queued for them; the pixels are decoded later.
+    With `decode` the pixels are decoded here too (JPEGs in draft mode),
+    for callers that must not start on a truncated or corrupt file.
+    """
+    if decode:
+        open_image(image_bytes, IMAGE_SIZE).close()
+    else:
+        try:
+            Image.open(BytesIO(image_bytes)).close()
+        except IMAGE_DECODE_ERRORS as err:
+            raise InvalidImageError(str(err)) from None
+    return image_digest(image_bytes)
+
+
+def open_image(image_bytes: bytes, draft_size: tuple) -> Image.Image:
+    """Opens and decodes an upload, JPEGs in draft mode at `draft_size` or above."""
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        if img.format == 'JPEG':
+            img.draft('RGB', draft_size)
+        img.load()
+    except IMAGE_DECODE_ERRORS as err:
+        raise InvalidImageError(str(err)) from None
+    return img
+
+
+def load_image_payload(image_data: str) -> tuple:
+    image_bytes = decode_image_data(image_data)
+    return image_bytes, image_digest(image_bytes)
+
+
+IMAGE_SIZE = (160, 160)
+
+
+def preprocess_image_bytes(image_bytes: bytes, out: np.ndarray = None) -> np.ndarray:
+    """Decodes an upload into a 160x160 RGB array.
+
+    JPEGs are decoded in draft mode, letting libjpeg scale by 1/2-1/8 in the
+    DCT, so a 12MP photo never materialises at full size. Without `out` a
+    uint8 array is returned; otherwise the pixels are written straight into
+    `out` (e.g. one slot of a float32 batch buffer).
+    """
+    started = time.perf_counter()
+    img = open_image(image_bytes, IMAGE_SIZE)
+    decoded = time.perf_counter()
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    if img.size != IMAGE_SIZE:
+        img = img.resize(IMAGE_SIZE, reducing_gap=3.0)
+
+    if out is None:
+        out = np.asarray(img)
+    else:
+        out[...] = np.asarray(img)
+    PREDICT_STAGE_SECONDS.observe(decoded - started, "pil_decode")
+    PREDICT_STAGE_SECONDS.observe(time.perf_counter() - decoded, "resize")
+    return out
+
+
+def prepare_image_for_prediction(image_data: str) -> np.ndarray:
+    img_array = np.empty((1,) + IMAGE_SIZE + (3,), dtype=np.float32)
+    preprocess_image_bytes(decode_image_data(image_data), out=img_array[0])
+    return img_array
+
+
+# --- Tiled Prediction ---
+# A single 160x160 downscale of a phone photo loses small lesions. The
+# tiled mode also scores a grid of overlapping crops at higher detail,
+# each with its mirror image, in one batched forward pass.
+
+TILE_OVERLAP = 0.25
+# A tile at least this sure of disease (score <= 1 - confidence) decides
+# the combined score, blended with the whole photo by TILE_LESION_WEIGHT
+TILE_LESION_CONFIDENCE = 0.8
+TILE_LESION_WEIGHT = 0.75
+
+
+def tile_boxes(width: int, height: int, grid: int) -> list:
+    """Pixel boxes of a grid x grid set of tiles, row by row; each tile
+    extends TILE_OVERLAP of a cell into its neighbours so a lesion on a
+    cell border is seen whole by at least one tile.
+    """
+    boxes = []
+    cell_w, cell_h = width / grid, height / grid
+    for row in range(grid):
+        for col in range(grid):
+            boxes.append((
+                max(0.0, (col - TILE_OVERLAP) * cell_w),
+                max(0.0, (row - TILE_OVERLAP) * cell_h),
+                min(float(width), (col + 1 + TILE_OVERLAP) * cell_w),
+                min(float(height), (row + 1 + TILE_OVERLAP) * cell_h),
+            ))
+    return boxes
+
+
+def tile_image_bytes(image_bytes: bytes, grid: int = 3, flips: bool = True) -> tuple:
+    """Decodes an upload once into a float32 batch: the whole photo, then
+    each tile, every view followed by its horizontal flip when `flips`.
+    Returns the batch and the tile boxes as fractions of the photo.
+    """
+    started = time.perf_counter()
+    # Keep enough resolution for each tile to be downscaled, not upscaled
+    img = open_image(image_bytes, (IMAGE_SIZE[0] * grid, IMAGE_SIZE[1] * grid))
+    decoded = time.perf_counter()
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    boxes = tile_boxes(img.width, img.height, grid)
+    step = 2 if flips else 1
+    batch = np.empty(((len(boxes) + 1) * step,) + IMAGE_SIZE + (3,), dtype=np.float32)
+    for i, box in enumerate([None] + boxes):
+        batch[i * step] = np.asarray(img.resize(IMAGE_SIZE, box=box, reducing_gap=3.0))
+        if flips:
+            batch[i * step + 1] = batch[i * step, :, ::-1]
+
+    PREDICT_STAGE_SECONDS.observe(decoded - started, "pil_decode")
+    PREDICT_STAGE_SECONDS.observe(time.perf_counter() - decoded, "resize")
+    fractions = [
+        (x0 / img.width, y0 / img.height, x1 / img.width, y1 / img.height) for x0, y0, x1, y1 in boxes
+    ]
+    return batch, fractions
+
+
+def aggregate_tile_scores(scores: np.ndarray, boxes: list, grid: int, flips: bool) -> tuple:
+    """Returns the combined score, the whole-photo score and a grid x grid
+    array of tile scores (1 is healthy, as for a single prediction).
+
+    The combined score is a coverage-weighted mean: every view counts in
+    proportion to the share of the photo it sees, the whole photo as 1 and
+    each tile by the area of its box. A lesion seen by one tile would be
+    averaged away by the healthy rest, so when the least healthy tile is
+    at least TILE_LESION_CONFIDENCE sure of disease it drives the result
+    instead, blended with the whole-photo score. Either way it stays a
+    probability on the scale the model was trained for, so the 0.5
+    threshold still applies; `python export_model.py --tiled` checks its
+    accuracy on held-out data.
+    """
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if flips:
+        scores = scores.reshape(-1, 2).mean(axis=1)
+    whole = float(scores[0])
+    tiles = scores[1:].reshape(grid, grid)
+
+    coverage = np.array([(x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes], dtype=np.float32)
+    weights = np.concatenate(([1.0], coverage))
+    combined = float(np.dot(weights, scores) / weights.sum())
+
+    lowest = float(tiles.min())
+    if 1.0 - lowest >= TILE_LESION_CONFIDENCE:
+        combined = min(combined, TILE_LESION_WEIGHT * lowest + (1.0 - TILE_LESION_WEIGHT) * whole)
+    return combined, whole, tiles
+
+
+def predict_tiled(image_bytes: bytes, grid: int = 3, flips: bool = True) -> dict:
+    batch, boxes = tile_image_bytes(image_bytes, grid, flips)
+    with PREDICT_STAGE_SECONDS.time("forward"):
+        scores = run_model_batch(batch)
+    score, whole, tiles = aggregate_tile_scores(scores, boxes, grid, flips)
+    return {
+        "score": score,
+        "wholeImageScore": whole,
+        "grid": grid,
+        "views": len(batch),
+        "tileScores": tiles.tolist(),
+        "boxes": boxes,
+    }
+
+
+class InferencePoolSaturated(Exception):
+    pass
+
+
+class _Slot:
+    """One admitted request: the request itself plus each of its jobs still on a worker."""
+    __slots__ = ("holds",)
+
+    def __init__(self):
+        self.holds = 1
+
+
+# The slot of the request being run by InferencePool.submit, if any
+_current_slot = contextvars.ContextVar("inference_slot", default=None)
+
+
+class InferencePool:
+    """Runs blocking preprocessing and model calls away from the event loop.
+
+    At most `max_pending` requests are admitted at once; anything beyond that
+    is rejected straight away so callers can shed load instead of queueing
+    without bound. Each admitted request is cancelled after `timeout_s`, but
+    a worker cannot be interrupted, so its slot stays taken until the jobs it
+    started have finished. `run` outside a request takes a slot of its own.
+    """
+
+    def __init__(self, workers: int = 2, mode: str = "thread", max_pending: int = 64,
+                 timeout_s: float = 30.0):
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout_s
+
+        if mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+
+        # Job callbacks run on executor threads, so the counts are locked
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _admit(self) -> _Slot:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise InferencePoolSaturated()
+            self.pending += 1
+        return _Slot()
+
+    def _hold(self, slot: _Slot):
+        with self._lock:
+            slot.holds += 1
+
+    def _release(self, slot: _Slot):
+        with self._lock:
+            slot.holds -= 1
+            if slot.holds == 0:
+                self.pending -= 1
+
+    async def run(self, fn, *args):
+        slot = _current_slot.get()
+        if slot is None:
+            return await self._run_holding([self._admit()], fn, *args)
+        return await self.run_for([slot], fn, *args)
+
+    async def run_for(self, slots: list, fn, *args):
+        """Runs one job on behalf of already admitted requests, e.g. a
+        micro-batch; each keeps its slot until the job has finished."""
+        slots = [slot for slot in slots if slot is not None]
+        for slot in slots:
+            self._hold(slot)
+        return await self._run_holding(slots, fn, *args)
+
+    async def _run_holding(self, slots: list, fn, *args):
+        def release(_):
+            for slot in slots:
+                self._release(slot)
+
+        try:
+            job = self.executor.submit(fn, *args)
+        except BaseException:
+            release(None)
+            raise
+        # Released when the worker is done, not when the caller stops waiting
+        job.add_done_callback(release)
+        return await asyncio.wrap_future(job)
+
+    async def submit(self, coro_fn, *args):
+        slot = self._admit()
+        token = _current_slot.set(slot)
+        try:
+            return await asyncio.wait_for(coro_fn(*args), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        finally:
+            _current_slot.reset(token)
+            self._release(slot)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "maxPending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "timedOut": self.timed_out,
+        }
+
+
+class MicroBatcher:
+    """Collects concurrent prediction requests into a single forward pass.
+
+    A batch is dispatched once `max_batch_size` images are waiting or the
+    oldest request has waited `max_wait_ms`, whichever comes first.
+    """
+
+    def __init__(self, predict_fn, max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 pool: "InferencePool" = None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.pool = pool
+
+        self.batch_sizes = Histogram(buckets=(1, 2, 4, 8, 16, 32, 64))
+        self.queue_wait_ms = Histogram(buckets=(0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500))
+
+        self._queue = None
+        self._worker = None
+        self._loop = None
+        self._buffer = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, image: np.ndarray) -> float:
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        # The request's pool slot, held by the forward pass its image joins
+        await self._queue.put((image, future, time.perf_counter(), _current_slot.get()))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._collect()
+            dispatched_at = time.perf_counter()
+
+            # Requests that timed out while queued no longer need a slot
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            self.batch_sizes.observe(len(batch))
+            for _, _, enqueued_at, _ in batch:
+                self.queue_wait_ms.observe((dispatched_at - enqueued_at) * 1000.0)
+
+            images = self._fill_buffer([image for image, _, _, _ in batch])
+            try:
+                with PREDICT_STAGE_SECONDS.time("forward"):
+                    if self.pool is not None:
+                        scores = await self.pool.run_for([slot for _, _, _, slot in batch], self.predict_fn, images)
+                    else:
+                        scores = await loop.run_in_executor(None, self.predict_fn, images)
+            except Exception as err:
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(err)
+                continue
+
+            for i, (_, future, _, _) in enumerate(batch):
+                if not future.done():
+                    future.set_result(float(scores[i][0]))
+
+    def _fill_buffer(self, images: list) -> np.ndarray:
+        # Batches run one at a time, so a single float32 buffer can be reused
+        shape = images[0].shape
+        if self._buffer is None or self._buffer.shape[1:] != shape:
+            self._buffer = np.empty((self.max_batch_size,) + shape, dtype=np.float32)
+        return np.stack(images, out=self._buffer[:len(images)])
+
+    def stats(self) -> dict:
+        return {
+            "maxBatchSize": self.max_batch_size,
+            "maxWaitMs": self.max_wait * 1000.0,
+            "queueDepth": self._queue.qsize() if self._queue is not None else 0,
+            "batchSize": self.batch_sizes.snapshot(),
+            "queueWaitMs": self.queue_wait_ms.snapshot(),
+        }
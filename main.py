@@ -1,58 +1,225 @@
-from fastapi import FastAPI, HTTPException
+import time
+STARTUP_BEGAN = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
+import base64
 import json
+import logging
 import os
-import base64
-import numpy as np
-from io import BytesIO
-from PIL import Image
-import smtplib
-from email.mime.text import MIMEText
-import tensorflow as tf
-from datetime import datetime
+import blobstore
+import database
+from geoindex import AlertIndex, resolve_location
+from recent_reports import RecentReports, decode_cursor, encode_cursor
+import notifications
+from notifications import notifier
+from inference import (
+    InferencePool,
+    InferencePoolSaturated,
+    InvalidImageError,
+    MicroBatcher,
+    decode_image_data,
+    image_digest,
+    load_image_payload,
+    load_plant_model,
+    model_status,
+    model_version,
+    predict_tiled,
+    preprocess_image_bytes,
+    run_model_batch,
+    upload_digest,
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry
+from prediction_cache import PredictionCache, perceptual_hash
+from response_cache import ResponseCache
+from view_counter import ViewCounter
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger("uvicorn.error")
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    global model_load_task
+    stages = [("module import", APP_IMPORTED - STARTUP_BEGAN)]
+    
+    async def stage(name, work):
+        began = time.perf_counter()
+        await work
+        stages.append((name, time.perf_counter() - began))
+    
+    if MODEL_LOAD_MODE == "eager":
+        await stage("model", load_model_in_pool())
+    elif MODEL_LOAD_MODE == "background":
+        model_load_task = asyncio.create_task(load_model_in_pool())
+    
+    await stage("inline images", asyncio.to_thread(migrate_inline_images))
+    await stage("alert index", asyncio.to_thread(load_alert_index))
+    await stage("recent reports", asyncio.to_thread(load_recent_reports))
+    await stage("lookup plans", asyncio.to_thread(database.check_lookup_plans))
+    view_counter.start()
+    if notifications.email_configured():
+        notifier.start()
+    
+    logger.info(
+        "API ready in %.2fs (model load mode: %s; %s)",
+        time.perf_counter() - STARTUP_BEGAN, MODEL_LOAD_MODE,
+        ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stages)
+    )
+    yield
+    await asyncio.to_thread(notifier.stop)
+    await asyncio.to_thread(view_counter.stop)
+    inference_pool.executor.shutdown(wait=False, cancel_futures=True)
+    database.close_connections()
+
+app = FastAPI(lifespan=lifespan)
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
-MODEL_PATH = os.path.join(BASE_DIR, "plant.keras")
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
-PRODUCTS_FILE = os.path.join(DATA_DIR, "products.json")
-ALERTS_FILE = os.path.join(DATA_DIR, "alert_registrations.json")
-DISEASE_REPORTS_FILE = os.path.join(DATA_DIR, "disease_reports.json")
-DETECTION_HISTORY_FILE = os.path.join(DATA_DIR, "detection_history.json")
-
-EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
-EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 COMMUNITY_EMAIL = os.getenv('COMMUNITY_EMAIL')
 
-plant_model = None
 PLANT_CLASSES = ["diseased", "healthy"]
 TOKEN_PRICE = 49.99
 
+PREDICT_MAX_BATCH_SIZE = int(os.getenv('PREDICT_MAX_BATCH_SIZE', '8'))
+PREDICT_MAX_WAIT_MS = float(os.getenv('PREDICT_MAX_WAIT_MS', '5'))
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '2'))
+INFERENCE_WORKER_MODE = os.getenv('INFERENCE_WORKER_MODE', 'thread')
+INFERENCE_MAX_PENDING = int(os.getenv('INFERENCE_MAX_PENDING', '64'))
+INFERENCE_TIMEOUT_S = float(os.getenv('INFERENCE_TIMEOUT_S', '30'))
+INFERENCE_RETRY_AFTER_S = int(os.getenv('INFERENCE_RETRY_AFTER_S', '2'))
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # boundaries, part headers and small fields around the image
+INVALID_IMAGE_DETAIL = "The upload is not a readable image (JPEG, PNG, WebP, ...)"
+MODEL_LOAD_MODE = os.getenv('MODEL_LOAD_MODE', 'background')
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', '1') == '1'
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '1024'))
+PREDICTION_CACHE_TTL_S = float(os.getenv('PREDICTION_CACHE_TTL_S', '3600'))
+PREDICTION_CACHE_PERCEPTUAL = os.getenv('PREDICTION_CACHE_PERCEPTUAL', '0') == '1'
+TILED_PREDICT_GRID = max(1, int(os.getenv('TILED_PREDICT_GRID', '3')))
+TILED_PREDICT_FLIPS = os.getenv('TILED_PREDICT_FLIPS', '1') == '1'
+ALERT_FANOUT_BATCH_SIZE = int(os.getenv('ALERT_FANOUT_BATCH_SIZE', '500'))
+ALERT_INDEX_CATCH_UP_BATCH = 10000
+RECENT_ALERTS_WINDOW = int(os.getenv('RECENT_ALERTS_WINDOW', '100'))
+RECENT_ALERTS_MAX_LIMIT = 50
+RECENT_ALERTS_CATCH_UP_LIMIT = 1000
+PRODUCTS_PAGE_SIZE = 50
+PRODUCTS_MAX_PAGE_SIZE = 200
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+EXPORT_CHUNK_BYTES = 1024 * 1024  # cap per streamed chunk when photos are inlined
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '512'))
+RESPONSE_CACHE_TTL_S = float(os.getenv('RESPONSE_CACHE_TTL_S', '30'))
+VIEW_FLUSH_INTERVAL_S = float(os.getenv('VIEW_FLUSH_INTERVAL_S', '2'))
+VIEW_FLUSH_THRESHOLD = int(os.getenv('VIEW_FLUSH_THRESHOLD', '1000'))
+
+
+inference_pool = InferencePool(
+    workers=INFERENCE_WORKERS,
+    mode=INFERENCE_WORKER_MODE,
+    max_pending=INFERENCE_MAX_PENDING,
+    timeout_s=INFERENCE_TIMEOUT_S,
+)
 
-def initialize_plant_model():
-    global plant_model
-    if plant_model is not None:
-        return plant_model
-    
-    if not os.path.exists(MODEL_PATH):
-        return None
-    
-    try:
-        plant_model = tf.keras.models.load_model(MODEL_PATH)
-        return plant_model
-    except Exception:
-        return None
+prediction_batcher = MicroBatcher(
+    run_model_batch,
+    max_batch_size=PREDICT_MAX_BATCH_SIZE,
+    max_wait_ms=PREDICT_MAX_WAIT_MS,
+    pool=inference_pool,
+)
 
-initialize_plant_model()
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    ttl_s=PREDICTION_CACHE_TTL_S,
+)
+
+# Listing bodies keyed by resource; write paths bump the resource's version
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl_s=RESPONSE_CACHE_TTL_S,
+)
+
+# Flushed view counts do not bump "products": that would empty the listing
+# cache every flush interval. Cached listings show counts up to
+# RESPONSE_CACHE_TTL_S old; the view endpoint itself is always current.
+view_counter = ViewCounter(
+    database.add_product_views,
+    interval_s=VIEW_FLUSH_INTERVAL_S,
+    threshold=VIEW_FLUSH_THRESHOLD,
+)
+
+alert_index = AlertIndex()
+recent_reports = RecentReports(capacity=RECENT_ALERTS_WINDOW)
+
+model_load_task = None
+
+
+# --- Metrics ---
+# Counters the caches and workers already keep are read when /metrics is
+# scraped, so the request path pays nothing extra for them
+
+CACHES = {"prediction": prediction_cache, "response": response_cache, "recent_reports": recent_reports}
+
+registry.callback("cache_hits_total", "Lookups answered from the cache.",
+                  lambda: {name: cache.hits for name, cache in CACHES.items()}, kind="counter", labels=("cache",))
+registry.callback("cache_misses_total", "Lookups the cache could not answer.",
+                  lambda: {"prediction": prediction_cache.misses, "response": response_cache.misses,
+                           "recent_reports": recent_reports.fallbacks}, kind="counter", labels=("cache",))
+registry.callback("cache_entries", "Entries held by the cache.",
+                  lambda: {"prediction": len(prediction_cache), "response": len(response_cache)},
+                  labels=("cache",))
+registry.callback("response_cache_not_modified_total", "Conditional requests answered with 304.",
+                  lambda: response_cache.not_modified, kind="counter")
+registry.histogram("predict_batch_size", "Images per model forward pass.",
+                   histogram=prediction_batcher.batch_sizes)
+registry.histogram("predict_queue_wait_milliseconds", "Time an image waits for its batch.",
+                   histogram=prediction_batcher.queue_wait_ms)
+registry.callback("predict_queue_depth", "Images waiting for a batch.",
+                  lambda: prediction_batcher.stats()["queueDepth"])
+registry.callback("inference_pending", "Predictions admitted to the inference pool.",
+                  lambda: inference_pool.pending)
+registry.callback("inference_rejected_total", "Predictions turned away because the pool was full.",
+                  lambda: inference_pool.rejected, kind="counter")
+registry.callback("model_ready", "1 when the disease model is loaded.",
+                  lambda: model_status["state"] == "ready")
+registry.callback("email_outbox_messages", "Emails in the outbox by status.",
+                  database.count_emails_by_status, labels=("status",))
+registry.callback("email_queue_depth", "Emails waiting to be sent.",
+                  lambda: notifier.stats()["queueDepth"])
+registry.callback("email_delivery_total", "Email delivery attempts by outcome.",
+                  lambda: {"sent": notifier.sent, "retried": notifier.retried, "failed": notifier.failed,
+                           "deduplicated": notifier.deduplicated}, kind="counter", labels=("outcome",))
+registry.callback("product_views_pending", "Product views counted in memory, not yet flushed.",
+                  lambda: view_counter.stats()["pendingViews"])
+registry.callback("product_view_flushes_total", "Batched product view writes.",
+                  lambda: view_counter.flushes, kind="counter")
+registry.callback("alert_registrations_indexed", "Alert registrations in the geo index.",
+                  lambda: alert_index.stats()["registrations"])
+registry.callback("db_file_bytes", "Size of the SQLite database files.", database.file_sizes, labels=("file",))
+
+
+async def load_model_in_pool():
+    # Runs on an inference worker so process-mode workers hold the model and
+    # the event loop keeps serving the rest of the API meanwhile
+    try:
+        status = await inference_pool.run(load_plant_model, MODEL_WARMUP)
+    except Exception as err:
+        model_status.update(state="failed", error=str(err))
+        logger.error("Model load failed: %s", err)
+        return
+    
+    model_status.update(status)
+    timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in status["timings"].items())
+    logger.info("Model %s (%s): %s", status["state"], status["backend"], timings or status["error"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -60,7 +227,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
+# Added last so it is outermost and times the whole request
+app.add_middleware(MetricsMiddleware)
 
 class UserCreate(BaseModel):
     name: str
@@ -87,12 +257,16 @@ class ProductCreate(BaseModel):
 
 class ImageData(BaseModel):
     image: str
+    tiled: bool = False
 
 class AlertRegistration(BaseModel):
     farmerName: str
     phoneNumber: str
     cropTypes: str
     alertRadius: int
+    email: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class DiseaseReport(BaseModel):
     diseaseName: str
@@ -100,6 +274,8 @@ class DiseaseReport(BaseModel):
     severity: str
     description: Optional[str] = None
     location: Optional[str] = "Bharatpur"
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class EmailAlert(BaseModel):
     email: str
@@ -113,53 +289,66 @@ class DetectionRecord(BaseModel):
     prediction: str
     confidence: float
 
-def read_json_file(filepath):
-    if not os.path.exists(filepath):
-        return []
-    with open(filepath, "r") as file:
-        return json.load(file)
 
-def write_json_file(filepath, data):
-    with open(filepath, "w") as file:
-        json.dump(data, file, indent=2)
+# --- Response Formatting (rows are snake_case, the API is camelCase) ---
 
-def get_current_month():
-    return datetime.now().strftime("%Y-%m")
+def format_user(user: dict) -> dict:
+    return {
+        "id": user["id"],
+        "name": user["name"],
+        "type": user["type"],
+        "credits": user["credits"],
+        "friends": user.get("friends", []),
+        "tokens": user["tokens"],
+        "lastTokenReset": user["last_token_reset"]
+    }
 
-def check_and_reset_monthly_tokens(user):
-    current_month = get_current_month()
-    last_reset = user.get("lastTokenReset", "")
-    
-    if last_reset != current_month:
-        user["tokens"] = 5
-        user["lastTokenReset"] = current_month
-        return True
-    return False
+def format_ledger_entry(entry: dict) -> dict:
+    return {
+        "id": entry["id"],
+        "account": entry["account"],
+        "delta": entry["delta"],
+        "balance": entry["balance"],
+        "reason": entry["reason"],
+        "createdAt": entry["created_at"]
+    }
 
-def prepare_image_for_prediction(image_data: str) -> np.ndarray:
-    if ',' in image_data:
-        image_data = image_data.split(',')[1]
-    
-    decoded_bytes = base64.b64decode(image_data)
-    img = Image.open(BytesIO(decoded_bytes))
-    
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-    
-    img = img.resize((160, 160))
-    img_array = np.array(img, dtype=np.float32)
-    img_array = np.expand_dims(img_array, axis=0)
-    
-    return img_array
+def format_report(report: dict) -> dict:
+    return {
+        "id": report["id"],
+        "diseaseName": report["disease_name"],
+        "location": report["location"],
+        "cropType": report["crop_type"],
+        "severity": report["severity"],
+        "description": report["description"],
+        "reporterPhone": report["reporter_phone"],
+        "reportedAt": report["reported_at"],
+        "status": report["status"],
+        "latitude": report["latitude"],
+        "longitude": report["longitude"]
+    }
 
+def format_registration(registration: dict) -> dict:
+    result = {
+        "id": registration["id"],
+        "farmerName": registration["farmer_name"],
+        "phoneNumber": registration["phone_number"],
+        "location": registration["location"],
+        "cropTypes": registration["crop_types"],
+        "alertRadius": registration["alert_radius"],
+        "email": registration["email"],
+        "latitude": registration["latitude"],
+        "longitude": registration["longitude"],
+        "registeredAt": registration["registered_at"],
+        "isActive": bool(registration["is_active"])
+    }
+    if registration["updated_at"]:
+        result["updatedAt"] = registration["updated_at"]
+    return result
 
-async def send_disease_alert_email(recipient: str, disease: str, crop: str, location: str) -> bool:
-    if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
-        return False
-    
-    try:
-        subject = f"Crop Disease Alert: {disease} detected in {crop}"
-        body = f"""Disease Alert Notification - Gaun Roots
+def disease_alert_message(disease: str, crop: str, location: str):
+    subject = f"Crop Disease Alert: {disease} detected in {crop}"
+    body = f"""Disease Alert Notification - Gaun Roots
 
 A disease outbreak has been reported in your area.
 Disease: {disease}
@@ -170,68 +359,117 @@ Please inspect your crops immediately and take necessary preventive measures.
 
 Stay safe,
 Gaun Roots Team"""
-        
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = recipient
-        
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            server.send_message(msg)
-        
-        return True
-        
-    except Exception:
-        return False
+    return subject, body
 
-async def alert_nearby_farmers(location: str, disease: str, crop: str):
-    notifications_sent = 0
+def queue_disease_alert_email(recipient: str, disease: str, crop: str, location: str) -> bool:
+    """Hands the alert to the background delivery worker; False if email is off or it is a repeat."""
+    if not notifications.email_configured():
+        return False
+    
+    subject, body = disease_alert_message(disease, crop, location)
+    return notifier.enqueue(recipient, subject, body)
+
+def index_registration(reg_id, location, latitude, longitude, radius, crop_types, is_active=True):
+    point = (latitude, longitude) if latitude is not None else resolve_location(location)
+    if is_active and point is not None:
+        alert_index.add(reg_id, point[0], point[1], radius, crop_types)
+    else:
+        alert_index.remove(reg_id)
+
+def load_alert_index():
+    revision = database.get_alert_registrations_revision()
+    for row in database.iter_active_alert_registrations():
+        index_registration(*row)
+    alert_index.revision = revision
+    logger.info("Alert index loaded: %d registrations", len(alert_index))
+
+def sync_alert_index():
+    # Registrations are made on every worker; an indexed max(revision) shows
+    # whether this process's index is behind, and only changed rows are read
+    if database.get_alert_registrations_revision() <= alert_index.revision:
+        return
+    while True:
+        changed = database.get_alert_registrations_changed_since(alert_index.revision, ALERT_INDEX_CATCH_UP_BATCH)
+        for *row, revision in changed:
+            index_registration(*row)
+            alert_index.revision = max(alert_index.revision, revision)
+        if len(changed) < ALERT_INDEX_CATCH_UP_BATCH:
+            break
+
+def load_recent_reports():
+    last_id = database.get_latest_disease_report_id()
+    recent_reports.load(database.get_recent_disease_reports_by_location(RECENT_ALERTS_WINDOW + 1), last_id)
+
+def sync_recent_reports():
+    # Other workers file reports too; an indexed max(id) shows whether this
+    # process's windows missed any, and only those rows are read
+    if database.get_latest_disease_report_id() <= recent_reports.last_id:
+        return
+    missed = database.get_disease_reports_after(recent_reports.last_id, RECENT_ALERTS_CATCH_UP_LIMIT + 1)
+    if len(missed) > RECENT_ALERTS_CATCH_UP_LIMIT:
+        load_recent_reports()
+    else:
+        recent_reports.catch_up(missed)
+    response_cache.bump("alerts")
+
+def alert_nearby_farmers(location: str, disease: str, crop: str,
+                         latitude: Optional[float] = None, longitude: Optional[float] = None) -> int:
+    notifications_queued = 0
     
     try:
         if COMMUNITY_EMAIL:
-            success = await send_disease_alert_email(COMMUNITY_EMAIL, disease, crop, location)
-            if success:
-                notifications_sent += 1
+            if queue_disease_alert_email(COMMUNITY_EMAIL, disease, crop, location):
+                notifications_queued += 1
         
-        return notifications_sent
-    except Exception:
-        return 0
+        point = (latitude, longitude) if latitude is not None and longitude is not None else resolve_location(location)
+        if point is None or not notifications.email_configured():
+            return notifications_queued
+        
+        sync_alert_index()
+        
+        # Registrations whose own alert radius covers the report and who grow this crop
+        matches = alert_index.match(point[0], point[1], crop)
+        subject, body = disease_alert_message(disease, crop, location)
+        
+        batch = []
+        for _, _, email in database.get_alert_contacts(matches):
+            batch.append((email, subject, body))
+            if len(batch) >= ALERT_FANOUT_BATCH_SIZE:
+                notifications_queued += notifier.enqueue_many(batch)
+                batch = []
+        notifications_queued += notifier.enqueue_many(batch)
+        
+        return notifications_queued
+    except Exception as err:
+        logger.error("Failed to queue disease alerts: %s", err)
+        return notifications_queued
 
 @app.post("/api/register-alerts")
-async def register_for_alerts(registration: AlertRegistration):
+def register_for_alerts(registration: AlertRegistration):
     try:
-        alerts = read_json_file(ALERTS_FILE)
-        
-        existing_reg = None
-        for alert in alerts:
-            if alert["phoneNumber"] == registration.phoneNumber:
-                existing_reg = alert
-                break
-        
         detected_location = "Bharatpur"
         
-        if existing_reg:
-            existing_reg.update(registration.model_dump())
-            existing_reg["location"] = detected_location
-            existing_reg["updatedAt"] = "2024-12-14T00:00:00Z"
-            result = existing_reg
-        else:
-            new_reg = registration.model_dump()
-            new_reg["id"] = len(alerts) + 1
-            new_reg["location"] = detected_location
-            new_reg["registeredAt"] = "2024-12-14T00:00:00Z"
-            new_reg["isActive"] = True
-            alerts.append(new_reg)
-            result = new_reg
+        latitude, longitude = registration.latitude, registration.longitude
+        if latitude is None or longitude is None:
+            latitude, longitude = resolve_location(detected_location) or (None, None)
         
-        write_json_file(ALERTS_FILE, alerts)
+        result = database.create_or_update_alert_registration(
+            registration.farmerName,
+            registration.phoneNumber,
+            registration.cropTypes,
+            registration.alertRadius,
+            location=detected_location,
+            email=registration.email,
+            latitude=latitude,
+            longitude=longitude
+        )
+        if latitude is not None:
+            alert_index.add(result["id"], latitude, longitude, result["alert_radius"], result["crop_types"])
         
         return {
             "success": True,
             "message": f"Alert registration successful for {detected_location}",
-            "registration": result
+            "registration": format_registration(result)
         }
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Registration error: {str(err)}")
@@ -240,29 +478,35 @@ async def register_for_alerts(registration: AlertRegistration):
 @app.post("/api/report-disease")
 async def report_disease(report: DiseaseReport):
     try:
-        reports = read_json_file(DISEASE_REPORTS_FILE)
-        
         detected_location = "Bharatpur"
         
-        new_report = report.model_dump()
-        new_report["id"] = len(reports) + 1
-        new_report["location"] = detected_location
-        new_report["reportedAt"] = "2024-12-14T00:00:00Z"
-        new_report["status"] = "pending_verification"
-        
-        reports.append(new_report)
-        write_json_file(DISEASE_REPORTS_FILE, reports)
+        new_report = await asyncio.to_thread(
+            database.create_disease_report,
+            report.diseaseName,
+            report.cropType,
+            report.severity,
+            report.description,
+            detected_location,
+            latitude=report.latitude,
+            longitude=report.longitude
+        )
+        recent_reports.add(new_report)
+        response_cache.bump("alerts")
         
-        farmers_notified = await alert_nearby_farmers(
-            detected_location, 
-            report.diseaseName, 
-            report.cropType
+        # Only queued here; delivery happens on the notification worker
+        farmers_notified = await asyncio.to_thread(
+            alert_nearby_farmers,
+            detected_location,
+            report.diseaseName,
+            report.cropType,
+            report.latitude,
+            report.longitude
         )
         
         return {
             "success": True,
             "message": f"Disease report submitted for {detected_location}",
-            "report": new_report,
+            "report": format_report(new_report),
             "notified_farmers": farmers_notified
         }
     except Exception as err:
@@ -270,35 +514,34 @@ async def report_disease(report: DiseaseReport):
 
 
 @app.post("/api/send-alert")
-async def send_alert(alert: EmailAlert):
+def send_alert(alert: EmailAlert):
+    if not notifications.email_configured():
+        raise HTTPException(status_code=500, detail="Email delivery is not configured")
+    
     try:
-        success = await send_disease_alert_email(
+        queued = queue_disease_alert_email(
             alert.email, 
             alert.disease, 
             alert.crop, 
             alert.location
         )
         
-        if success:
-            return {
-                "success": True,
-                "message": f"Alert sent to {alert.email}",
-                "details": {
-                    "email": alert.email,
-                    "disease": alert.disease,
-                    "crop": alert.crop,
-                    "location": alert.location
-                }
+        return {
+            "success": True,
+            "message": f"Alert queued for {alert.email}" if queued else f"Alert already queued for {alert.email}",
+            "details": {
+                "email": alert.email,
+                "disease": alert.disease,
+                "crop": alert.crop,
+                "location": alert.location
             }
-        else:
-            raise HTTPException(status_code=500, detail="Email delivery failed")
-            
+        }
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Alert error: {str(err)}")
 
 
 @app.post("/api/send-community-alert")
-async def send_community_alert():
+def send_community_alert():
     try:
         demo_data = {
             "disease": "Late Blight",
@@ -306,7 +549,7 @@ async def send_community_alert():
             "location": "Bharatpur"
         }
         
-        notifications = await alert_nearby_farmers(
+        queued = alert_nearby_farmers(
             demo_data["location"],
             demo_data["disease"],
             demo_data["crop"]
@@ -314,191 +557,548 @@ async def send_community_alert():
         
         return {
             "success": True,
-            "message": "Community alert broadcast complete",
-            "notifications_sent": notifications
+            "message": "Community alert broadcast queued",
+            "notifications_sent": queued
         }
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Community alert error: {str(err)}")
 
 
+def recent_alerts_page(location: Optional[str], limit: int, before: Optional[tuple]) -> dict:
+    page = recent_reports.page(location, limit, before)
+    if page is None:
+        # Past the in-memory window: keyset query on the (location_key, reported_at, id) index
+        reports = database.get_recent_disease_reports(location, limit + 1, before)
+        page = reports[:limit], len(reports) > limit
+    reports, has_more = page
+    
+    return {
+        "success": True,
+        "alerts": [format_report(r) for r in reports],
+        "nextCursor": encode_cursor(reports[-1]) if has_more and reports else None
+    }
+
 @app.get("/api/recent-alerts")
-async def get_recent_alerts(location: Optional[str] = None):
+def get_recent_alerts(request: Request, location: Optional[str] = None, limit: int = 10,
+                      cursor: Optional[str] = None):
+    limit = max(1, min(limit, RECENT_ALERTS_MAX_LIMIT))
+    before = None
+    if cursor:
+        try:
+            before = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
     try:
-        reports = read_json_file(DISEASE_REPORTS_FILE)
-        
-        if location:
-            reports = [r for r in reports if location.lower() in r["location"].lower()]
-        
-        sorted_reports = sorted(reports, key=lambda x: x["reportedAt"], reverse=True)[:10]
-        
-        return {
-            "success": True,
-            "alerts": sorted_reports
-        }
+        sync_recent_reports()
+        return response_cache.respond(
+            request, "alerts", (location and database.location_key(location), limit, before),
+            lambda: recent_alerts_page(location, limit, before)
+        )
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve alerts: {str(err)}")
 
-@app.post("/api/predict")
-async def predict_plant_disease(data: ImageData):
-    model = initialize_plant_model()
-    if model is None:
-        raise HTTPException(status_code=500, detail="Disease detection model unavailable")
+async def predict_image(image_data: str, tiled: bool = False):
+    image_bytes, digest = await inference_pool.run(load_image_payload, image_data)
+    if tiled:
+        return await predict_tiled_bytes(image_bytes, digest)
+    return await predict_image_bytes(image_bytes, digest)
+
+async def predict_image_bytes(image_bytes: bytes, digest: Optional[str] = None) -> float:
+    if digest is None:
+        digest = await inference_pool.run(image_digest, image_bytes)
+    version = model_version()
+    
+    cached_score = prediction_cache.get(digest, version)
+    if cached_score is not None:
+        return cached_score
+    
+    processed_img = await inference_pool.run(preprocess_image_bytes, image_bytes)
+    
+    # Near-duplicate lookup: re-encoded or slightly resized copies of a photo
+    # share a perceptual hash even though their bytes differ
+    perceptual_key = None
+    if PREDICTION_CACHE_PERCEPTUAL:
+        perceptual_key = "p:" + perceptual_hash(processed_img)
+        cached_score = prediction_cache.get(perceptual_key, version)
+        if cached_score is not None:
+            prediction_cache.put(digest, version, cached_score)
+            return cached_score
+    
+    confidence_score = await prediction_batcher.submit(processed_img)
+    prediction_cache.put(digest, version, confidence_score)
+    if perceptual_key:
+        prediction_cache.put(perceptual_key, version, confidence_score)
+    return confidence_score
+
+async def predict_tiled_bytes(image_bytes: bytes, digest: Optional[str] = None) -> dict:
+    # Tiles and flips go through the model as one batch of their own rather
+    # than through the micro-batcher, whose buffer holds single images
+    if digest is None:
+        digest = await inference_pool.run(image_digest, image_bytes)
+    version = model_version()
+    cache_key = f"tiled:{TILED_PREDICT_GRID}:{int(TILED_PREDICT_FLIPS)}:{digest}"
+    
+    cached = prediction_cache.get(cache_key, version)
+    if cached is not None:
+        return cached
+    
+    result = await inference_pool.run(predict_tiled, image_bytes, TILED_PREDICT_GRID, TILED_PREDICT_FLIPS)
+    prediction_cache.put(cache_key, version, result)
+    return result
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Image exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"
+    )
+
+async def read_multipart_image(request: Request, boundary: bytes) -> bytearray:
+    """Collects the 'image' part while the body streams in.
+    
+    request.form() spools the whole file before it can be measured, so a
+    chunked upload (no Content-Length) could get past the limit. Here the
+    body and the image part are counted chunk by chunk and the upload is
+    refused as soon as either goes over.
+    """
+    image = bytearray()
+    part = {"header": b"", "value": b"", "is_image": False, "found": False}
+    
+    def on_part_begin():
+        part["is_image"] = False
+    
+    def on_header_field(data, start, end):
+        part["header"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+    
+    def on_header_end():
+        if part["header"].lower() == b"content-disposition":
+            _, options = parse_options_header(part["value"])
+            if options.get(b"name") == b"image" and b"filename" in options and not part["found"]:
+                part["is_image"] = part["found"] = True
+        part["header"], part["value"] = b"", b""
+    
+    def on_part_data(data, start, end):
+        if part["is_image"]:
+            image.extend(memoryview(data)[start:end])
+            if len(image) > MAX_UPLOAD_BYTES:
+                raise upload_too_large()
+    
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_data": on_part_data,
+    })
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+            raise upload_too_large()
+        try:
+            parser.write(chunk)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Malformed multipart body")
+    parser.finalize()
     
+    if not part["found"]:
+        raise HTTPException(status_code=400, detail="Expected an 'image' file field")
+    return image
+
+async def read_image_upload(request: Request) -> bytearray:
+    # The buffer is handed on as-is: hashing, decoding (via BytesIO) and the
+    # blob store all accept it, so the upload is never copied into bytes
+    content_type = request.headers.get("content-type", "")
+    media_type, options = parse_options_header(content_type)
+    is_multipart = media_type == b"multipart/form-data"
+    limit = MAX_UPLOAD_BYTES + (MULTIPART_OVERHEAD_BYTES if is_multipart else 0)
+    
+    declared_length = request.headers.get("content-length")
+    if declared_length and declared_length.isdigit() and int(declared_length) > limit:
+        raise upload_too_large()
+    
+    if is_multipart:
+        if not options.get(b"boundary"):
+            raise HTTPException(status_code=400, detail="Missing multipart boundary")
+        image_bytes = await read_multipart_image(request, options[b"boundary"])
+    elif media_type.startswith(b"image/") or media_type == b"application/octet-stream":
+        image_bytes = bytearray()
+        async for chunk in request.stream():
+            image_bytes += chunk
+            if len(image_bytes) > MAX_UPLOAD_BYTES:
+                raise upload_too_large()
+    else:
+        raise HTTPException(status_code=415, detail="Send the image as multipart/form-data or an image/* body")
+    
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    return image_bytes
+
+def check_model_available():
+    state = model_status["state"]
+    if state == "loading":
+        raise HTTPException(
+            status_code=503,
+            detail="Disease detection model is still loading. Please retry shortly.",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER_S)}
+        )
+    
+    current_version = model_version()
+    if current_version is None or (state == "failed" and model_status["version"] == current_version):
+        raise HTTPException(status_code=500, detail="Disease detection model unavailable")
+
+def inference_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Disease detection is busy. Please retry shortly.",
+        headers={"Retry-After": str(INFERENCE_RETRY_AFTER_S)}
+    )
+
+async def run_prediction(coro_fn, *args) -> float:
     try:
-        processed_img = prepare_image_for_prediction(data.image)
-        prediction = model.predict(processed_img, verbose=0)
-        confidence_score = float(prediction[0][0])
-        is_healthy = confidence_score >= 0.5
-        
-        return {
-            "prediction": "healthy" if is_healthy else "diseased",
-            "confidence": confidence_score if is_healthy else (1 - confidence_score),
-            "raw_score": confidence_score
-        }
+        return await inference_pool.submit(coro_fn, *args)
+    except InferencePoolSaturated:
+        raise inference_busy()
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Prediction timed out")
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail=INVALID_IMAGE_DETAIL)
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(err)}")
 
+async def check_upload_image(image_bytes: bytes, decode: bool = False) -> str:
+    """Returns the upload's digest, or 400 if it is not an image, before any model work."""
+    try:
+        return await inference_pool.run(upload_digest, image_bytes, decode)
+    except InferencePoolSaturated:
+        raise inference_busy()
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail=INVALID_IMAGE_DETAIL)
+
+def format_prediction(confidence_score: float) -> dict:
+    is_healthy = confidence_score >= 0.5
+    return {
+        "prediction": "healthy" if is_healthy else "diseased",
+        "confidence": confidence_score if is_healthy else (1 - confidence_score),
+        "raw_score": confidence_score
+    }
+
+def format_tiled_prediction(result: dict) -> dict:
+    grid = result["grid"]
+    # Heatmap cells are disease probabilities, so lesions show up as hot spots
+    heatmap = [[1 - score for score in row] for row in result["tileScores"]]
+    return {
+        **format_prediction(result["score"]),
+        "mode": "tiled",
+        "wholeImageScore": result["wholeImageScore"],
+        "views": result["views"],
+        "heatmap": heatmap,
+        "tiles": [
+            {"row": i // grid, "col": i % grid, "box": list(box), "diseaseProbability": heatmap[i // grid][i % grid]}
+            for i, box in enumerate(result["boxes"])
+        ]
+    }
+
+async def run_image_prediction(image_bytes: bytes, digest: Optional[str], tiled: bool) -> dict:
+    if tiled:
+        return format_tiled_prediction(await run_prediction(predict_tiled_bytes, image_bytes, digest))
+    return format_prediction(await run_prediction(predict_image_bytes, image_bytes, digest))
+
+@app.post("/api/predict")
+async def predict_plant_disease(data: ImageData):
+    check_model_available()
+    if data.tiled:
+        return format_tiled_prediction(await run_prediction(predict_image, data.image, True))
+    confidence_score = await run_prediction(predict_image, data.image)
+    return format_prediction(confidence_score)
+
+@app.post("/api/predict/upload")
+async def predict_uploaded_image(request: Request, tiled: bool = False):
+    check_model_available()
+    image_bytes = await read_image_upload(request)
+    digest = await check_upload_image(image_bytes)
+    return await run_image_prediction(image_bytes, digest, tiled)
+
+
+@app.get("/api/predict/stats")
+async def get_prediction_stats():
+    return {
+        "batcher": prediction_batcher.stats(),
+        "pool": inference_pool.stats(),
+        "cache": prediction_cache.stats()
+    }
+
+
+@app.get("/api/cache/stats")
+def get_response_cache_stats():
+    return response_cache.stats()
+
+@app.get("/api/alerts/index/stats")
+def get_alert_index_stats():
+    return {**alert_index.stats(), "recentReports": recent_reports.stats()}
+
+
+@app.get("/api/notifications/stats")
+def get_notification_stats():
+    return notifier.stats()
+
+
+# --- Health Endpoints ---
+
+@app.get("/api/health")
+async def health():
+    return {"status": "ok", "model": model_status["state"]}
+
+@app.get("/api/health/model")
+async def model_health():
+    if model_status["state"] != "ready":
+        raise HTTPException(status_code=503, detail=dict(model_status))
+    return model_status
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text format; a plain def so the outbox count runs off the event loop
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# --- Page Cursors ---
+# Opaque to clients: the keyset position of the last row on a page
+
+def encode_page_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_page_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size or not isinstance(values[-1], int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
 
 # --- Detection History Endpoints ---
 
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def store_history_image(image_data: str) -> str:
+    """Raises ValueError (binascii.Error included) for a payload that is not base64 image data."""
+    image_bytes = decode_image_data(image_data)
+    if not image_bytes:
+        raise ValueError("Empty image")
+    return blobstore.save_image(image_bytes)
+
+def migrate_inline_images():
+    # Older records carry the base64 photo inline; move it into the blob store
+    while True:
+        records = database.get_inline_detection_images()
+        if not records:
+            break
+        for record in records:
+            try:
+                image_id = store_history_image(record["image"])
+            except ValueError as err:
+                # Clearing the payload keeps the record but stops it being picked up again
+                logger.warning("Dropping undecodable image of detection record %s: %s", record["id"], err)
+                image_id = None
+            database.set_detection_image_id(record["id"], image_id)
+
+def format_history_summary(record: dict) -> dict:
+    result = {
+        "id": record["id"],
+        "prediction": record["prediction"],
+        "confidence": record["confidence"],
+        "timestamp": record["timestamp"]
+    }
+    if record["image_id"]:
+        result["thumbnailUrl"] = f"/api/images/{record['image_id']}/thumbnail"
+    return result
+
+def format_history_record(record: dict) -> dict:
+    result = {
+        "id": record["id"],
+        "userId": record["user_id"],
+        "imageId": record["image_id"],
+        "prediction": record["prediction"],
+        "confidence": record["confidence"],
+        "timestamp": record["timestamp"]
+    }
+    image_id = record["image_id"]
+    if image_id:
+        result["imageUrl"] = f"/api/images/{image_id}"
+        result["thumbnailUrl"] = f"/api/images/{image_id}/thumbnail"
+    return result
+
+def image_response(path: str, etag: str, request: Request):
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=blobstore.media_type(path), headers=headers)
+
 @app.post("/api/detection-history")
 def save_detection(record: DetectionRecord):
-    history = read_json_file(DETECTION_HISTORY_FILE)
-    
-    new_record = {
-        "id": len(history) + 1,
-        "userId": record.userId,
-        "image": record.image,
-        "prediction": record.prediction,
-        "confidence": record.confidence,
-        "timestamp": datetime.now().isoformat()
-    }
-    history.append(new_record)
-    write_json_file(DETECTION_HISTORY_FILE, history)
-    return new_record
+    try:
+        image_id = store_history_image(record.image)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image data")
+    
+    new_record = database.save_detection_record(
+        record.userId,
+        image_id,
+        record.prediction,
+        record.confidence
+    )
+    response_cache.bump(f"history:{record.userId}")
+    return format_history_record(new_record)
+
+HISTORY_VIEWS = {"full": format_history_record, "summary": format_history_summary}
+
+def history_page(user_id: int, limit: int, before: Optional[tuple], view: str):
+    records = database.get_user_detection_history(user_id, limit + 1, before)
+    headers = {}
+    if len(records) > limit:
+        records = records[:limit]
+        headers["X-Next-Cursor"] = encode_page_cursor(records[-1]["timestamp"], records[-1]["id"])
+    return [HISTORY_VIEWS[view](r) for r in records], headers
 
 @app.get("/api/detection-history/{user_id}")
-def get_detection_history(user_id: int):
-    history = read_json_file(DETECTION_HISTORY_FILE)
-    user_history = [h for h in history if h["userId"] == user_id]
-    return sorted(user_history, key=lambda x: x["timestamp"], reverse=True)
+def get_detection_history(user_id: int, request: Request, limit: int = HISTORY_PAGE_SIZE,
+                          cursor: Optional[str] = None, view: str = "full"):
+    # Newest first, one page per request; X-Next-Cursor points at the next page
+    if view not in HISTORY_VIEWS:
+        raise HTTPException(status_code=400, detail="view must be 'full' or 'summary'")
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    before = tuple(decode_page_cursor(cursor, 2)) if cursor else None
+    
+    return response_cache.respond(
+        request, f"history:{user_id}", (limit, before, view),
+        lambda: history_page(user_id, limit, before, view),
+        with_headers=True
+    )
+
+def export_history_lines(user_id: int, include_images: bool, batch_size: int = 500,
+                         max_chunk_bytes: int = EXPORT_CHUNK_BYTES):
+    # Sync generators are resumed on the threadpool once per chunk, so hand
+    # over a batch of lines at a time rather than one line per hop. With
+    # images a batch is cut at max_chunk_bytes, so at most one photo past
+    # the cap is held at once.
+    lines = []
+    chunk_bytes = 0
+    for record in database.iter_user_detection_history(user_id, batch_size):
+        line = format_history_record(record)
+        path = blobstore.get_image(record["image_id"]) if include_images and record["image_id"] else None
+        if path is not None:
+            with open(path, "rb") as f:
+                encoded = base64.b64encode(f.read()).decode()
+            line["image"] = f"data:{blobstore.media_type(path)};base64,{encoded}"
+        lines.append(json.dumps(line))
+        chunk_bytes += len(lines[-1]) + 1
+        if len(lines) >= batch_size or chunk_bytes >= max_chunk_bytes:
+            yield "\n".join(lines) + "\n"
+            lines = []
+            chunk_bytes = 0
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+@app.get("/api/detection-history/{user_id}/export")
+def export_detection_history(user_id: int, include_images: bool = False):
+    # One JSON record per line, read in batches, so the archive never sits in memory whole
+    return StreamingResponse(
+        export_history_lines(user_id, include_images),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="detection-history-{user_id}.ndjson"'}
+    )
 
 @app.delete("/api/detection-history/{record_id}")
 def delete_detection_record(record_id: int):
-    history = read_json_file(DETECTION_HISTORY_FILE)
-    history = [h for h in history if h["id"] != record_id]
-    write_json_file(DETECTION_HISTORY_FILE, history)
+    user_id = database.delete_detection_record(record_id)
+    if user_id is not None:
+        response_cache.bump(f"history:{user_id}")
     return {"message": "Record deleted"}
 
+@app.get("/api/images/{digest}")
+def get_history_image(digest: str, request: Request):
+    path = blobstore.get_image(digest)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image_response(path, f'"{digest}"', request)
+
+@app.get("/api/images/{digest}/thumbnail")
+def get_history_thumbnail(digest: str, request: Request):
+    try:
+        path = blobstore.get_thumbnail(digest)
+    except Exception:
+        path = None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image_response(path, f'"{digest}-thumbnail"', request)
+
 
 # --- User Management Endpoints ---
 
 @app.post("/api/users/register")
 def register_user(user: UserCreate):
-    users = read_json_file(USERS_FILE)
-    
-    for u in users:
-        if u["name"].lower() == user.name.lower() and u["type"] == user.type:
-            raise HTTPException(status_code=400, detail="User already exists")
-    
-    new_user = {
-        "id": len(users) + 1,
-        "name": user.name,
-        "type": user.type,
-        "credits": 0,
-        "friends": [],
-        "tokens": 5,
-        "lastTokenReset": get_current_month()
-    }
-    users.append(new_user)
-    write_json_file(USERS_FILE, users)
-    return new_user
+    new_user = database.register_user(user.name, user.type)
+    if new_user is None:
+        raise HTTPException(status_code=400, detail="User already exists")
+    return format_user(new_user)
+
+def get_user_or_404(user_id: int):
+    user = database.get_user_by_id(user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 @app.post("/api/users/login")
 def login_user(user: UserLogin):
-    users = read_json_file(USERS_FILE)
-    
-    for i, u in enumerate(users):
-        if u["name"].lower() == user.name.lower() and u["type"] == user.type:
-            if check_and_reset_monthly_tokens(users[i]):
-                write_json_file(USERS_FILE, users)
-            return users[i]
-    
-    raise HTTPException(status_code=404, detail="User not found")
+    existing = database.get_user_by_name_type(user.name, user.type)
+    if existing is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return format_user(existing)
 
 @app.get("/api/users/{user_id}")
 def get_user(user_id: int):
-    users = read_json_file(USERS_FILE)
-    
-    for u in users:
-        if u["id"] == user_id:
-            return u
-    
-    raise HTTPException(status_code=404, detail="User not found")
+    return format_user(get_user_or_404(user_id))
 
 @app.put("/api/users/{user_id}")
 def update_user(user_id: int, update: UserUpdate):
-    users = read_json_file(USERS_FILE)
-    
-    for i, u in enumerate(users):
-        if u["id"] == user_id:
-            if update.credits is not None:
-                users[i]["credits"] = update.credits
-            if update.friends is not None:
-                users[i]["friends"] = update.friends
-            if update.tokens is not None:
-                users[i]["tokens"] = update.tokens
-            write_json_file(USERS_FILE, users)
-            return users[i]
-    
-    raise HTTPException(status_code=404, detail="User not found")
+    with database.get_db(write=True):
+        get_user_or_404(user_id)
+        user = database.update_user(user_id, credits=update.credits, tokens=update.tokens)
+        if update.friends is not None:
+            user = database.set_user_friends(user_id, update.friends)
+    return format_user(user)
 
 @app.post("/api/users/{user_id}/add-credits")
 def add_credits(user_id: int, amount: int):
-    users = read_json_file(USERS_FILE)
-    
-    for i, u in enumerate(users):
-        if u["id"] == user_id:
-            current_credits = users[i].get("credits", 0)
-            users[i]["credits"] = current_credits + amount
-            write_json_file(USERS_FILE, users)
-            return users[i]
-    
-    raise HTTPException(status_code=404, detail="User not found")
+    user = database.add_user_credits(user_id, amount, reason="deposit")
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return format_user(user)
 
 @app.post("/api/users/{user_id}/add-friend")
 def add_friend(user_id: int, friend_name: str):
-    users = read_json_file(USERS_FILE)
-    
-    for i, u in enumerate(users):
-        if u["id"] == user_id:
-            if "friends" not in users[i]:
-                users[i]["friends"] = []
-            if friend_name not in users[i]["friends"]:
-                users[i]["friends"].append(friend_name)
-            write_json_file(USERS_FILE, users)
-            return users[i]
-    
-    raise HTTPException(status_code=404, detail="User not found")
+    with database.get_db(write=True):
+        get_user_or_404(user_id)
+        user = database.add_user_friend(user_id, friend_name)
+    return format_user(user)
 
 
 # --- Token System Endpoints ---
 
 @app.get("/api/users/{user_id}/tokens")
 def get_user_tokens(user_id: int):
-    users = read_json_file(USERS_FILE)
-    
-    for i, u in enumerate(users):
-        if u["id"] == user_id:
-            if check_and_reset_monthly_tokens(users[i]):
-                write_json_file(USERS_FILE, users)
-            return {
-                "tokens": users[i].get("tokens", 0),
-                "lastReset": users[i].get("lastTokenReset", ""),
-                "pricePerToken": TOKEN_PRICE
-            }
+    # The monthly top-up is applied as the row is read; nothing is written
+    user = get_user_or_404(user_id)
     
-    raise HTTPException(status_code=404, detail="User not found")
+    return {
+        "tokens": user["tokens"],
+        "lastReset": user["last_token_reset"],
+        "pricePerToken": TOKEN_PRICE
+    }
 
 
 @app.post("/api/users/{user_id}/purchase-tokens")
@@ -506,99 +1106,189 @@ def purchase_tokens(user_id: int, purchase: TokenPurchase):
     if purchase.quantity < 1:
         raise HTTPException(status_code=400, detail="Quantity must be at least 1")
     
-    users = read_json_file(USERS_FILE)
-    
-    for i, u in enumerate(users):
-        if u["id"] == user_id:
-            current_tokens = users[i].get("tokens", 0)
-            users[i]["tokens"] = current_tokens + purchase.quantity
-            write_json_file(USERS_FILE, users)
-            
-            total_cost = purchase.quantity * TOKEN_PRICE
-            return {
-                "success": True,
-                "message": f"Purchased {purchase.quantity} token(s) for Rs {total_cost:.2f}",
-                "tokens": users[i]["tokens"],
-                "totalCost": total_cost
-            }
+    tokens = database.add_tokens(user_id, purchase.quantity, reason="purchase")
+    if tokens is None:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    raise HTTPException(status_code=404, detail="User not found")
+    total_cost = purchase.quantity * TOKEN_PRICE
+    return {
+        "success": True,
+        "message": f"Purchased {purchase.quantity} token(s) for Rs {total_cost:.2f}",
+        "tokens": tokens,
+        "totalCost": total_cost
+    }
+
 
+def spend_scan_token(user_id: int) -> int:
+    remaining = database.spend_token(user_id, reason="scan")
+    if remaining is None:
+        get_user_or_404(user_id)
+        raise HTTPException(
+            status_code=402, 
+            detail="Insufficient tokens. Please purchase more tokens to continue scanning."
+        )
+    return remaining
 
 @app.post("/api/users/{user_id}/use-token")
 def use_token(user_id: int):
-    users = read_json_file(USERS_FILE)
-    
-    for i, u in enumerate(users):
-        if u["id"] == user_id:
-            check_and_reset_monthly_tokens(users[i])
-            
-            current_tokens = users[i].get("tokens", 0)
-            if current_tokens < 1:
-                raise HTTPException(
-                    status_code=402, 
-                    detail="Insufficient tokens. Please purchase more tokens to continue scanning."
-                )
-            
-            users[i]["tokens"] = current_tokens - 1
-            write_json_file(USERS_FILE, users)
-            
-            return {
-                "success": True,
-                "remainingTokens": users[i]["tokens"]
-            }
+    remaining = spend_scan_token(user_id)
+    
+    return {
+        "success": True,
+        "remainingTokens": remaining
+    }
+
+
+# --- Scan ---
+
+async def read_scan_image(request: Request) -> bytes:
+    # Raw bytes or multipart like /api/predict/upload, or the base64 JSON body of /api/predict
+    if not request.headers.get("content-type", "").lower().startswith("application/json"):
+        return await read_image_upload(request)
+    try:
+        data = ImageData(**await request.json())
+        image_bytes = await asyncio.to_thread(decode_image_data, data.image)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Expected a JSON body with a base64 'image'")
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    return image_bytes
+
+def save_scan(user_id: int, image_bytes: bytes, digest: str, result: dict) -> dict:
+    image_id = blobstore.save_image(image_bytes, digest)
+    record = database.save_detection_record(user_id, image_id, result["prediction"], result["confidence"])
+    response_cache.bump(f"history:{user_id}")
+    return record
+
+@app.post("/api/users/{user_id}/scan")
+async def scan_plant(user_id: int, request: Request, tiled: bool = False):
+    """Spends a token, predicts and saves the scan to history in one request.
     
-    raise HTTPException(status_code=404, detail="User not found")
+    The photo is decoded once before the token is spent, so an upload
+    that is not a readable image costs nothing. The token is given back
+    if the prediction fails. A prediction that succeeded is returned even
+    if saving it to history did not. With `tiled` the photo is also
+    scored tile by tile (see predict_tiled).
+    """
+    check_model_available()
+    image_bytes = await read_scan_image(request)
+    digest = await check_upload_image(image_bytes, decode=True)
+
+    remaining = await asyncio.to_thread(spend_scan_token, user_id)
+    try:
+        result = await run_image_prediction(image_bytes, digest, tiled)
+    except BaseException:
+        # Shielded so a client disconnect mid-prediction still gets its refund
+        await asyncio.shield(asyncio.to_thread(database.refund_token, user_id, "scan refund"))
+        raise
+
+    try:
+        record = await asyncio.to_thread(save_scan, user_id, image_bytes, digest, result)
+    except Exception:
+        logger.exception("Failed to save scan for user %s to history", user_id)
+        record = None
+
+    return {
+        **result,
+        "remainingTokens": remaining,
+        "record": format_history_record(record) if record else None
+    }
+
+
+@app.get("/api/users/{user_id}/ledger")
+def get_user_ledger(user_id: int, limit: int = 50):
+    get_user_or_404(user_id)
+    return [format_ledger_entry(entry) for entry in database.get_ledger_entries(user_id, min(limit, 500))]
 
 
 # --- Product Management Endpoints ---
 
+def encode_product_cursor(sort: str, product: dict) -> str:
+    column, _ = database.PRODUCT_SORTS[sort]
+    return encode_page_cursor(sort, product[column] if column else None, product["id"])
+
+def decode_product_cursor(cursor: str, sort: str) -> tuple:
+    cursor_sort, value, product_id = decode_page_cursor(cursor, 3)
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor does not match this sort order")
+    return value, product_id
+
+def products_page(limit: int, sort: str, after: Optional[tuple], filters: dict):
+    products = database.search_products(limit + 1, sort, after, **filters)
+    headers = {}
+    if len(products) > limit:
+        products = products[:limit]
+        headers["X-Next-Cursor"] = encode_product_cursor(sort, products[-1])
+    return products, headers
+
+# Both listings are served from the "products" resource, so any product
+# write invalidates the marketplace and every seller page at once
 @app.get("/api/products")
-def get_products():
-    return read_json_file(PRODUCTS_FILE)
+def get_products(request: Request, limit: int = PRODUCTS_PAGE_SIZE, cursor: Optional[str] = None,
+                 sort: str = "newest", type: Optional[str] = None, min_price: Optional[float] = None,
+                 max_price: Optional[float] = None, seller_id: Optional[int] = None,
+                 q: Optional[str] = None):
+    # Still a plain array; the cursor for the next page travels in X-Next-Cursor
+    if sort not in database.PRODUCT_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(database.PRODUCT_SORTS)}")
+    limit = max(1, min(limit, PRODUCTS_MAX_PAGE_SIZE))
+    after = decode_product_cursor(cursor, sort) if cursor else None
+    filters = {
+        "product_type": type or None,
+        "min_price": min_price,
+        "max_price": max_price,
+        "seller_id": seller_id,
+        "query": (q or "").strip() or None,
+    }
+    
+    return response_cache.respond(
+        request, "products", (limit, sort, after, *filters.values()),
+        lambda: products_page(limit, sort, after, filters),
+        with_headers=True
+    )
 
 @app.get("/api/products/seller/{seller_id}")
-def get_seller_products(seller_id: int):
-    products = read_json_file(PRODUCTS_FILE)
-    return [p for p in products if p["seller_id"] == seller_id]
+def get_seller_products(seller_id: int, request: Request):
+    return response_cache.respond(
+        request, "products", ("seller", seller_id),
+        lambda: database.get_seller_products(seller_id)
+    )
 
 @app.post("/api/products")
 def create_product(product: ProductCreate, seller_id: int, seller_name: str):
-    products = read_json_file(PRODUCTS_FILE)
-    
-    new_product = {
-        "id": len(products) + 1,
-        "seller_id": seller_id,
-        "seller_name": seller_name,
-        "name": product.name,
-        "price": product.price,
-        "description": product.description,
-        "type": product.type,
-        "phone": product.phone,
-        "views": 0
-    }
-    products.append(new_product)
-    write_json_file(PRODUCTS_FILE, products)
+    new_product = database.create_product(
+        seller_id,
+        seller_name,
+        product.name,
+        product.price,
+        product.description,
+        product.type,
+        product.phone
+    )
+    response_cache.bump("products")
     return new_product
 
 @app.delete("/api/products/{product_id}")
 def delete_product(product_id: int):
-    products = read_json_file(PRODUCTS_FILE)
-    products = [p for p in products if p["id"] != product_id]
-    write_json_file(PRODUCTS_FILE, products)
+    if database.delete_product(product_id):
+        response_cache.bump("products")
     return {"message": "Product removed successfully"}
 
 @app.post("/api/products/{product_id}/view")
 def increment_view(product_id: int):
-    products = read_json_file(PRODUCTS_FILE)
-    
-    for i, p in enumerate(products):
-        if p["id"] == product_id:
-            products[i]["views"] = products[i].get("views", 0) + 1
-            write_json_file(PRODUCTS_FILE, products)
-            return products[i]
-    
-    raise HTTPException(status_code=404, detail="Product not found")
+    # Counted in memory and flushed in batches; listings pick the new
+    # total up once their cached page expires. Looked up first so an
+    # unknown id is never counted.
+    product, pending = view_counter.read(product_id, lambda: database.get_product_by_id(product_id))
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    view_counter.increment(product_id)
+    product["views"] += pending + 1
+    return product
+
+@app.get("/api/products/views/stats")
+def get_view_counter_stats():
+    return view_counter.stats()
 
 @app.get("/")
 async def serve_home():
@@ -613,6 +1303,8 @@ async def serve_page(page: str):
 
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 
+APP_IMPORTED = time.perf_counter()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,265 @@
+import bisect
+import threading
+import time
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            count = self._count
+
+        # Cumulative "less than or equal" counts, same layout Prometheus uses
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = count
+
+        return {"count": count, "sum": total, "buckets": buckets}
+
+
+# --- Prometheus Exposition ---
+# A small registry rendering the text format (version 0.0.4) without the
+# prometheus_client dependency. Recording is a dict lookup and a short
+# locked update; all formatting happens when /metrics is scraped.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {} if self.labels else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in values.items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class LabeledHistogram:
+    """One Histogram per combination of label values."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, labels=(), histogram: Histogram = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets)) if histogram is None else histogram.buckets
+        self.labels = tuple(labels)
+        self._children = {} if histogram is None else {(): histogram}
+        self._lock = threading.Lock()
+
+    def child(self, *label_values) -> Histogram:
+        histogram = self._children.get(label_values)
+        if histogram is None:
+            with self._lock:
+                histogram = self._children.setdefault(label_values, Histogram(self.buckets))
+        return histogram
+
+    def observe(self, value: float, *label_values):
+        self.child(*label_values).observe(value)
+
+    def time(self, *label_values):
+        return _Timer(self.child(*label_values))
+
+    def samples(self):
+        for label_values, histogram in list(self._children.items()):
+            with histogram._lock:
+                counts = list(histogram._counts)
+                total = histogram._sum
+                count = histogram._count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"')
+                yield self.name + "_bucket", labels, cumulative
+            yield self.name + "_bucket", _format_labels(self.labels, label_values, 'le="+Inf"'), count
+            yield self.name + "_sum", _format_labels(self.labels, label_values), total
+            yield self.name + "_count", _format_labels(self.labels, label_values), count
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class CallbackMetric:
+    """Read at scrape time from `fn`, which returns a number or {label values: number}."""
+
+    def __init__(self, name: str, help: str, kind: str, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.fn = fn
+        self.labels = tuple(labels)
+
+    def samples(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            if value is None:
+                continue
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Registry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric, replace: bool = False):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not replace:
+                return existing  # modules re-imported under another name share the series
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._add(Gauge(self.prefix + name, help, labels))
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS, labels=(),
+                  histogram: Histogram = None) -> LabeledHistogram:
+        # Wrapping an existing Histogram rebinds the name to the newest owner
+        metric = LabeledHistogram(self.prefix + name, help, buckets, labels, histogram)
+        return self._add(metric, replace=histogram is not None)
+
+    def callback(self, name: str, help: str, fn, kind: str = "gauge", labels=()) -> CallbackMetric:
+        return self._add(CallbackMetric(self.prefix + name, help, kind, fn, labels), replace=True)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as err:
+                # One failing callback should not take the whole scrape down
+                lines.append(f"# {metric.name} unavailable: {_escape(err)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(prefix="arobytess_")
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status.
+
+    The route is the matched path template ("/api/users/{user_id}"), so ids
+    in URLs do not create new series; unmatched paths share one label.
+    Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app, registry: Registry = registry):
+        self.app = app
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency by route.",
+            labels=("method", "route", "status")
+        )
+        self.in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being served.")
+        self._in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self._in_flight += 1
+        self.in_flight.set(self._in_flight)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self._in_flight -= 1
+            self.in_flight.set(self._in_flight)
+            route = scope.get("route")
+            self.latency.observe(
+                time.perf_counter() - started,
+                scope["method"], getattr(route, "path", "unmatched"), status
+            )
@@ -1,105 +1,312 @@
 """
 Migration script to import existing JSON data into SQLite database.
 Run this once to migrate your data: python migrate_to_db.py
+
+Each JSON file is parsed one record at a time and inserted in batches,
+with the batch and a checkpoint (byte offset into the file) committed
+together. An interrupted run picks up from the last checkpoint when
+started again; pass --restart to ignore checkpoints. Inline base64 scan
+images go straight into the blob store instead of the database.
 """
+import argparse
+import codecs
 import json
 import os
-from database import get_db, init_db
+import re
+import time
+import blobstore
+import database
+from database import get_db, init_db, location_key, month_epoch, utc_timestamp
+from inference import decode_image_data
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
-def load_json(filename):
-    filepath = os.path.join(DATA_DIR, filename)
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as f:
-            return json.load(f)
-    return []
+BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 1 << 20
+PROGRESS_INTERVAL_S = 2.0
 
-def migrate_users():
-    users = load_json('users.json')
-    with get_db() as conn:
-        cursor = conn.cursor()
-        for user in users:
-            cursor.execute('''
-                INSERT OR IGNORE INTO users (id, name, type, credits, tokens, last_token_reset)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user['id'], user['name'], user['type'], 
-                  user.get('credits', 0), user.get('tokens', 5), 
-                  user.get('lastTokenReset', '')))
-            
-            for friend in user.get('friends', []):
-                cursor.execute('''
-                    INSERT OR IGNORE INTO user_friends (user_id, friend_name)
-                    VALUES (?, ?)
-                ''', (user['id'], friend))
-    print(f"Migrated {len(users)} users")
-
-def migrate_disease_reports():
-    reports = load_json('disease_reports.json')
-    with get_db() as conn:
-        cursor = conn.cursor()
-        for report in reports:
-            cursor.execute('''
-                INSERT OR IGNORE INTO disease_reports 
-                (id, disease_name, location, crop_type, severity, description, reporter_phone, reported_at, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (report['id'], report['diseaseName'], report.get('location', 'Bharatpur'),
-                  report['cropType'], report['severity'], report.get('description'),
-                  report.get('reporterPhone'), report.get('reportedAt'), report.get('status')))
-    print(f"Migrated {len(reports)} disease reports")
-
-def migrate_alert_registrations():
-    alerts = load_json('alert_registrations.json')
-    with get_db() as conn:
-        cursor = conn.cursor()
-        for alert in alerts:
-            cursor.execute('''
-                INSERT OR IGNORE INTO alert_registrations 
-                (id, farmer_name, phone_number, location, crop_types, alert_radius, registered_at, is_active)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (alert['id'], alert['farmerName'], alert['phoneNumber'],
-                  alert.get('location', 'Bharatpur'), alert.get('cropTypes'),
-                  alert.get('alertRadius', 10), alert.get('registeredAt'),
-                  1 if alert.get('isActive', True) else 0))
-    print(f"Migrated {len(alerts)} alert registrations")
-
-def migrate_detection_history():
-    history = load_json('detection_history.json')
-    with get_db() as conn:
-        cursor = conn.cursor()
-        for record in history:
-            cursor.execute('''
-                INSERT OR IGNORE INTO detection_history 
-                (id, user_id, image, prediction, confidence, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (record['id'], record['userId'], record['image'],
-                  record['prediction'], record['confidence'], record.get('timestamp')))
-    print(f"Migrated {len(history)} detection records")
-
-def migrate_products():
-    products = load_json('products.json')
+# --- Streaming JSON ---
+
+_decoder = json.JSONDecoder()
+_separators = re.compile(r'[\s,]*')
+
+def iter_json_array(filepath, offset=0, chunk_size=READ_CHUNK_SIZE):
+    """Yields (record, end_offset) for each element of a top-level JSON array.
+
+    Only the element being parsed is held in memory. `end_offset` is the
+    byte position just past the element, so passing it back as `offset`
+    resumes with the next one.
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        utf8 = codecs.getincrementaldecoder('utf-8')()
+        buffer, index, position, eof = '', 0, offset, False
+        expect_open = offset == 0
+
+        def fill():
+            nonlocal buffer, index, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[index:] + utf8.decode(chunk, final=eof)
+            index = 0
+
+        while True:
+            # Skip whitespace and separators between elements
+            skip = _separators.match(buffer, index).end()
+            position += len(buffer[index:skip].encode('utf-8'))
+            index = skip
+            if index == len(buffer):
+                if eof:
+                    raise ValueError(f"{filepath}: unexpected end of file")
+                fill()
+                continue
+            if expect_open:
+                if buffer[index] != '[':
+                    raise ValueError(f"{filepath}: expected a JSON array")
+                index, position, expect_open = index + 1, position + 1, False
+                continue
+            if buffer[index] == ']':
+                return
+
+            try:
+                record, end = _decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()  # element continues past the buffered text
+                continue
+            if end == len(buffer) and not eof:
+                # A number could still be cut off mid-way; make sure it ended
+                fill()
+                continue
+
+            position += len(buffer[index:end].encode('utf-8'))
+            index = end
+            yield record, position
+
+# --- Checkpoints ---
+
+def create_checkpoint_table():
+    with get_db(write=True) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS migration_checkpoints (
+                source TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                rows INTEGER NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+
+def file_fingerprint(filepath):
+    stat = os.stat(filepath)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+def load_checkpoint(source, fingerprint):
     with get_db() as conn:
+        row = conn.execute('SELECT * FROM migration_checkpoints WHERE source = ?', (source,)).fetchone()
+    if row is None or row['fingerprint'] != fingerprint:
+        return None
+    return dict(row)
+
+def save_checkpoint(conn, source, fingerprint, offset, rows, done=False):
+    conn.execute('''
+        INSERT INTO migration_checkpoints (source, fingerprint, offset, rows, done, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(source) DO UPDATE SET fingerprint = excluded.fingerprint, offset = excluded.offset,
+            rows = excluded.rows, done = excluded.done, updated_at = excluded.updated_at
+    ''', (source, fingerprint, offset, rows, int(done), utc_timestamp()))
+
+# --- Deferred indexes ---
+
+def drop_secondary_indexes():
+    """Drops what create_indexes() and create_product_search() build, so bulk inserts skip their upkeep."""
+    with get_db(write=True) as conn:
+        triggers = [row['name'] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'products'"
+        )]
+        for name in triggers:
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        # Dropped rather than left stale, so an app started mid-migration rebuilds it
+        conn.execute('DROP TABLE IF EXISTS products_fts')
+
+        indexes = [row['name'] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+        )]
+        for name in indexes:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+    return indexes
+
+def rebuild_indexes():
+    with get_db(write=True) as conn:
         cursor = conn.cursor()
-        for product in products:
-            cursor.execute('''
-                INSERT OR IGNORE INTO products 
-                (id, seller_id, seller_name, name, price, description, type, phone, views)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (product['id'], product['seller_id'], product['seller_name'],
-                  product['name'], product['price'], product.get('description'),
-                  product.get('type'), product.get('phone'), product.get('views', 0)))
-    print(f"Migrated {len(products)} products")
+        database.create_indexes(cursor)
+        database.create_product_search(cursor)
+        conn.execute('ANALYZE')
+
+# --- Migration ---
+
+def migrate_file(filename, convert, batch_size=BATCH_SIZE, restart=False):
+    """Streams `filename` into SQLite. `convert(record)` returns [(sql, params), ...]."""
+    filepath = os.path.join(DATA_DIR, filename)
+    if not os.path.exists(filepath):
+        print(f"{filename}: not found, skipping")
+        return 0
+
+    fingerprint = file_fingerprint(filepath)
+    checkpoint = None if restart else load_checkpoint(filename, fingerprint)
+    if checkpoint and checkpoint['done']:
+        print(f"{filename}: already migrated ({checkpoint['rows']:,} records)")
+        return 0
+    offset = checkpoint['offset'] if checkpoint else 0
+    rows = checkpoint['rows'] if checkpoint else 0
+    if checkpoint:
+        print(f"{filename}: resuming after {rows:,} records")
+
+    began = last_report = time.perf_counter()
+    migrated = 0
+    batch = {}
+    batch_count = 0
+
+    def flush(done=False):
+        nonlocal batch, batch_count
+        with get_db(write=True) as conn:
+            for sql, params in batch.items():
+                conn.executemany(sql, params)
+            save_checkpoint(conn, filename, fingerprint, offset, rows, done)
+        batch, batch_count = {}, 0
+
+    for record, offset in iter_json_array(filepath, offset):
+        for sql, params in convert(record):
+            batch.setdefault(sql, []).append(params)
+        batch_count += 1
+        rows += 1
+        migrated += 1
+
+        if batch_count >= batch_size:
+            flush()
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL_S:
+                print(f"  {filename}: {rows:,} records ({migrated / (now - began):,.0f}/s)")
+                last_report = now
+    flush(done=True)
+
+    elapsed = time.perf_counter() - began
+    print(f"Migrated {migrated:,} records from {filename} in {elapsed:.1f}s "
+          f"({migrated / elapsed if elapsed else 0:,.0f}/s)")
+    return migrated
+
+def token_epoch(last_token_reset):
+    try:
+        return month_epoch(last_token_reset)
+    except (AttributeError, ValueError):
+        return 0  # never reset; tops up on first use
+
+def user_rows(user):
+    rows = [('''
+        INSERT OR IGNORE INTO users (id, name, type, credits, tokens, last_token_reset, token_epoch)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user['id'], user['name'], user['type'],
+          user.get('credits', 0), user.get('tokens', 5),
+          user.get('lastTokenReset', ''), token_epoch(user.get('lastTokenReset'))))]
+    for friend in user.get('friends', []):
+        rows.append(('''
+            INSERT OR IGNORE INTO user_friends (user_id, friend_name)
+            VALUES (?, ?)
+        ''', (user['id'], friend)))
+    return rows
+
+def disease_report_rows(report):
+    location = report.get('location', 'Bharatpur')
+    return [('''
+        INSERT OR IGNORE INTO disease_reports
+        (id, disease_name, location, location_key, crop_type, severity, description, reporter_phone,
+         reported_at, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (report['id'], report['diseaseName'], location, location_key(location),
+          report['cropType'], report['severity'], report.get('description'),
+          report.get('reporterPhone'), report.get('reportedAt'), report.get('status')))]
+
+def alert_registration_rows(alert):
+    return [('''
+        INSERT OR IGNORE INTO alert_registrations
+        (id, farmer_name, phone_number, location, crop_types, alert_radius, registered_at, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (alert['id'], alert['farmerName'], alert['phoneNumber'],
+          alert.get('location', 'Bharatpur'), alert.get('cropTypes'),
+          alert.get('alertRadius', 10), alert.get('registeredAt'),
+          1 if alert.get('isActive', True) else 0))]
+
+# Ids of detection records whose inline image could not be decoded
+dropped_images = []
+
+def detection_record_rows(record):
+    image_id, image = record.get('imageId'), record.get('image', '')
+    if image and not image_id:
+        # Into the blob store now, rather than into the database and out again on startup
+        try:
+            image_bytes = decode_image_data(image)
+            if not image_bytes:
+                raise ValueError("empty image")
+            image_id = blobstore.save_image(image_bytes)
+        except ValueError:
+            dropped_images.append(record['id'])  # the record is kept, without its image
+        image = ''
+    return [('''
+        INSERT OR IGNORE INTO detection_history
+        (id, user_id, image, image_id, prediction, confidence, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (record['id'], record['userId'], image, image_id,
+          record['prediction'], record['confidence'], record.get('timestamp')))]
+
+def product_rows(product):
+    return [('''
+        INSERT OR IGNORE INTO products
+        (id, seller_id, seller_name, name, price, description, type, phone, views)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (product['id'], product['seller_id'], product['seller_name'],
+          product['name'], product['price'], product.get('description'),
+          product.get('type'), product.get('phone'), product.get('views', 0)))]
+
+SOURCES = [
+    ('users.json', user_rows),
+    ('disease_reports.json', disease_report_rows),
+    ('alert_registrations.json', alert_registration_rows),
+    ('detection_history.json', detection_record_rows),
+    ('products.json', product_rows),
+]
+
+def main():
+    global DATA_DIR
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory holding the JSON files')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='records per transaction')
+    parser.add_argument('--restart', action='store_true', help='ignore checkpoints and start from the top')
+    args = parser.parse_args()
+    DATA_DIR = args.data_dir
 
-if __name__ == '__main__':
     print("Initializing database...")
     init_db()
-    
+    create_checkpoint_table()
+    drop_secondary_indexes()
+
     print("\nMigrating data from JSON files...")
-    migrate_users()
-    migrate_disease_reports()
-    migrate_alert_registrations()
-    migrate_detection_history()
-    migrate_products()
-    
-    print("\nMigration complete! Database created at: data/arobytess.db")
+    for filename, convert in SOURCES:
+        migrate_file(filename, convert, args.batch_size, args.restart)
+
+    print("\nBuilding indexes...")
+    began = time.perf_counter()
+    rebuild_indexes()
+    print(f"Indexes built in {time.perf_counter() - began:.1f}s")
+
+    if dropped_images:
+        shown = ', '.join(map(str, dropped_images[:20])) + (' ...' if len(dropped_images) > 20 else '')
+        print(f"\nDropped {len(dropped_images):,} undecodable detection images "
+              f"(records kept without an image): {shown}")
+
+    print(f"\nMigration complete! Database created at: {database.DB_PATH}")
+
+if __name__ == '__main__':
+    main()
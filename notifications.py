@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import deque
+from email.mime.text import MIMEText
+
+import database
+
+logger = logging.getLogger("uvicorn.error")
+
+EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
+EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') == '1'
+SMTP_TIMEOUT_S = float(os.getenv('SMTP_TIMEOUT_S', '30'))
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '2'))
+SMTP_IDLE_CHECK_S = float(os.getenv('SMTP_IDLE_CHECK_S', '30'))
+
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', '2'))
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', '20'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BASE_S = float(os.getenv('EMAIL_RETRY_BASE_S', '5'))
+EMAIL_RETRY_MAX_S = float(os.getenv('EMAIL_RETRY_MAX_S', '900'))
+EMAIL_LEASE_S = float(os.getenv('EMAIL_LEASE_S', '120'))
+EMAIL_DEDUP_WINDOW_S = int(os.getenv('EMAIL_DEDUP_WINDOW_S', str(24 * 3600)))
+
+
+def email_configured() -> bool:
+    # A local relay (SMTP_HOST pointed elsewhere) does not need credentials
+    return bool(EMAIL_ADDRESS and (EMAIL_PASSWORD or SMTP_HOST != 'smtp.gmail.com'))
+
+
+def dedup_key(recipient: str, subject: str, body: str, now: float = None) -> str:
+    """Same message to the same recipient within one dedup window shares a key."""
+    window = int((now if now is not None else time.time()) // EMAIL_DEDUP_WINDOW_S)
+    content = "\0".join((recipient.strip().lower(), subject, body, str(window)))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class SMTPPool:
+    """Keeps up to `size` logged-in SMTP sessions for reuse across messages.
+
+    Opening a session costs a TCP connect, EHLO, STARTTLS and AUTH; a pooled
+    session only pays for the message itself. Sessions idle longer than
+    SMTP_IDLE_CHECK_S are probed with NOOP before reuse, and any session
+    that raises is discarded rather than returned.
+    """
+
+    def __init__(self, host: str, port: int, username: str = None, password: str = None,
+                 starttls: bool = True, size: int = 2, timeout_s: float = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout_s = timeout_s
+        self._idle = queue.LifoQueue(maxsize=size)
+        self.opened = 0
+        self.reused = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout_s)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.opened += 1
+        return server
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            try:
+                server, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            if time.monotonic() - idle_since < SMTP_IDLE_CHECK_S:
+                self.reused += 1
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    self.reused += 1
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.discard(server)
+
+    def release(self, server: smtplib.SMTP):
+        try:
+            self._idle.put_nowait((server, time.monotonic()))
+        except queue.Full:
+            self.discard(server, quit=True)
+
+    def discard(self, server: smtplib.SMTP, quit: bool = False):
+        try:
+            server.quit() if quit else server.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(server, quit=True)
+
+    def send(self, message: MIMEText):
+        server = self.acquire()
+        try:
+            server.send_message(message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as err:
+            # A rejected message leaves the session usable (smtplib sends
+            # RSET), unless the server is closing it with 421
+            if getattr(err, "smtp_code", None) == 421:
+                self.discard(server)
+            else:
+                self.release(server)
+            raise
+        except Exception:
+            self.discard(server)
+            raise
+        self.release(server)
+
+
+class NotificationWorker:
+    """Drains the email outbox on background threads.
+
+    Messages are claimed from the SQLite outbox in batches, sent through the
+    shared SMTPPool, and either marked sent, rescheduled with exponential
+    backoff, or marked failed after EMAIL_MAX_ATTEMPTS. Permanent rejections
+    (5xx replies, refused recipients) are not retried.
+    """
+
+    def __init__(self, pool: SMTPPool, sender: str, workers: int = 2, batch_size: int = 20,
+                 max_attempts: int = 5, retry_base_s: float = 5, retry_max_s: float = 900,
+                 lease_s: float = 120):
+        self.pool = pool
+        self.sender = sender
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.lease_s = lease_s
+
+        self._threads = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._sent_times = deque(maxlen=10000)
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.send_seconds = 0.0
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"email-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout_s: float = 5):
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout_s)
+        self._threads = []
+        self.pool.close()
+
+    def enqueue(self, recipient: str, subject: str, body: str) -> bool:
+        """Queues a message for delivery; False if it is a duplicate."""
+        email_id = database.enqueue_email(recipient, subject, body, dedup_key(recipient, subject, body))
+        if email_id is None:
+            with self._lock:
+                self.deduplicated += 1
+            return False
+        self._wake.set()
+        return True
+
+    def enqueue_many(self, messages: list) -> int:
+        """Queues (recipient, subject, body) tuples in one transaction; returns how many were new."""
+        if not messages:
+            return 0
+        rows = [(recipient, subject, body, dedup_key(recipient, subject, body))
+                for recipient, subject, body in messages]
+        created = database.enqueue_emails(rows)
+        with self._lock:
+            self.deduplicated += len(rows) - created
+        if created:
+            self._wake.set()
+        return created
+
+    def _idle_wait(self):
+        # Clear before looking at the queue, so an enqueue that lands after
+        # the check still interrupts the wait
+        self._wake.clear()
+        if self._stopping.is_set():
+            return
+        due = database.next_email_due()
+        wait_s = 60.0 if due is None else max(0.0, min(60.0, due - time.time()))
+        if wait_s > 0:
+            self._wake.wait(wait_s)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                batch = database.claim_emails(time.time(), self.lease_s, self.batch_size)
+            except Exception as err:
+                logger.error("Email outbox unavailable: %s", err)
+                self._stopping.wait(self.retry_base_s)
+                continue
+
+            if not batch:
+                self._idle_wait()
+                continue
+
+            for email in batch:
+                self._deliver(email)
+        database.close_connection()
+
+    def _deliver(self, email: dict):
+        message = MIMEText(email["body"])
+        message['Subject'] = email["subject"]
+        message['From'] = self.sender
+        message['To'] = email["recipient"]
+
+        began = time.perf_counter()
+        try:
+            self.pool.send(message)
+        except Exception as err:
+            self._record_failure(email, err)
+            return
+
+        database.mark_email_sent(email["id"])
+        with self._lock:
+            self.sent += 1
+            self.send_seconds += time.perf_counter() - began
+            self._sent_times.append(time.monotonic())
+
+    def _record_failure(self, email: dict, err: Exception):
+        permanent = (isinstance(err, smtplib.SMTPRecipientsRefused)
+                     or (isinstance(err, smtplib.SMTPResponseException) and 500 <= err.smtp_code < 600))
+        error = f"{type(err).__name__}: {err}"
+
+        if permanent or email["attempts"] >= self.max_attempts:
+            database.mark_email_failed(email["id"], error)
+            with self._lock:
+                self.failed += 1
+            logger.warning("Email to %s failed after %d attempt(s): %s", email["recipient"], email["attempts"], error)
+            return
+
+        delay = min(self.retry_max_s, self.retry_base_s * 2 ** (email["attempts"] - 1))
+        database.mark_email_retry(email["id"], time.time() + delay, error)
+        with self._lock:
+            self.retried += 1
+
+    def send_rate(self, window_s: float = 60) -> float:
+        cutoff = time.monotonic() - window_s
+        with self._lock:
+            recent = sum(1 for t in self._sent_times if t >= cutoff)
+        return recent / window_s
+
+    def stats(self) -> dict:
+        counts = database.count_emails_by_status()
+        send_rate = self.send_rate()
+        with self._lock:
+            return {
+                "queueDepth": counts.get("pending", 0) + counts.get("sending", 0),
+                "outbox": counts,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "deduplicated": self.deduplicated,
+                "sendRatePerSecond": round(send_rate, 3),
+                "avgSendMs": round(self.send_seconds / self.sent * 1000, 2) if self.sent else None,
+                "connectionsOpened": self.pool.opened,
+                "connectionsReused": self.pool.reused,
+                "workers": len(self._threads),
+            }
+
+
+smtp_pool = SMTPPool(
+    SMTP_HOST,
+    SMTP_PORT,
+    username=EMAIL_ADDRESS,
+    password=EMAIL_PASSWORD,
+    starttls=SMTP_STARTTLS,
+    size=SMTP_POOL_SIZE,
+    timeout_s=SMTP_TIMEOUT_S,
+)
+
+notifier = NotificationWorker(
+    smtp_pool,
+    sender=EMAIL_ADDRESS,
+    workers=EMAIL_WORKERS,
+    batch_size=EMAIL_BATCH_SIZE,
+    max_attempts=EMAIL_MAX_ATTEMPTS,
+    retry_base_s=EMAIL_RETRY_BASE_S,
+    retry_max_s=EMAIL_RETRY_MAX_S,
+    lease_s=EMAIL_LEASE_S,
+)
@@ -0,0 +1,88 @@
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from PIL import Image
+
+
+def perceptual_hash(image: np.ndarray) -> str:
+    """Difference hash of a preprocessed image, stable across re-encodes and small resizes."""
+    gray = Image.fromarray(np.asarray(image, dtype=np.uint8)).convert('L').resize((9, 8))
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+class PredictionCache:
+    """LRU + TTL cache of raw model scores keyed by image digest.
+
+    Entries are tagged with the model version they were computed with; the
+    whole cache is dropped the first time a different version is seen.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version: str):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: str, version: str):
+        if self.max_entries <= 0:
+            return None
+
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, version: str, score: float):
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (score, time.monotonic())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "maxEntries": self.max_entries,
+            "modelVersion": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,116 @@
+import base64
+import threading
+from bisect import bisect_left
+
+from database import location_key
+
+
+def encode_cursor(report: dict) -> str:
+    raw = f"{report['reported_at'] or ''}|{report['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Opaque page cursor -> (reported_at, id); raises ValueError if malformed."""
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    reported_at, _, report_id = raw.rpartition('|')
+    if not reported_at:
+        raise ValueError("malformed cursor")
+    return reported_at, int(report_id)
+
+
+class RecentReports:
+    """The newest `capacity` disease reports per location and overall.
+
+    Each window is kept ordered by (reported_at, id) and updated as reports
+    are filed, so a page of recent alerts costs O(limit) instead of a scan
+    and sort over the whole history. `page()` returns None when a request
+    reaches past a window that has been trimmed; the caller then falls
+    back to the indexed SQL query.
+
+    Other processes file reports too. `last_id` is the highest report id
+    read from the database (reports added locally do not move it), so the
+    caller can compare it with the table's max(id) and `catch_up()` on
+    whatever it missed. Inserting a report twice is harmless.
+    """
+
+    ALL = None
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self._windows = {}
+        self._truncated = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.last_id = 0
+
+        self.hits = 0
+        self.fallbacks = 0
+
+    def load(self, reports: list, last_id: int = 0):
+        """Seeds the windows from up to capacity + 1 newest reports per location;
+        `last_id` is the table's max(id) read before `reports` were queried.
+        """
+        with self._lock:
+            self._windows.clear()
+            self._truncated.clear()
+            for report in reports:
+                self._insert(report)
+            self.last_id = last_id
+            self._loaded = True
+
+    def catch_up(self, reports: list):
+        """Adds reports read from the database in id order, after last_id."""
+        with self._lock:
+            for report in reports:
+                self._insert(report)
+                self.last_id = max(self.last_id, report['id'])
+
+    def add(self, report: dict):
+        with self._lock:
+            self._insert(report)
+
+    def _insert(self, report: dict):
+        entry = (report['reported_at'] or '', report['id'], report)
+        for key in (self.ALL, location_key(report['location'])):
+            window = self._windows.setdefault(key, [])
+            i = bisect_left(window, entry[:2])
+            if i < len(window) and window[i][1] == entry[1]:
+                continue  # already added by this process
+            window.insert(i, entry)
+            if len(window) > self.capacity:
+                del window[0]
+                self._truncated.add(key)
+
+    def page(self, location: str = None, limit: int = 10, before: tuple = None):
+        """Returns (reports, has_more) newest first, or None if the caller must query SQL."""
+        key = location_key(location) if location else self.ALL
+        with self._lock:
+            if not self._loaded:
+                self.fallbacks += 1
+                return None
+
+            window = self._windows.get(key, ())
+            # Ids are unique, so entries never compare past (reported_at, id)
+            end = len(window) if before is None else bisect_left(window, tuple(before))
+
+            start = max(0, end - limit)
+            truncated = key in self._truncated
+            if end - start < limit and truncated:
+                self.fallbacks += 1
+                return None
+
+            self.hits += 1
+            reports = [entry[2] for entry in reversed(window[start:end])]
+            return reports, start > 0 or truncated
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "locations": sum(1 for key in self._windows if key is not self.ALL),
+                "capacity": self.capacity,
+                "trimmed": len(self._truncated),
+                "lastId": self.last_id,
+                "hits": self.hits,
+                "fallbacks": self.fallbacks,
+            }
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.responses import Response
+
+# Every 200 and 304 carries the ETag; browsers revalidate on each load
+# instead of reusing a copy that may predate a write
+CACHE_CONTROL = "no-cache"
+
+
+def serialize(content) -> bytes:
+    # Same encoding as starlette's JSONResponse, so cached and uncached bodies match
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class ResponseCache:
+    """Serialized JSON bodies for read-heavy listings, invalidated by version counters.
+
+    Each cached body belongs to a resource ("products", "history:12", ...)
+    whose version is bumped by the write paths. An entry built under an
+    older version is a miss. A write that lands while a body is being
+    built also leaves that entry stale. The TTL bounds how long a process
+    can serve a body after a write made by another worker process.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_s: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.bumps = 0
+
+    def version(self, resource: str) -> int:
+        return self._versions.get(resource, 0)
+
+    def bump(self, *resources: str):
+        with self._lock:
+            for resource in resources:
+                self._versions[resource] = self._versions.get(resource, 0) + 1
+                self.bumps += 1
+
+    def _lookup(self, cache_key, version: int):
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and (entry[0] != version or time.monotonic() - entry[3] > self.ttl):
+                del self._entries[cache_key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return entry
+
+    def _store(self, cache_key, entry):
+        with self._lock:
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def respond(self, request, resource: str, key, build, with_headers: bool = False) -> Response:
+        """Cached JSON response for `build()`, or a 304 if the client already has it.
+
+        With `with_headers`, `build()` returns (content, headers) and the
+        headers are cached and sent along with the body.
+        """
+        cache_key = (resource, key)
+        version = self.version(resource)
+
+        entry = self._lookup(cache_key, version) if self.max_entries > 0 else None
+        if entry is None:
+            content, extra = build() if with_headers else (build(), {})
+            body = serialize(content)
+            digest = hashlib.blake2b(body, digest_size=16)
+            digest.update(serialize(sorted(extra.items())))
+            etag = f'"{digest.hexdigest()}"'
+            entry = (version, body, etag, time.monotonic(), extra)
+            if self.max_entries > 0:
+                self._store(cache_key, entry)
+
+        _, body, etag, _, extra = entry
+        headers = {**extra, "ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "maxEntries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "notModified": self.not_modified,
+            "evictions": self.evictions,
+            "invalidations": self.bumps,
+        }
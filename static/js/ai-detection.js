@@ -35,8 +35,9 @@ var fileSelector = document.getElementById('fileInput');
 var previewContainer = document.getElementById('previewSection');
 var previewImg = document.getElementById('previewImage');
 
-// Store current image data
+// Store current image data (data URL for preview/history, raw blob for upload)
 var selectedImageData = null;
+var selectedImageBlob = null;
 
 // Click to upload
 dropZone.addEventListener('click', function() { 
@@ -73,6 +74,7 @@ fileSelector.addEventListener('change', function(e) {
 
 // Process uploaded image file
 function processImageFile(file) {
+    selectedImageBlob = file;
     var reader = new FileReader();
     
     reader.onload = function(e) {
@@ -163,6 +165,10 @@ function takePhoto() {
     ctx.drawImage(videoFeed, 0, 0);
     
     selectedImageData = captureCanvas.toDataURL('image/jpeg', 0.9);
+    selectedImageBlob = null;
+    captureCanvas.toBlob(function(blob) {
+        selectedImageBlob = blob;
+    }, 'image/jpeg', 0.9);
     previewImg.src = selectedImageData;
     previewContainer.style.display = 'block';
     document.getElementById('resultCard').style.display = 'none';
@@ -172,6 +178,7 @@ function takePhoto() {
 var analyzeButton = document.getElementById('analyzeBtn');
 var loadingScreen = document.getElementById('loadingOverlay');
 var resultsCard = document.getElementById('resultCard');
+var highAccuracyToggle = document.getElementById('highAccuracy');
 
 analyzeButton.addEventListener('click', runAnalysis);
 
@@ -184,60 +191,32 @@ function getCurrentUser() {
     return userData ? JSON.parse(userData) : null;
 }
 
-// Update token display
-async function updateTokenDisplay() {
+// Show a token balance and keep localStorage in step (uses same key as api.js)
+function showTokenBalance(tokens) {
     var user = getCurrentUser();
     var tokenDisplay = document.getElementById('tokenBalance');
     
     if (!user || !tokenDisplay) return;
     
-    try {
-        var response = await fetch('/api/users/' + user.id + '/tokens');
-        if (response.ok) {
-            var data = await response.json();
-            tokenDisplay.textContent = data.tokens;
-            // Update localStorage (uses same key as api.js)
-            user.tokens = data.tokens;
-            localStorage.setItem('currentUser', JSON.stringify(user));
-        }
-    } catch (err) {
-        console.error('Failed to fetch tokens:', err);
-    }
+    tokenDisplay.textContent = tokens;
+    user.tokens = tokens;
+    localStorage.setItem('currentUser', JSON.stringify(user));
 }
 
-// Check if user has tokens before scanning
-async function checkAndUseToken() {
+// Update token display
+async function updateTokenDisplay() {
     var user = getCurrentUser();
     
-    if (!user) {
-        alert('Please login to use the AI detection feature');
-        window.location.href = 'login.html';
-        return false;
-    }
+    if (!user) return;
     
     try {
-        var response = await fetch('/api/users/' + user.id + '/use-token', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' }
-        });
-        
-        if (response.status === 402) {
-            // Insufficient tokens
-            showBuyTokensModal();
-            return false;
-        }
-        
-        if (!response.ok) {
-            throw new Error('Token check failed');
+        var response = await fetch('/api/users/' + user.id + '/tokens');
+        if (response.ok) {
+            var data = await response.json();
+            showTokenBalance(data.tokens);
         }
-        
-        var result = await response.json();
-        updateTokenDisplay();
-        return true;
-        
     } catch (err) {
-        alert('Error: ' + err.message);
-        return false;
+        console.error('Failed to fetch tokens:', err);
     }
 }
 
@@ -313,27 +292,48 @@ async function purchaseTokens(quantity) {
     purchaseTokensDemo();
 }
 
-// Send image to API for analysis
+// Send image to API for analysis; the server spends the token, predicts
+// and saves the scan to history in this one request
 async function runAnalysis() {
     if (!selectedImageData) {
         alert('Please upload or capture an image first');
         return;
     }
     
-    // Check and consume token first
-    var hasToken = await checkAndUseToken();
-    if (!hasToken) {
+    var user = getCurrentUser();
+    if (!user) {
+        alert('Please login to use the AI detection feature');
+        window.location.href = 'login.html';
         return;
     }
     
     loadingScreen.style.display = 'flex';
     
+    // High accuracy also scores the photo tile by tile, in the same request
+    var scanUrl = '/api/users/' + user.id + '/scan' + (highAccuracyToggle.checked ? '?tiled=true' : '');
+    
     try {
-        var response = await fetch('/api/predict', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ image: selectedImageData })
-        });
+        var response;
+        if (selectedImageBlob) {
+            // Send raw image bytes; avoids base64 overhead on slow connections
+            response = await fetch(scanUrl, {
+                method: 'POST',
+                headers: { 'Content-Type': selectedImageBlob.type || 'application/octet-stream' },
+                body: selectedImageBlob
+            });
+        } else {
+            response = await fetch(scanUrl, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ image: selectedImageData })
+            });
+        }
+        
+        if (response.status === 402) {
+            // Insufficient tokens
+            showBuyTokensModal();
+            return;
+        }
         
         if (!response.ok) {
             throw new Error('Analysis request failed');
@@ -341,10 +341,8 @@ async function runAnalysis() {
         
         var analysisResult = await response.json();
         showResults(analysisResult);
-        
-        // Save to detection history
-        saveToHistory(analysisResult);
-        
+        showTokenBalance(analysisResult.remainingTokens);
+    
     } catch (err) {
         alert('Analysis error: ' + err.message);
     } finally {
@@ -352,27 +350,6 @@ async function runAnalysis() {
     }
 }
 
-// Save detection result to history
-async function saveToHistory(result) {
-    var user = getCurrentUser();
-    if (!user) return;
-    
-    try {
-        await fetch('/api/detection-history', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                userId: user.id,
-                image: selectedImageData,
-                prediction: result.prediction,
-                confidence: result.confidence
-            })
-        });
-    } catch (err) {
-        console.error('Failed to save to history:', err);
-    }
-}
-
 // Initialize token display on page load
 document.addEventListener('DOMContentLoaded', function() {
     updateTokenDisplay();
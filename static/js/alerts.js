@@ -3,6 +3,9 @@
 var AlertSystem = (function() {
     
     var apiEndpoint = '/api';
+    var alertsShown = [];
+    var alertsLocation = null;
+    var alertsCursor = null;
     
     // Initialize the alert system
     function init() {
@@ -13,12 +16,15 @@ var AlertSystem = (function() {
     // Register farmer for SMS alerts
     async function registerFarmer(formData) {
         try {
-            // Location is auto-detected, remove from payload
+            // Without coordinates the server places the farm at the detected location
             var payload = {
                 farmerName: formData.farmerName,
                 phoneNumber: formData.phoneNumber,
                 cropTypes: formData.cropTypes,
-                alertRadius: formData.alertRadius
+                alertRadius: formData.alertRadius,
+                email: formData.email || null,
+                latitude: formData.latitude,
+                longitude: formData.longitude
             };
             
             var response = await fetch(apiEndpoint + '/register-alerts', {
@@ -73,25 +79,38 @@ var AlertSystem = (function() {
         }
     }
 
-    // Fetch recent alerts for display
-    async function fetchRecentAlerts(location) {
+    // Fetch recent alerts for display; pass a cursor to append the next (older) page
+    async function fetchRecentAlerts(location, cursor) {
         try {
-            var url = apiEndpoint + '/recent-alerts';
+            var params = new URLSearchParams();
             if (location) {
-                url += '?location=' + encodeURIComponent(location);
+                params.set('location', location);
+            }
+            if (cursor) {
+                params.set('cursor', cursor);
             }
             
-            var response = await fetch(url);
+            var query = params.toString();
+            var response = await fetch(apiEndpoint + '/recent-alerts' + (query ? '?' + query : ''));
             var result = await response.json();
             
             if (result.success) {
-                renderAlertsList(result.alerts);
+                alertsShown = cursor ? alertsShown.concat(result.alerts) : result.alerts;
+                alertsLocation = location || null;
+                alertsCursor = result.nextCursor || null;
+                renderAlertsList(alertsShown);
             }
         } catch (error) {
             console.error('Could not load alerts:', error);
         }
     }
 
+    function fetchOlderAlerts() {
+        if (alertsCursor) {
+            return fetchRecentAlerts(alertsLocation, alertsCursor);
+        }
+    }
+
     // Render alerts in the UI
     function renderAlertsList(alerts) {
         var container = document.querySelector('.recent-alerts');
@@ -113,6 +132,10 @@ var AlertSystem = (function() {
             });
         }
 
+        if (alertsCursor) {
+            html += '<button type="button" class="btn btn-outline" style="width: 100%; margin-top: 10px;" onclick="AlertSystem.fetchOlderAlerts()">Show older reports</button>';
+        }
+
         container.innerHTML = html;
     }
 
@@ -128,7 +151,10 @@ var AlertSystem = (function() {
                     farmerName: document.getElementById('farmerName').value,
                     phoneNumber: document.getElementById('phoneNumber').value,
                     cropTypes: document.getElementById('cropTypes').value,
-                    alertRadius: parseInt(document.getElementById('alertRadius').value)
+                    alertRadius: parseInt(document.getElementById('alertRadius').value),
+                    email: document.getElementById('alertEmail').value.trim(),
+                    latitude: readCoordinate('alertLatitude'),
+                    longitude: readCoordinate('alertLongitude')
                 };
 
                 if (!isValidPhone(data.phoneNumber)) {
@@ -136,6 +162,11 @@ var AlertSystem = (function() {
                     return;
                 }
 
+                if ((data.latitude === null) !== (data.longitude === null)) {
+                    displayNotification('Please enter both latitude and longitude, or neither', 'error');
+                    return;
+                }
+
                 try {
                     await registerFarmer(data);
                     regForm.reset();
@@ -145,6 +176,21 @@ var AlertSystem = (function() {
             });
         }
 
+        // Fill the farm location from the device
+        var locationButton = document.getElementById('useMyLocation');
+        if (locationButton && navigator.geolocation) {
+            locationButton.addEventListener('click', function() {
+                navigator.geolocation.getCurrentPosition(function(position) {
+                    document.getElementById('alertLatitude').value = position.coords.latitude.toFixed(5);
+                    document.getElementById('alertLongitude').value = position.coords.longitude.toFixed(5);
+                }, function() {
+                    displayNotification('Could not get your location - enter it by hand or leave it empty', 'error');
+                });
+            });
+        } else if (locationButton) {
+            locationButton.style.display = 'none';
+        }
+
         // Disease report form
         var reportForm = document.getElementById('diseaseReportForm');
         if (reportForm) {
@@ -172,6 +218,12 @@ var AlertSystem = (function() {
         }
     }
 
+    // Number from a coordinate input, or null when it is empty
+    function readCoordinate(id) {
+        var value = document.getElementById(id).value.trim();
+        return value === '' ? null : parseFloat(value);
+    }
+
     // Validate phone number format
     function isValidPhone(phone) {
         var cleaned = phone.replace(/[-\s]/g, '');
@@ -249,7 +301,8 @@ var AlertSystem = (function() {
         init: init,
         registerFarmer: registerFarmer,
         submitDiseaseReport: submitDiseaseReport,
-        fetchRecentAlerts: fetchRecentAlerts
+        fetchRecentAlerts: fetchRecentAlerts,
+        fetchOlderAlerts: fetchOlderAlerts
     };
     
 })();
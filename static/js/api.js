@@ -70,12 +70,36 @@ var api = {
         return response.json();
     },
 
-    // Get all products in marketplace
+    // Get the first page of marketplace products (newest first)
     getProducts: async function() {
         var response = await fetch(API_BASE + '/products');
         return response.json();
     },
 
+    // Search and filter products one page at a time.
+    // filters: { q, type, min_price, max_price, seller_id, sort, limit }
+    // Returns { products, nextCursor }; pass nextCursor back for the next page
+    searchProducts: async function(filters, cursor) {
+        var params = new URLSearchParams();
+        Object.keys(filters || {}).forEach(function(key) {
+            if (filters[key] !== undefined && filters[key] !== null && filters[key] !== '') {
+                params.set(key, filters[key]);
+            }
+        });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        
+        var response = await fetch(API_BASE + '/products?' + params.toString());
+        if (!response.ok) {
+            throw new Error('Product search failed');
+        }
+        return {
+            products: await response.json(),
+            nextCursor: response.headers.get('X-Next-Cursor')
+        };
+    },
+
     // Get products for specific seller
     getSellerProducts: async function(sellerId) {
         var response = await fetch(API_BASE + '/products/seller/' + sellerId);
@@ -11,6 +11,8 @@ var detailPlaceholder = document.getElementById('detailPlaceholder');
 var detailContent = document.getElementById('detailContent');
 
 var selectedRecordId = null;
+var historyCursor = null;
+window.historyData = [];
 
 // Get current user
 function getCurrentUser() {
@@ -31,8 +33,8 @@ function formatDate(isoString) {
     return date.toLocaleDateString('en-US', options);
 }
 
-// Load detection history
-async function loadHistory() {
+// Load detection history; with `more` set, append the next page
+async function loadHistory(more) {
     var user = getCurrentUser();
     
     if (!user) {
@@ -41,14 +43,19 @@ async function loadHistory() {
     }
     
     try {
-        var response = await fetch('/api/detection-history/' + user.id);
+        var url = '/api/detection-history/' + user.id + '?limit=50';
+        if (more && historyCursor) {
+            url += '&cursor=' + encodeURIComponent(historyCursor);
+        }
+        var response = await fetch(url);
         
         if (!response.ok) {
             throw new Error('Failed to load history');
         }
         
-        var history = await response.json();
-        renderHistory(history);
+        var page = await response.json();
+        historyCursor = response.headers.get('X-Next-Cursor');
+        renderHistory(more === true ? window.historyData.concat(page) : page);
         
     } catch (err) {
         console.error('Error loading history:', err);
@@ -64,7 +71,7 @@ function renderHistory(history) {
     }
     
     emptyState.style.display = 'none';
-    scanCount.textContent = history.length + ' scan' + (history.length !== 1 ? 's' : '');
+    scanCount.textContent = history.length + (historyCursor ? '+' : '') + ' scan' + (history.length !== 1 ? 's' : '');
     
     var html = '';
     history.forEach(function(record) {
@@ -73,7 +80,7 @@ function renderHistory(history) {
         var confidence = Math.round(record.confidence * 100);
         
         html += '<div class="history-item" data-id="' + record.id + '" onclick="selectRecord(' + record.id + ')">' +
-            '<img class="history-item-thumb" src="' + record.image + '" alt="Scan">' +
+            '<img class="history-item-thumb" src="' + (record.thumbnailUrl || record.image) + '" alt="Scan" loading="lazy">' +
             '<div class="history-item-info">' +
                 '<div class="history-item-status ' + statusClass + '">' + statusText + '</div>' +
                 '<div class="history-item-date">' + formatDate(record.timestamp) + '</div>' +
@@ -82,6 +89,10 @@ function renderHistory(history) {
         '</div>';
     });
     
+    if (historyCursor) {
+        html += '<button class="btn btn-outline btn-sm history-more" onclick="loadHistory(true)">Load older scans</button>';
+    }
+    
     historyList.innerHTML = html + emptyState.outerHTML;
     emptyState = document.getElementById('emptyState');
     emptyState.style.display = 'none';
@@ -124,7 +135,7 @@ function selectRecord(recordId) {
     detailContent.style.display = 'flex';
     
     // Populate details
-    document.getElementById('detailImage').src = record.image;
+    document.getElementById('detailImage').src = record.imageUrl || record.image;
     
     var statusEl = document.getElementById('detailStatus');
     var isHealthy = record.prediction === 'healthy';
@@ -164,4 +175,6 @@ async function deleteSelectedRecord() {
 }
 
 // Initialize on page load
-document.addEventListener('DOMContentLoaded', loadHistory);
+document.addEventListener('DOMContentLoaded', function() {
+    loadHistory();
+});
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+
+import database
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class _Shard:
+    __slots__ = ("lock", "counts")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+
+class ViewCounter:
+    """Counts product views in memory and writes them to storage in batches.
+
+    `increment()` only touches one shard's dict. A background thread hands
+    the accumulated deltas to `write(counts)` every `interval_s`, or sooner
+    once `threshold` views are pending. A crash loses at most the views
+    since the last flush. `read()` pairs a stored count with the views not
+    yet written, retrying if a flush moved them in between.
+    """
+
+    def __init__(self, write, shards: int = 16, interval_s: float = 2.0, threshold: int = 1000):
+        self.write = write
+        self.interval_s = interval_s
+        self.threshold = threshold
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+
+        self._pending = 0
+        self._flush_lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._generation = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.flushes = 0
+        self.flushed_views = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+
+    def _shard(self, product_id: int) -> _Shard:
+        return self._shards[hash(product_id) % len(self._shards)]
+
+    def increment(self, product_id: int, count: int = 1):
+        shard = self._shard(product_id)
+        with shard.lock:
+            shard.counts[product_id] = shard.counts.get(product_id, 0) + count
+        # Unlocked on purpose; the threshold is a hint, not an exact bound
+        self._pending += count
+        if self._pending >= self.threshold:
+            self._wake.set()
+
+    def pending(self, product_id: int) -> int:
+        shard = self._shard(product_id)
+        with shard.lock:
+            return shard.counts.get(product_id, 0)
+
+    def read(self, product_id: int, load):
+        """Returns (load(), pending views) as of a moment with no flush in progress."""
+        while True:
+            self._idle.wait()
+            generation = self._generation
+            stored = load()
+            pending = self.pending(product_id)
+            if self._idle.is_set() and self._generation == generation:
+                return stored, pending
+
+    def flush(self):
+        with self._flush_lock:
+            counts = {}
+            self._idle.clear()
+            self._generation += 1
+            try:
+                for shard in self._shards:
+                    with shard.lock:
+                        taken, shard.counts = shard.counts, {}
+                    counts.update(taken)
+                self._pending = 0
+                if not counts:
+                    return
+
+                began = time.perf_counter()
+                try:
+                    self.write(counts)
+                except Exception as err:
+                    # Put the views back so the next flush retries them
+                    self.failed_flushes += 1
+                    logger.error("View count flush failed: %s", err)
+                    for product_id, count in counts.items():
+                        self.increment(product_id, count)
+                    return
+                self.last_flush_ms = (time.perf_counter() - began) * 1000
+                self.flushes += 1
+                self.flushed_views += sum(counts.values())
+            finally:
+                self._generation += 1
+                self._idle.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="view-counter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout_s: float = 5):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            self.flush()
+        database.close_connection()
+
+    def stats(self) -> dict:
+        return {
+            "pendingProducts": sum(len(shard.counts) for shard in self._shards),
+            "pendingViews": self._pending,
+            "shards": len(self._shards),
+            "flushes": self.flushes,
+            "flushedViews": self.flushed_views,
+            "failedFlushes": self.failed_flushes,
+            "lastFlushMs": self.last_flush_ms,
+        }